@@ -0,0 +1,75 @@
+"""
+Benchmark the codecs used to store arrays in the database.
+
+Compares encode and decode throughput and blob size of each codec
+on the raw and label frames of a .npz, .trk, .png, or .tif file.
+
+Usage (from the repository root):
+    python -m benchmarks.compression path/to/file.npz --frames 10
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import timeit
+
+from deepcell_label import compression
+from deepcell_label.loaders import LocalFileSystemLoader
+
+
+CODECS = ['npz', 'raw', 'zlib', 'lz4', 'rle']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', type=str,
+                        help='image file to load raw and label frames from')
+    parser.add_argument('--frames', type=int, default=10,
+                        help='number of frames to encode from each array')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='number of times to encode and decode each frame')
+    return parser.parse_args()
+
+
+def benchmark(frames, codec, repeats):
+    """
+    Encodes and decodes each frame with a codec.
+
+    Returns:
+        tuple: encode MB/s, decode MB/s, and compression ratio
+    """
+    nbytes = sum(frame.nbytes for frame in frames) * repeats
+    start = timeit.default_timer()
+    for _ in range(repeats):
+        blobs = [compression.encode(frame, codec=codec) for frame in frames]
+    encode_time = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    for _ in range(repeats):
+        for blob in blobs:
+            compression.decode(blob)
+    decode_time = timeit.default_timer() - start
+
+    ratio = sum(frame.nbytes for frame in frames) / sum(len(blob) for blob in blobs)
+    return nbytes / encode_time / 1e6, nbytes / decode_time / 1e6, ratio
+
+
+def main():
+    args = parse_args()
+    loader = LocalFileSystemLoader(args.path)
+    arrays = {
+        'raw': loader.raw_array[:args.frames],
+        'label': loader.label_array[:args.frames],
+    }
+    print('{:<6} {:<5} {:>8} {:>14} {:>14} {:>8}'.format(
+        'array', 'codec', 'dtype', 'encode (MB/s)', 'decode (MB/s)', 'ratio'))
+    for name, array in arrays.items():
+        for codec in CODECS:
+            encode_speed, decode_speed, ratio = benchmark(list(array), codec, args.repeats)
+            print('{:<6} {:<5} {:>8} {:>14.1f} {:>14.1f} {:>8.2f}'.format(
+                name, codec, str(array.dtype), encode_speed, decode_speed, ratio))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark rendering raw and label frames as PNGs for the front-end.
+
+Compares imgutils.render_png, which colors integer frames with a colormap lookup table
+and writes palette PNGs, to imgutils.pngify, which normalizes and colors each pixel
+with matplotlib and writes RGBA PNGs, on synthetic frames with the given sizes
+at several PNG compression levels.
+
+Usage (from the repository root):
+    python -m benchmarks.png --sizes 1024 4096 --levels 1 6
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import timeit
+
+import numpy as np
+from PIL import Image
+
+from deepcell_label.imgutils import pngify, render_png
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1024, 4096],
+                        help='height and width of the frames to render')
+    parser.add_argument('--labels', type=int, default=1000,
+                        help='number of labels in the label frames')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 6],
+                        help='PNG compression levels to render with render_png')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='number of times to render each frame')
+    return parser.parse_args()
+
+
+def make_raw(size, seed=0):
+    """Makes a uint16 frame with smooth background and bright spots, like fluorescence images."""
+    rng = np.random.RandomState(seed)
+    y, x = np.mgrid[:size, :size]
+    background = 200 + 100 * np.sin(x / size * np.pi) * np.cos(y / size * np.pi)
+    noise = rng.poisson(20, size=(size, size))
+    spots = rng.randint(0, 2000, size=(size // 16, size // 16)).repeat(16, 0).repeat(16, 1)
+    return (background + noise + spots * (spots > 1800)).astype('uint16')
+
+
+def make_labels(size, num_labels, seed=0):
+    """Makes an int32 frame with square labels on a background of zeros."""
+    rng = np.random.RandomState(seed)
+    labels = np.zeros((size, size), dtype='int32')
+    cell = max(1, size // 64)
+    for label in range(1, num_labels + 1):
+        y, x = rng.randint(0, size - cell, size=2)
+        labels[y:y + cell, x:x + cell] = label
+    return labels
+
+
+def benchmark(function, repeats):
+    """Returns the fastest time to call function over several repeats."""
+    return min(timeit.repeat(function, number=1, repeat=repeats))
+
+
+def same_pixels(png, other):
+    """Whether two PNGs decode to the same pixels."""
+    return np.array_equal(np.array(Image.open(png).convert('RGBA')),
+                          np.array(Image.open(other).convert('RGBA')))
+
+
+def main():
+    args = parse_args()
+    print('{:<6} {:<6} {:<16} {:>10} {:>12} {:>8}'.format(
+        'frame', 'size', 'path', 'time (s)', 'PNG (KB)', 'speedup'))
+    for size in args.sizes:
+        raw = make_raw(size)
+        labels = make_labels(size, args.labels)
+        max_label = int(labels.max())
+        frames = [
+            ('raw', lambda: pngify(raw, 0, None, cmap='cubehelix'),
+             lambda level: render_png(raw, 0, None, cmap='cubehelix', compress_level=level)),
+            ('label', lambda: pngify(np.ma.masked_equal(labels, 0), 0, max_label, cmap='viridis'),
+             lambda level: render_png(labels, 0, max_label, cmap='viridis', mask_value=0,
+                                      compress_level=level)),
+        ]
+        for name, reference, render in frames:
+            expected = reference()
+            reference_time = benchmark(reference, args.repeats)
+            print('{:<6} {:<6} {:<16} {:>10.3f} {:>12.1f} {:>8}'.format(
+                name, size, 'pngify', reference_time, len(expected.getvalue()) / 1024, ''))
+            for level in args.levels:
+                png = render(level)
+                assert same_pixels(png, expected), 'render_png pixels differ from pngify'
+                time = benchmark(lambda: render(level), args.repeats)
+                print('{:<6} {:<6} {:<16} {:>10.3f} {:>12.1f} {:>7.1f}x'.format(
+                    name, size, 'render_png (l{})'.format(level), time,
+                    len(png.getvalue()) / 1024, reference_time / time))
+
+
+if __name__ == '__main__':
+    main()
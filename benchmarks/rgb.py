@@ -0,0 +1,127 @@
+"""
+Benchmark reducing raw frames with up to 6 channels to RGB images for display.
+
+Compares the vectorized whole-stack reduction in imgutils.reduce_to_rgb
+to the per-frame, per-channel reduction it replaced
+on the raw frames of a .npz, .trk, .png, or .tif file.
+Also compares adding each rescaled channel to its RGB channels, as reduce_to_rgb does,
+to mixing all the rescaled channels with one matrix product over the stack.
+
+Usage (from the repository root):
+    python -m benchmarks.rgb path/to/file.npz --frames 10
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import timeit
+
+import numpy as np
+from skimage.exposure import rescale_intensity
+
+from deepcell_label.imgutils import CMY_TO_RGB, reduce_to_rgb, rescale_channels
+from deepcell_label.loaders import LocalFileSystemLoader
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', type=str,
+                        help='image file to load raw frames from')
+    parser.add_argument('--frames', type=int, default=10,
+                        help='number of frames to reduce')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='number of times to reduce the frames')
+    return parser.parse_args()
+
+
+def rescale_95(frame):
+    """Rescales the 5th to 95th percentile of positive values in a channel to uint8."""
+    percentiles = np.percentile(frame[frame > 0], [5, 95])
+    rescaled_frame = rescale_intensity(
+        frame,
+        in_range=(percentiles[0], percentiles[1]),
+        out_range='uint8')
+    return rescaled_frame.astype('uint8')
+
+
+def reduce_frame_to_rgb(frame):
+    """
+    Reduces one frame to RGB one channel at a time.
+    The previous RGBFrame implementation, kept as the reference for reduce_to_rgb.
+    """
+    rescaled = np.zeros(frame.shape, dtype='uint8')
+    for channel in range(min(6, frame.shape[-1])):
+        raw_channel = frame[..., channel]
+        if np.sum(raw_channel) != 0:
+            rescaled[..., channel] = rescale_95(raw_channel)
+
+    # rgb starts as uint16 so it can handle values above 255 without overflow
+    rgb_img = np.zeros((frame.shape[0], frame.shape[1], 3), dtype='uint16')
+    for c in range(min(6, frame.shape[-1])):
+        new_channel = (rescaled[..., c]).astype('uint16')
+        if c < 3:
+            rgb_img[..., c] = new_channel
+        # collapse cyan to G and B
+        if c == 3:
+            rgb_img[..., 1] += new_channel
+            rgb_img[..., 2] += new_channel
+        # collapse magenta to R and B
+        if c == 4:
+            rgb_img[..., 0] += new_channel
+            rgb_img[..., 2] += new_channel
+        # collapse yellow to R and G
+        if c == 5:
+            rgb_img[..., 0] += new_channel
+            rgb_img[..., 1] += new_channel
+        rgb_img[..., 0:3] = np.clip(rgb_img[..., 0:3], a_min=0, a_max=255)
+    return rgb_img.astype('uint8')
+
+
+def reduce_to_rgb_product(stack):
+    """
+    Reduces frames to RGB like reduce_to_rgb,
+    but mixes the channels with one matrix product over the stack.
+    """
+    num_channels = min(6, stack.shape[-1])
+    rescaled = np.empty(stack.shape[:-1] + (num_channels,), dtype=np.uint16)
+    for frame, channel, rescaled_channel in rescale_channels(stack[..., :num_channels]):
+        rescaled[frame, ..., channel] = rescaled_channel
+    rgb = np.matmul(rescaled, CMY_TO_RGB[:num_channels].astype(np.uint16))
+    np.minimum(rgb, 255, out=rgb)
+    return rgb.astype(np.uint8)
+
+
+def benchmark(function, repeats):
+    """Returns the fastest time to call function over several repeats."""
+    return min(timeit.repeat(function, number=1, repeat=repeats))
+
+
+def main():
+    args = parse_args()
+    loader = LocalFileSystemLoader(args.path)
+    raw = loader.raw_array[:args.frames]
+
+    per_frame = np.array([reduce_frame_to_rgb(frame) for frame in raw])
+    whole_stack = reduce_to_rgb(raw)
+    difference = np.abs(per_frame.astype(int) - whole_stack).max()
+    assert np.array_equal(reduce_to_rgb_product(raw), whole_stack), \
+        'matrix product pixels differ from reduce_to_rgb'
+
+    per_frame_time = benchmark(lambda: [reduce_frame_to_rgb(frame) for frame in raw],
+                               args.repeats)
+    whole_stack_time = benchmark(lambda: reduce_to_rgb(raw), args.repeats)
+    product_time = benchmark(lambda: reduce_to_rgb_product(raw), args.repeats)
+    print('raw shape {}, dtype {}'.format(raw.shape, raw.dtype))
+    print('{:<16} {:>10} {:>14}'.format('path', 'time (s)', 'frames/s'))
+    for name, time in [('per-frame', per_frame_time), ('whole-stack', whole_stack_time),
+                       ('matrix product', product_time)]:
+        print('{:<16} {:>10.3f} {:>14.1f}'.format(name, time, len(raw) / time))
+    print('speedup {:.1f}x, max pixel difference {}'.format(
+        per_frame_time / whole_stack_time, difference))
+    print('matrix product takes {:.2f}x the time of whole-stack'.format(
+        product_time / whole_stack_time))
+
+
+if __name__ == '__main__':
+    main()
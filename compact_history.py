@@ -0,0 +1,76 @@
+"""
+Compact the action history of existing projects.
+
+Squashes actions older than the undo depth into checkpoints and deletes
+actions and frame mementos that can no longer be reached by undo or redo.
+Defaults to the HISTORY_UNDO_DEPTH and HISTORY_CHECKPOINT_INTERVAL settings.
+
+Usage:
+    python compact_history.py --undo-depth 100 --checkpoint-interval 50
+    python compact_history.py --token <project token>
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import logging
+
+from flask.logging import default_handler
+
+from deepcell_label import create_app
+from deepcell_label import models
+
+
+def initialize_logger():
+    """Set up logger format and level"""
+    formatter = logging.Formatter(
+        '[%(asctime)s]:[%(levelname)s]:[%(name)s]: %(message)s')
+
+    default_handler.setFormatter(formatter)
+    default_handler.setLevel(logging.DEBUG)
+
+    logger = logging.getLogger()
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(default_handler)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--token', type=str, action='append',
+                        help='project to compact; compacts all unfinished projects if omitted')
+    parser.add_argument('--undo-depth', type=int, default=None,
+                        help='number of most recent actions to keep undoable')
+    parser.add_argument('--checkpoint-interval', type=int, default=None,
+                        help='number of squashed actions per checkpoint')
+    return parser.parse_args()
+
+
+# still creating the application to initialize the database connection
+application = create_app()  # pylint: disable=C0103
+
+
+if __name__ == '__main__':
+    initialize_logger()
+    args = parse_args()
+
+    query = models.db.session.query(models.Project.id)
+    if args.token:
+        query = query.filter(models.Project.token.in_(args.token))
+    else:
+        query = query.filter(models.Project.finished.is_(None))
+    project_ids = [project_id for (project_id,) in query]
+
+    totals = {'checkpoints': 0, 'actions': 0, 'mementos': 0}
+    for project_id in project_ids:
+        project = models.db.session.query(models.Project).get(project_id)
+        stats = project.compact_history(undo_depth=args.undo_depth,
+                                        checkpoint_interval=args.checkpoint_interval)
+        print('project', project.token, stats)
+        for key in totals:
+            totals[key] += stats[key]
+        # Commit each project so a failure does not lose the work on other projects
+        models.db.session.commit()
+        models.db.session.expunge_all()
+
+    print('compacted', len(project_ids), 'projects', totals)
@@ -15,6 +15,7 @@ import flask_monitoringdashboard as dashboard
 from deepcell_label import config
 from deepcell_label.blueprints import bp
 from deepcell_label.models import db
+from deepcell_label.prefetch import prefetcher
 
 
 compress = Compress()  # pylint: disable=C0103
@@ -59,6 +60,7 @@ def create_app(**config_overrides):
 
     compress.init_app(app)
     dropzone.init_app(app)
+    prefetcher.init_app(app)
 
     # For flask monitoring dashboard
     if config.DASHBOARD_CONFIG:
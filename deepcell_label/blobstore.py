@@ -0,0 +1,97 @@
+"""
+Content-addressed storage for immutable arrays on the local filesystem.
+
+Each array is written once as a .npy file named by the SHA-256 hash of its dtype, shape, and bytes,
+so storing the same array again reuses the existing file.
+Arrays are read back as read-only memory maps without copying the file into memory.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+
+class BlobStore(object):
+    """
+    Stores arrays in a directory under keys computed from their contents.
+
+    Args:
+        root (str): directory to store arrays in
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    @staticmethod
+    def key(array):
+        """
+        Computes the key of an array from its contents.
+
+        Args:
+            array (np.array): array to compute the key of
+
+        Returns:
+            str: hex digest of the dtype, shape, and bytes of the array
+        """
+        array = np.ascontiguousarray(array)
+        digest = hashlib.sha256()
+        digest.update('{}{}'.format(array.dtype.str, array.shape).encode())
+        digest.update(array.data)
+        return digest.hexdigest()
+
+    def path(self, key):
+        """Returns the path of the file that stores the array with the key."""
+        # Nest files in subdirectories to avoid very large directories
+        return os.path.join(self.root, key[:2], '{}.npy'.format(key))
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def put(self, array):
+        """
+        Stores an array unless an array with the same contents is already stored.
+
+        Args:
+            array (np.array): array to store
+
+        Returns:
+            str: key to get the array from the store
+        """
+        key = self.key(array)
+        path = self.path(key)
+        if not os.path.exists(path):
+            save(path, array)
+        return key
+
+    def get(self, key):
+        """
+        Gets a stored array.
+
+        Args:
+            key (str): key returned when the array was stored
+
+        Returns:
+            np.memmap: read-only memory map of the array
+        """
+        return np.load(self.path(key), mmap_mode='r')
+
+
+def save(path, array):
+    """
+    Saves an array to a .npy file, creating its directory if needed.
+    Writes to a temporary file and renames it so readers never see a partial file.
+
+    Args:
+        path (str): path of the .npy file
+        array (np.array): array to save
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False) as f:
+        np.save(f, array)
+    os.replace(f.name, path)
@@ -0,0 +1,44 @@
+"""Tests for blobstore.py"""
+
+import numpy as np
+import pytest
+
+from deepcell_label.blobstore import BlobStore
+
+
+def test_put_get(tmpdir):
+    store = BlobStore(str(tmpdir))
+    array = np.random.randint(0, 100, size=(8, 8, 2), dtype='uint16')
+
+    key = store.put(array)
+    stored = store.get(key)
+
+    assert key in store
+    assert isinstance(stored, np.memmap)
+    np.testing.assert_array_equal(stored, array)
+    assert stored.dtype == array.dtype
+    # Stored arrays are immutable
+    with pytest.raises(ValueError):
+        stored[0, 0, 0] = 1
+
+
+def test_put_same_contents(tmpdir):
+    store = BlobStore(str(tmpdir))
+    array = np.zeros((4, 4), dtype='uint8')
+
+    key = store.put(array)
+
+    assert store.put(array.copy()) == key
+    assert len(tmpdir.listdir()) == 1
+    # Same bytes with a different dtype or shape are stored separately
+    assert store.put(array.view('int8')) != key
+    assert store.put(array.reshape(2, 8)) != key
+
+
+def test_get_missing(tmpdir):
+    store = BlobStore(str(tmpdir))
+    key = BlobStore.key(np.zeros(1))
+
+    assert key not in store
+    with pytest.raises(FileNotFoundError):
+        store.get(key)
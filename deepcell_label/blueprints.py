@@ -5,6 +5,7 @@ from __future__ import print_function
 
 import distutils
 import distutils.util
+import hashlib
 import json
 import os
 import re
@@ -23,12 +24,23 @@ from werkzeug.exceptions import HTTPException
 
 from deepcell_label.label import TrackEdit, ZStackEdit, BaseEdit, ChangeDisplay
 from deepcell_label.models import Project
+from deepcell_label.cache import frame_cache, render_cache
+from deepcell_label import compression
 from deepcell_label import loaders
 from deepcell_label import exporters
 from deepcell_label.config import S3_INPUT_BUCKET, S3_OUTPUT_BUCKET
+from deepcell_label.config import HISTORY_CHECKPOINT_INTERVAL, HISTORY_UNDO_DEPTH
+from deepcell_label.config import PNG_COMPRESS_LEVEL
+from deepcell_label.imgutils import colormap_key
+from deepcell_label.prefetch import prefetcher
 
 bp = Blueprint('label', __name__)  # pylint: disable=C0103
 
+# Cache-Control of images that never change, like raw frames
+IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+# Cache-Control of images that change, like label frames, which must be checked before reuse
+REVALIDATE_CACHE_CONTROL = 'private, no-cache'
+
 
 @bp.route('/health')
 def health():
@@ -36,6 +48,16 @@ def health():
     return jsonify({'message': 'success'}), 200
 
 
+@bp.route('/api/cache')
+def cache_stats():
+    """Returns the hit, miss, and eviction counters of the in-process caches."""
+    return jsonify({
+        'frames': frame_cache.stats(),
+        'renders': render_cache.stats(),
+        'prefetch': prefetcher.stats(),
+    }), 200
+
+
 @bp.errorhandler(404)
 def handle_404(error):
     return render_template('404.html'), 404
@@ -83,8 +105,13 @@ def edit(token, action_type):
         return abort(404, description=f'project {token} not found')
     edit = get_edit(project)
     payload = edit.dispatch_action(action_type, info)
-    project.create_memento(action_type)
+    action = project.create_memento(action_type, labels_changed=edit.labels_changed)
     project.update()
+    # Bound the action history every HISTORY_CHECKPOINT_INTERVAL actions
+    if (action is not None and HISTORY_UNDO_DEPTH and
+            project.num_actions % max(HISTORY_CHECKPOINT_INTERVAL, 1) == 0):
+        project.compact_history()
+        project.update()
 
     current_app.logger.debug('Finished action %s for project %s in %s s.',
                              action_type, token,
@@ -115,6 +142,7 @@ def change_display(token, display_attribute, value):
     change = ChangeDisplay(project)
     payload = change.change(display_attribute, value)
     project.update()
+    prefetch_neighbors(project)
 
     current_app.logger.debug('Changed to %s %s for project %s in %s s.',
                              display_attribute, value, token,
@@ -137,21 +165,187 @@ def rgb(token, rgb_value):
 
     rgb = bool(distutils.util.strtobool(rgb_value))
     project.rgb = rgb
-    project.update()
     payload = project.make_payload(x=True)
+    project.update()
     current_app.logger.debug('Set RGB to %s for project %s in %s s.',
                              rgb, token, timeit.default_timer() - start)
     return jsonify(payload)
 
 
+@bp.route('/api/labelarray/<token>/<int:frame>/<int:feature>', methods=['GET'])
+def label_array(token, frame, feature):
+    """
+    Send the outlined labels of a frame as binary data instead of a nested JSON list.
+    The body is an int16 array with negative label outlines encoded by compression.encode:
+    a header with the codec, dtype, and shape, followed by the little-endian array data.
+    The optional encoding URL parameter chooses the codec: 'raw' (default), 'zlib', 'lz4',
+    or 'rle', which sends runs of repeated labels instead of every pixel.
+
+    Args:
+        token (str): base64 ID of project
+        frame (int): index of the label frame
+        feature (int): index of the feature
+
+    Returns:
+        application/octet-stream response with the encoded array
+    """
+    start = timeit.default_timer()
+    encoding = request.args.get('encoding', default='raw')
+    if encoding not in compression.CODECS:
+        return abort(400, description=f'encoding {encoding} not supported')
+
+    project = Project.get(token)
+    if not project:
+        return abort(404, description=f'project {token} not found')
+    label_arr = project._get_label_arr(frame, feature)
+    if label_arr is None:
+        return abort(404, description=f'frame {frame} feature {feature} not found')
+    label_arr = label_arr.astype('<i2')
+    data = compression.encode(label_arr, codec=encoding)
+
+    current_app.logger.debug('Encoded %s label array of frame %s for project %s '
+                             '(%s of %s bytes) in %s s.', encoding, frame, token, len(data),
+                             label_arr.nbytes, timeit.default_timer() - start)
+    return current_app.response_class(data, mimetype='application/octet-stream')
+
+
+@bp.route('/api/image/<token>/raw/<int:frame>/<int:channel>', methods=['GET'])
+def raw_image(token, frame, channel):
+    """
+    Send a channel of a raw frame as a PNG.
+    Raw frames never change, so browsers may cache the PNG indefinitely.
+
+    Args:
+        token (str): base64 ID of project
+        frame (int): index of the raw frame
+        channel (int): index of the channel
+
+    Returns:
+        image/png response
+    """
+    project = Project.get(token)
+    if not project:
+        return abort(404, description=f'project {token} not found')
+    if not (0 <= frame < project.num_frames and 0 <= channel < project.num_channels):
+        return abort(404, description=f'frame {frame} channel {channel} not found')
+    etag = f'raw-{frame}-{channel}-{PNG_COMPRESS_LEVEL}'
+    return _send_png(etag, IMMUTABLE_CACHE_CONTROL,
+                     lambda: project._get_raw_png(frame, channel, rgb=False))
+
+
+@bp.route('/api/image/<token>/rgb/<int:frame>', methods=['GET'])
+def rgb_image(token, frame):
+    """
+    Send a raw frame reduced to RGB as a PNG.
+    Raw frames never change, so browsers may cache the PNG indefinitely.
+
+    Args:
+        token (str): base64 ID of project
+        frame (int): index of the raw frame
+
+    Returns:
+        image/png response
+    """
+    project = Project.get(token)
+    if not project:
+        return abort(404, description=f'project {token} not found')
+    if not 0 <= frame < project.num_frames:
+        return abort(404, description=f'frame {frame} not found')
+
+    def render():
+        png = project._get_raw_png(frame, rgb=True)
+        # Save RGB frames created for the PNG
+        project.update()
+        return png
+
+    etag = f'rgb-{frame}-{PNG_COMPRESS_LEVEL}'
+    return _send_png(etag, IMMUTABLE_CACHE_CONTROL, render)
+
+
+@bp.route('/api/image/<token>/labels/<int:frame>/<int:feature>', methods=['GET'])
+def label_image(token, frame, feature):
+    """
+    Send a feature of a label frame as a PNG.
+    Label frames change with edits, so the ETag changes with the version of the frame
+    and browsers check that their cached PNG is current before using it.
+    Payloads add the version to the URL, so browsers also request edited frames again.
+
+    Args:
+        token (str): base64 ID of project
+        frame (int): index of the label frame
+        feature (int): index of the feature
+
+    Returns:
+        image/png response
+    """
+    project = Project.get(token)
+    if not project:
+        return abort(404, description=f'project {token} not found')
+    label_frame = project.get_label_frame(frame)
+    if label_frame is None or not 0 <= feature < project.num_features:
+        return abort(404, description=f'frame {frame} feature {feature} not found')
+    colormap = hashlib.sha1(repr(colormap_key(project.colormap)).encode()).hexdigest()[:12]
+    etag = f'labels-{frame}-{feature}-{label_frame.version}-{colormap}-{PNG_COMPRESS_LEVEL}'
+    return _send_png(etag, REVALIDATE_CACHE_CONTROL,
+                     lambda: project._get_label_png(frame, feature))
+
+
+def prefetch_neighbors(project):
+    """
+    Renders the frames before and after the displayed frame of a project in the background,
+    with the displayed channel and feature, so changing frames gets PNGs from the render cache.
+    Call after committing the project, as prefetches load the project in their own sessions.
+
+    Args:
+        project (Project): project that displayed a frame
+    """
+    if not prefetcher.enabled:
+        return
+    token, channel, feature, rgb = project.token, project.channel, project.feature, project.rgb
+
+    def render(frame):
+        project = Project.get(token)
+        if project is None or project.finished is not None:
+            return 0
+        raw_png = project._get_raw_png(frame, channel, rgb)
+        label_png = project._get_label_png(frame, feature)
+        return len(raw_png.getvalue()) + len(label_png.getvalue())
+
+    prefetcher.prefetch(token, project.frame, project.num_frames, render)
+
+
+def _send_png(etag, cache_control, render):
+    """
+    Send a PNG with a strong ETag, or 304 Not Modified when the browser has the same PNG.
+
+    Args:
+        etag (str): ETag that changes whenever the PNG changes
+        cache_control (str): Cache-Control header of the response
+        render (function): returns the PNG as a BytesIO
+
+    Returns:
+        image/png response
+    """
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(render().getvalue(), mimetype='image/png')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
 @bp.route('/api/undo/<token>', methods=['POST'])
 def undo(token):
+    """
+    Undo the last action, or the last several actions with the optional steps URL parameter.
+    """
     start = timeit.default_timer()
 
     project = Project.get(token)
     if not project:
         return abort(404, description=f'project {token} not found')
-    payload = project.undo()
+    payload = project.undo(steps=request.args.get('steps', default=1, type=int))
 
     current_app.logger.debug('Undid action for project %s finished in %s s.',
                              token, timeit.default_timer() - start)
@@ -160,18 +354,77 @@ def undo(token):
 
 @bp.route('/api/redo/<token>', methods=['POST'])
 def redo(token):
+    """
+    Redo the next action, or the next several actions with the optional steps URL parameter.
+    """
     start = timeit.default_timer()
 
     project = Project.get(token)
     if not project:
         return abort(404, description=f'project {token} not found')
-    payload = project.redo()
+    payload = project.redo(steps=request.args.get('steps', default=1, type=int))
 
     current_app.logger.debug('Redid action for project %s finished in %s s.',
                              token, timeit.default_timer() - start)
     return jsonify(payload)
 
 
+@bp.route('/api/jump/<token>/<int:action_id>', methods=['POST'])
+def jump(token, action_id):
+    """
+    Undo or redo actions until reaching an action in the project history.
+
+    Args:
+        token (str): base64 ID of project
+        action_id (int): action to jump to
+
+    Returns:
+        dict: contains the changed image data and label tracks
+    """
+    start = timeit.default_timer()
+
+    project = Project.get(token)
+    if not project:
+        return abort(404, description=f'project {token} not found')
+    steps = project.steps_to(action_id)
+    if steps is None:
+        return abort(404, description=f'action {action_id} not reachable in project {token}')
+    if steps < 0:
+        payload = project.undo(steps=-steps)
+    elif steps > 0:
+        payload = project.redo(steps=steps)
+    else:
+        payload = project.make_payload()
+
+    current_app.logger.debug('Jumped %s actions to action %s for project %s in %s s.',
+                             steps, action_id, token, timeit.default_timer() - start)
+    return jsonify(payload)
+
+
+@bp.route('/api/compact/<token>', methods=['POST'])
+def compact(token):
+    """
+    Squash old actions into checkpoints and delete unreachable actions.
+    Optional undo_depth and checkpoint_interval URL parameters override the history policy.
+
+    Returns:
+        json with the number of checkpoints, and deleted actions and mementos
+    """
+    start = timeit.default_timer()
+
+    project = Project.get(token)
+    if not project:
+        return abort(404, description=f'project {token} not found')
+    stats = project.compact_history(
+        undo_depth=request.args.get('undo_depth', type=int),
+        checkpoint_interval=request.args.get('checkpoint_interval', type=int))
+    project.update()
+
+    current_app.logger.debug('Compacted history for project %s in %s s.',
+                             token, timeit.default_timer() - start)
+    return jsonify(stats)
+
+
 @bp.route('/', methods=['GET', 'POST'])
 def form():
     """Request HTML landing page to be rendered."""
@@ -237,8 +490,9 @@ def get_project(token):
     rgb = request.args.get('rgb', default='false', type=str)
     rgb = bool(distutils.util.strtobool(rgb))
     project.rgb = rgb
-    project.update()
     payload = project.make_first_payload()
+    project.update()
+    prefetch_neighbors(project)
     current_app.logger.debug('Loaded project %s in %s s.',
                              project.token, timeit.default_timer() - start)
     return jsonify(payload)
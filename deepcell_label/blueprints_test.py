@@ -7,7 +7,10 @@ import numpy as np
 
 # from flask_sqlalchemy import SQLAlchemy
 
+from deepcell_label import compression
 from deepcell_label import models
+from deepcell_label.cache import render_cache
+from deepcell_label.prefetch import Prefetcher, prefetcher
 from deepcell_label.conftest import DummyLoader
 
 
@@ -29,6 +32,17 @@ def test_health(client):
     assert response.json.get('message') == 'success'
 
 
+def test_cache_stats(client):
+    response = client.get('/api/cache')
+    assert response.status_code == 200
+    for cache in ['frames', 'renders']:
+        stats = response.json[cache]
+        for counter in ['hits', 'misses', 'evictions', 'entries', 'bytes', 'max_bytes']:
+            assert counter in stats
+    for counter in ['rendered', 'skipped', 'cancelled', 'failed']:
+        assert counter in response.json['prefetch']
+
+
 def test_change_display(client):
 
     response = client.post('/api/changedisplay/0/frame/999999')
@@ -43,25 +57,75 @@ def test_change_display(client):
         # TODO: test correctness
         assert 'raw' in response.json['imgs']
         assert 'segmented' in response.json['imgs']
-        assert 'seg_arr' in response.json['imgs']
+        assert 'seg_arr_url' in response.json['imgs']
 
         response = client.post('/api/changedisplay/{}/channel/0'.format(project.token))
         assert 'raw' in response.json['imgs']
         assert 'segmented' not in response.json['imgs']
-        assert 'seg_arr' not in response.json['imgs']
+        assert 'seg_arr_url' not in response.json['imgs']
 
         response = client.post('/api/changedisplay/{}/feature/0'.format(project.token))
         assert 'raw' not in response.json['imgs']
         assert 'segmented' in response.json['imgs']
-        assert 'seg_arr' in response.json['imgs']
+        assert 'seg_arr_url' in response.json['imgs']
 
     # TODO: test handle error
 
 
+def test_change_display_prefetch(client, mocker):
+    mocker.patch.object(Prefetcher, 'enabled', new_callable=mocker.PropertyMock,
+                        return_value=True)
+    prefetch = mocker.patch.object(prefetcher, 'prefetch')
+    project = models.Project.create(DummyLoader(raw=np.zeros((3, 2, 2, 1))))
+
+    response = client.post(f'/api/changedisplay/{project.token}/frame/1')
+    assert response.status_code == 200
+
+    prefetch.assert_called_once()
+    token, frame, num_frames, render = prefetch.call_args[0]
+    assert (token, frame, num_frames) == (project.token, 1, 3)
+    # Rendering a neighbor caches its raw and label PNGs
+    render_cache.clear()
+    assert render(2) > 0
+    assert len(render_cache) == 2
+    project._get_raw_png(2)
+    project._get_label_png(2)
+    assert render_cache.stats()['hits'] == 2
+
+
+def test_rgb(client):
+    response = client.post('/api/rgb/0/true')
+    assert response.status_code == 404
+
+    project = models.Project.create(DummyLoader())
+    response = client.post(f'/api/rgb/{project.token}/true')
+    assert response.status_code == 200
+    assert response.json['imgs']['raw'] == f'/api/image/{project.token}/rgb/0'
+    # RGB frame saved after first display
+    response = client.get(response.json['imgs']['raw'])
+    assert response.status_code == 200
+    assert len(project.rgb_frames) == 1
+
+
 def test_edit(client):
     pass
 
 
+def test_edit_compacts_history(client, mocker):
+    # Compacts after every action when the checkpoint interval is 0
+    mocker.patch('deepcell_label.blueprints.HISTORY_UNDO_DEPTH', 1)
+    mocker.patch('deepcell_label.blueprints.HISTORY_CHECKPOINT_INTERVAL', 0)
+    project = models.Project.create(DummyLoader(labels=np.zeros((1, 4, 4, 1))))
+    compact_history = mocker.spy(models.Project, 'compact_history')
+
+    response = client.post('/api/edit/{}/handle_draw'.format(project.token), data={
+        'trace': '[[1, 1]]', 'target_value': '0', 'brush_value': '1',
+        'brush_size': '1', 'erase': 'false'})
+
+    assert response.status_code == 200
+    assert compact_history.call_count == 1
+
+
 def test_tool(client):
     # test no form redirect
     response = client.get('/tool')
@@ -110,6 +174,88 @@ def test_shortcut(client):
     assert response.status_code == 200
 
 
+def test_raw_image(client):
+    response = client.get('/api/image/0/raw/0/0')
+    assert response.status_code == 404
+
+    project = models.Project.create(DummyLoader())
+    response = client.get(f'/api/image/{project.token}/raw/0/0')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert response.data == project._get_raw_png(0, 0, rgb=False).getvalue()
+    # Raw frames never change
+    assert 'immutable' in response.headers['Cache-Control']
+
+    etag = response.headers['ETag']
+    response = client.get(f'/api/image/{project.token}/raw/0/0',
+                          headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    response = client.get(f'/api/image/{project.token}/raw/0/{project.num_channels}')
+    assert response.status_code == 404
+    response = client.get(f'/api/image/{project.token}/rgb/{project.num_frames}')
+    assert response.status_code == 404
+
+
+def test_label_image(client):
+    response = client.get('/api/image/0/labels/0/0')
+    assert response.status_code == 404
+
+    labels = np.array([[[[1], [0]], [[0], [2]]]])
+    project = models.Project.create(DummyLoader(labels=labels))
+    url = project.make_first_payload()['imgs']['segmented']
+    assert url == f'/api/image/{project.token}/labels/0/0?version=1'
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert response.data == project._get_label_png(0, 0).getvalue()
+    assert 'no-cache' in response.headers['Cache-Control']
+    etag = response.headers['ETag']
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    # Edits change the version in the payload and the ETag
+    response = client.post(f'/api/edit/{project.token}/swap_single_frame',
+                           data={'label_1': 1, 'label_2': 2})
+    assert response.status_code == 200
+    url = response.json['imgs']['segmented']
+    assert url == f'/api/image/{project.token}/labels/0/0?version=2'
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+    response = client.get(f'/api/image/{project.token}/labels/0/{project.num_features}')
+    assert response.status_code == 404
+
+
+def test_label_array(client):
+    response = client.get('/api/labelarray/0/0/0')
+    assert response.status_code == 404
+
+    project = models.Project.create(DummyLoader())
+    expected = project._get_label_arr()
+    url = project._get_label_arr_url()
+
+    for encoding in ('raw', 'zlib', 'lz4', 'rle'):
+        response = client.get(f'{url}?encoding={encoding}')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/octet-stream'
+        np.testing.assert_array_equal(compression.decode(response.data), expected)
+
+    # Defaults to raw
+    response = client.get(url)
+    assert response.status_code == 200
+    np.testing.assert_array_equal(compression.decode(response.data), expected)
+
+    response = client.get(f'{url}?encoding=bad')
+    assert response.status_code == 400
+
+    response = client.get(f'/api/labelarray/{project.token}/{project.num_frames}/0')
+    assert response.status_code == 404
+
+
 def test_undo(client):
     # Project not found
     response = client.post('/api/undo/0')
@@ -136,6 +282,59 @@ def test_redo(client):
     assert response.status_code == 200
 
 
+def test_undo_redo_steps(client):
+    project = models.Project.create(DummyLoader(labels=np.zeros((1, 4, 4, 1))))
+    for value in range(1, 4):
+        project.label_frames[0].frame[0, value] = value
+        project.create_memento('test')
+        project.update()
+
+    response = client.post(f'/api/undo/{project.token}?steps=2')
+    assert response.status_code == 200
+    assert project.action.action_id == 1
+
+    response = client.post(f'/api/redo/{project.token}?steps=2')
+    assert response.status_code == 200
+    assert project.action.action_id == 3
+
+
+def test_jump(client):
+    # Project not found
+    response = client.post('/api/jump/0/0')
+    assert response.status_code == 404
+
+    project = models.Project.create(DummyLoader(labels=np.zeros((1, 4, 4, 1))))
+    project.label_frames[0].frame[0, 0] = 1
+    project.create_memento('test')
+    project.update()
+
+    response = client.post(f'/api/jump/{project.token}/0')
+    assert response.status_code == 200
+    assert project.action.action_id == 0
+    assert response.json['imgs']
+
+    response = client.post(f'/api/jump/{project.token}/1')
+    assert response.status_code == 200
+    assert project.action.action_id == 1
+
+    # Action not found
+    response = client.post(f'/api/jump/{project.token}/2')
+    assert response.status_code == 404
+
+
+def test_compact(client):
+    # Project not found
+    response = client.post('/api/compact/0')
+    assert response.status_code == 404
+
+    # Create a project
+    project = models.Project.create(DummyLoader())
+
+    response = client.post(f'/api/compact/{project.token}?undo_depth=10')
+    assert response.status_code == 200
+    assert response.json == {'checkpoints': 0, 'actions': 0, 'mementos': 0}
+
+
 def test_create_project(client, mocker):
     mocker.patch('deepcell_label.blueprints.loaders.get_loader', lambda *args: DummyLoader())
     response = client.post(f'/api/project')
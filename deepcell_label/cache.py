@@ -0,0 +1,126 @@
+"""
+In-process caches of decoded and rendered frames shared by the requests a worker handles.
+
+Frames are keyed by the version of the frame they hold, like
+('label', project_id, frame_id, version), so writing a frame bumps its version
+and later reads miss the cache instead of getting outdated arrays.
+Rendered PNGs are keyed by the version of the frame and every display setting used to render them.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import threading
+
+import numpy as np
+
+from deepcell_label.config import FRAME_CACHE_SIZE, RENDER_CACHE_SIZE
+
+
+def _sizeof(value):
+    """Returns the size in bytes of an array or bytes."""
+    return value.nbytes if isinstance(value, np.ndarray) else len(value)
+
+
+class FrameCache(object):
+    """
+    Least-recently-used cache of arrays or bytes bounded by their total size in bytes.
+
+    Cached arrays are read-only as they are shared between requests.
+    Callers that edit a cached array must edit a copy.
+
+    Args:
+        max_bytes (int): total size of the cached values; 0 disables the cache
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._arrays = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._arrays)
+
+    def __contains__(self, key):
+        return key in self._arrays
+
+    def get(self, key):
+        """
+        Gets a cached value and marks it as the most recently used.
+
+        Returns:
+            np.array or bytes: the cached value, or None if the key is not cached
+        """
+        with self._lock:
+            array = self._arrays.get(key)
+            if array is None:
+                self.misses += 1
+                return None
+            self._arrays.move_to_end(key)
+            self.hits += 1
+            return array
+
+    def put(self, key, array):
+        """
+        Caches an array or bytes, evicting the least recently used values to stay within
+        max_bytes. Values larger than max_bytes are not cached.
+        """
+        if array is None or not self.max_bytes or _sizeof(array) > self.max_bytes:
+            return
+        if isinstance(array, np.ndarray):
+            array.setflags(write=False)
+        with self._lock:
+            self._pop(key)
+            self._arrays[key] = array
+            self.nbytes += _sizeof(array)
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._arrays.popitem(last=False)
+                self.nbytes -= _sizeof(evicted)
+                self.evictions += 1
+
+    def pop(self, key):
+        """Removes a value from the cache."""
+        with self._lock:
+            self._pop(key)
+
+    def _pop(self, key):
+        array = self._arrays.pop(key, None)
+        if array is not None:
+            self.nbytes -= _sizeof(array)
+
+    def clear(self):
+        """Removes all values from the cache and resets the counters."""
+        with self._lock:
+            self._arrays.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        """
+        Returns:
+            dict: cache counters and size
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._arrays),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+# Decoded raw and label frames
+frame_cache = FrameCache(FRAME_CACHE_SIZE * 1024 * 1024)
+# PNGs of raw and label frames sent to the front-end
+render_cache = FrameCache(RENDER_CACHE_SIZE * 1024 * 1024)
+# Colormap lookup tables used to render PNGs, each at most 256 KB
+lut_cache = FrameCache(16 * 1024 * 1024)
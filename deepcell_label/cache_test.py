@@ -0,0 +1,84 @@
+"""Tests for cache.py"""
+
+import numpy as np
+import pytest
+
+from deepcell_label.cache import FrameCache
+
+
+def test_get_put():
+    cache = FrameCache(1024)
+    array = np.zeros(10, dtype='uint8')
+
+    assert cache.get('a') is None
+    cache.put('a', array)
+
+    assert cache.get('a') is array
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+    assert cache.nbytes == 10
+    # Cached arrays are shared and cannot be edited
+    with pytest.raises(ValueError):
+        array[0] = 1
+
+
+def test_evict_least_recently_used():
+    cache = FrameCache(30)
+    for key in 'abc':
+        cache.put(key, np.zeros(10, dtype='uint8'))
+    cache.get('a')
+
+    cache.put('d', np.zeros(10, dtype='uint8'))
+
+    assert 'b' not in cache
+    for key in 'acd':
+        assert key in cache
+    assert cache.nbytes == 30
+    assert cache.evictions == 1
+
+
+def test_put_replaces_key():
+    cache = FrameCache(30)
+    cache.put('a', np.zeros(10, dtype='uint8'))
+    cache.put('a', np.zeros(20, dtype='uint8'))
+
+    assert len(cache) == 1
+    assert cache.nbytes == 20
+
+
+def test_put_too_large():
+    cache = FrameCache(10)
+    cache.put('a', np.zeros(11, dtype='uint8'))
+    assert 'a' not in cache
+    assert cache.nbytes == 0
+
+    disabled = FrameCache(0)
+    disabled.put('a', np.zeros(0, dtype='uint8'))
+    assert 'a' not in disabled
+
+
+def test_pop_clear():
+    cache = FrameCache(30)
+    cache.put('a', np.zeros(10, dtype='uint8'))
+    cache.put('b', np.zeros(10, dtype='uint8'))
+
+    cache.pop('a')
+    assert 'a' not in cache
+    assert cache.nbytes == 10
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.nbytes == 0
+
+
+def test_cache_bytes():
+    cache = FrameCache(30)
+    cache.put('a', b'0123456789')
+    cache.put('b', np.zeros(10, dtype='uint8'))
+
+    assert cache.get('a') == b'0123456789'
+    assert cache.nbytes == 20
+
+    cache.put('c', b'0' * 15)
+    assert 'b' not in cache
+    assert cache.nbytes == 25
@@ -0,0 +1,133 @@
+"""
+Codecs to store numpy arrays as bytes in the database.
+
+Blobs written by a codec start with a short header that tags the blob format version,
+the codec, and the dtype and shape of the array, so rows written with any codec can be decoded.
+Blobs without the header are .npz files written by np.savez_compressed before codecs existed.
+"""
+import io
+import struct
+import zlib
+
+import lz4.frame
+import numpy as np
+
+
+# Tags the blob format version; the last byte changes when the header layout changes
+MAGIC = b'DCL\x01'
+# Zip file signature at the start of .npz files
+NPZ_MAGIC = b'PK\x03\x04'
+
+
+def _encode_raw(array):
+    return array.tobytes()
+
+
+def _decode_raw(data, dtype):
+    return np.frombuffer(bytearray(data), dtype=dtype)
+
+
+def _encode_zlib(array):
+    return zlib.compress(array.tobytes(), 1)
+
+
+def _decode_zlib(data, dtype):
+    return np.frombuffer(bytearray(zlib.decompress(data)), dtype=dtype)
+
+
+def _encode_lz4(array):
+    return lz4.frame.compress(array.tobytes())
+
+
+def _decode_lz4(data, dtype):
+    return np.frombuffer(bytearray(lz4.frame.decompress(data)), dtype=dtype)
+
+
+def _encode_rle(array):
+    """
+    Run-length encode the flattened array as the number of runs,
+    the value of each run, and the length of each run as uint32.
+    """
+    flat = array.ravel()
+    starts = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    starts = np.concatenate(([0], starts)) if flat.size else starts
+    lengths = np.diff(np.append(starts, flat.size)).astype('<u4')
+    values = flat[starts]
+    return struct.pack('<Q', len(starts)) + values.tobytes() + lengths.tobytes()
+
+
+def _decode_rle(data, dtype):
+    num_runs, = struct.unpack_from('<Q', data)
+    offset = 8
+    values = np.frombuffer(data, dtype=dtype, count=num_runs, offset=offset)
+    offset += values.nbytes
+    lengths = np.frombuffer(data, dtype='<u4', count=num_runs, offset=offset)
+    return np.repeat(values, lengths)
+
+
+# Codec name: (id stored in the blob header, encoder, decoder)
+# Encoders take a contiguous array and decoders return a flat, writable array
+CODECS = {
+    'raw': (1, _encode_raw, _decode_raw),
+    'zlib': (2, _encode_zlib, _decode_zlib),
+    'lz4': (3, _encode_lz4, _decode_lz4),
+    'rle': (4, _encode_rle, _decode_rle),
+}
+DECODERS = {codec_id: decoder for codec_id, _, decoder in CODECS.values()}
+
+
+def encode(array, codec='lz4'):
+    """
+    Encode an array as bytes.
+
+    Args:
+        array (np.array): array to encode
+        codec (str): one of 'npz', 'raw', 'zlib', 'lz4', or 'rle'
+            'npz' writes untagged .npz files readable by older versions of DeepCell Label
+            'rle' stores runs of repeated values, which suits label arrays
+
+    Returns:
+        bytes: encoded array
+    """
+    if codec == 'npz':
+        bytestream = io.BytesIO()
+        np.savez_compressed(bytestream, array=array)
+        return bytestream.getvalue()
+    try:
+        codec_id, encoder, _ = CODECS[codec]
+    except KeyError:
+        raise ValueError('Invalid codec "{}": choose from "npz", {}'.format(
+            codec, ', '.join('"{}"'.format(name) for name in CODECS)))
+    array = np.ascontiguousarray(array)
+    dtype = array.dtype.str.encode()
+    header = MAGIC + struct.pack('<BBB', codec_id, len(dtype), array.ndim) + dtype
+    header += struct.pack('<{}q'.format(array.ndim), *array.shape)
+    return header + encoder(array)
+
+
+def decode(blob):
+    """
+    Decode bytes written by encode or np.savez_compressed.
+
+    Args:
+        blob (bytes): encoded array
+
+    Returns:
+        np.array: decoded array
+    """
+    blob = bytes(blob)
+    if blob[:4] == NPZ_MAGIC:
+        return np.load(io.BytesIO(blob))['array']
+    if blob[:4] != MAGIC:
+        raise ValueError('Unrecognized array blob with header {}'.format(blob[:4]))
+    codec_id, dtype_length, ndim = struct.unpack_from('<BBB', blob, 4)
+    offset = 7
+    dtype = np.dtype(blob[offset:offset + dtype_length].decode())
+    offset += dtype_length
+    shape = struct.unpack_from('<{}q'.format(ndim), blob, offset)
+    offset += 8 * ndim
+    try:
+        decoder = DECODERS[codec_id]
+    except KeyError:
+        raise ValueError('Unrecognized codec id {}'.format(codec_id))
+    return decoder(blob[offset:], dtype).reshape(shape)
@@ -0,0 +1,71 @@
+"""Tests for compression.py"""
+
+import io
+
+import numpy as np
+import pytest
+
+from deepcell_label import compression
+
+
+@pytest.mark.parametrize('codec', ['npz', 'raw', 'zlib', 'lz4', 'rle'])
+@pytest.mark.parametrize('dtype', ['uint8', 'int16', 'int32', 'float64'])
+def test_encode_decode(codec, dtype):
+    array = np.random.randint(0, 100, size=(4, 5, 2)).astype(dtype)
+
+    blob = compression.encode(array, codec=codec)
+    decoded = compression.decode(blob)
+
+    assert decoded.dtype == array.dtype
+    np.testing.assert_array_equal(decoded, array)
+    # Decoded arrays can be edited in place
+    decoded[0, 0, 0] = 1
+
+
+@pytest.mark.parametrize('codec', ['raw', 'zlib', 'lz4', 'rle'])
+def test_encode_tags_codec(codec):
+    blob = compression.encode(np.zeros((2, 2)), codec=codec)
+    codec_id = compression.CODECS[codec][0]
+    assert blob[:4] == compression.MAGIC
+    assert blob[4] == codec_id
+
+
+def test_encode_non_contiguous():
+    array = np.arange(24).reshape((2, 3, 4))[..., 1]
+    decoded = compression.decode(compression.encode(array))
+    np.testing.assert_array_equal(decoded, array)
+
+
+@pytest.mark.parametrize('codec', ['raw', 'rle'])
+def test_encode_empty(codec):
+    array = np.zeros((0, 3), dtype='int32')
+    decoded = compression.decode(compression.encode(array, codec=codec))
+    assert decoded.shape == (0, 3)
+
+
+def test_encode_rle_runs():
+    array = np.zeros((100, 100), dtype='int16')
+    array[10:20, 10:20] = 3
+    array[50:, :] = -1
+    blob = compression.encode(array, codec='rle')
+    # A run of label 3 on each of 10 rows, each after a background run,
+    # then a background run and a run of -1 until the end
+    num_runs = 2 * 10 + 2
+    assert len(blob) < array.nbytes
+    assert len(blob) == blob.index(b'<i2') + 3 + 2 * 8 + 8 + num_runs * (2 + 4)
+    np.testing.assert_array_equal(compression.decode(blob), array)
+
+
+def test_decode_npz():
+    """Test decoding .npz files written before codecs."""
+    array = np.ones((3, 3))
+    bytestream = io.BytesIO()
+    np.savez_compressed(bytestream, array=array)
+    np.testing.assert_array_equal(compression.decode(bytestream.getvalue()), array)
+
+
+def test_invalid_codec():
+    with pytest.raises(ValueError):
+        compression.encode(np.zeros(1), codec='bad')
+    with pytest.raises(ValueError):
+        compression.decode(b'not an array')
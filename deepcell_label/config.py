@@ -23,6 +23,66 @@ SQLALCHEMY_TRACK_MODIFICATIONS = config('SQLALCHEMY_TRACK_MODIFICATIONS',
 SQLALCHEMY_DATABASE_URI = config('SQLALCHEMY_DATABASE_URI',
                                  default='sqlite:////tmp/deepcell_label.db')
 
+# Project creation
+# Number of frames encoded and inserted into the database at a time
+INGEST_BATCH_SIZE = config('INGEST_BATCH_SIZE', cast=int, default=8)
+
+# Label frame storage
+# Label frames are split into square tiles of this size so edits only rewrite the tiles they touch
+# When 0, disables tiling and stores each label frame as a single blob
+LABEL_TILE_SIZE = config('LABEL_TILE_SIZE', cast=int, default=256)
+
+# Action history
+# Every Nth memento of a label frame stores the whole frame in addition to the changed pixels
+# Bounds the number of changes applied to rebuild a past version of a frame
+MEMENTO_KEYFRAME_INTERVAL = config('MEMENTO_KEYFRAME_INTERVAL', cast=int, default=20)
+# Every Nth action stores the whole label metadata in addition to the changed entries
+# Bounds the number of changes applied to rebuild past label metadata
+LABELS_SNAPSHOT_INTERVAL = config('LABELS_SNAPSHOT_INTERVAL', cast=int, default=20)
+
+# Number of most recent actions that can be undone one at a time
+# Older actions are squashed into checkpoints by Project.compact_history
+# When 0, keeps every action
+HISTORY_UNDO_DEPTH = config('HISTORY_UNDO_DEPTH', cast=int, default=0)
+# Number of squashed actions between checkpoints
+# Edits compact the history each time this many actions are made
+# Values below 1 are treated as 1
+HISTORY_CHECKPOINT_INTERVAL = config('HISTORY_CHECKPOINT_INTERVAL', cast=int, default=50)
+# Number of actions deleted per statement when compacting the history
+HISTORY_GC_BATCH_SIZE = config('HISTORY_GC_BATCH_SIZE', cast=int, default=500)
+
+# Codec for arrays stored in the database: 'lz4', 'zlib', 'rle', 'raw', or 'npz'
+# Arrays stored with any codec can still be read after changing the codec
+NPZ_CODEC = config('NPZ_CODEC', default='lz4')
+
+# Raw frame storage
+# Directory to store raw frames in as memory-mapped files instead of in the database
+# When empty, stores raw frames in the database
+RAW_FRAME_STORE = config('RAW_FRAME_STORE', default='')
+
+# Directory to cache the raw array of each project as a memory-mapped .npy file
+# When empty, the raw array is compiled from the raw frames each time it is used
+RAW_STACK_CACHE = config('RAW_STACK_CACHE', default='')
+
+# Size of the in-process cache of decoded raw and label frames, measured in MB
+# When 0, disables the cache
+FRAME_CACHE_SIZE = config('FRAME_CACHE_SIZE', cast=int, default=256)
+
+# Size of the in-process cache of raw and label PNGs sent to the front-end, measured in MB
+# When 0, disables the cache
+RENDER_CACHE_SIZE = config('RENDER_CACHE_SIZE', cast=int, default=64)
+
+# zlib compression level of PNGs sent to the front-end, from 0 (fastest) to 9 (smallest)
+PNG_COMPRESS_LEVEL = config('PNG_COMPRESS_LEVEL', cast=int, default=6)
+
+# Background rendering of the frames before and after the displayed frame into the render cache
+# Number of threads rendering frames; when 0, disables prefetching
+PREFETCH_WORKERS = config('PREFETCH_WORKERS', cast=int, default=2)
+# Number of frames to render on each side of the displayed frame
+PREFETCH_FRAMES = config('PREFETCH_FRAMES', cast=int, default=3)
+# Most PNG data rendered after displaying a frame, measured in MB
+PREFETCH_SIZE = config('PREFETCH_SIZE', cast=int, default=32)
+
 # Flask monitoring dashboard
 # When empty, disables the dashboard
 DASHBOARD_CONFIG = config('DASHBOARD_CONFIG', default='')
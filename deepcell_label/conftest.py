@@ -8,6 +8,7 @@ import pytest
 from pytest_lazyfixture import lazy_fixture
 
 from deepcell_label import create_app  # pylint: disable=C0413
+from deepcell_label.cache import frame_cache, render_cache
 from deepcell_label.models import Project, Action
 from deepcell_label.loaders import Loader
 from deepcell_label.labelmaker import LabelInfoMaker
@@ -38,6 +39,13 @@ class DummyLoader(Loader):
         self.source = source
 
 
+@pytest.fixture(autouse=True)
+def clear_frame_cache():
+    """Keep cached frames from leaking between tests that reuse project ids."""
+    frame_cache.clear()
+    render_cache.clear()
+
+
 @pytest.fixture(scope='session')
 def app():
     """Session-wide test `Flask` application."""
@@ -48,6 +56,8 @@ def app():
     yield create_app(
         TESTING=True,
         SQLALCHEMY_DATABASE_URI=TEST_DATABASE_URI,
+        # Prefetch threads would not see the projects in uncommitted test transactions
+        PREFETCH_WORKERS=0,
     )
 
     os.unlink(TESTDB_PATH)
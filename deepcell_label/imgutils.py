@@ -8,6 +8,25 @@ import numpy as np
 
 from PIL import Image
 
+from deepcell_label.cache import lut_cache
+
+
+# Weights to collapse up to 6 channels (red, green, blue, cyan, magenta, yellow) into RGB
+CMY_TO_RGB = np.array([
+    [1, 0, 0],
+    [0, 1, 0],
+    [0, 0, 1],
+    [0, 1, 1],
+    [1, 0, 1],
+    [1, 1, 0],
+], dtype=np.uint8)
+# Largest value of integer images to rescale with counts of each value and lookup tables
+MAX_COUNTED_VALUE = 2 ** 16 - 1
+# Smallest colormap lookup table; tables grow by powers of two to fit the largest value
+MIN_LUT_SIZE = 256
+# Distance around the colormap between the colors of consecutive labels
+GOLDEN_RATIO_CONJUGATE = (np.sqrt(5) - 1) / 2
+
 
 def pngify(imgarr, vmin, vmax, cmap=None):
     out = io.BytesIO()
@@ -24,6 +43,203 @@ def pngify(imgarr, vmin, vmax, cmap=None):
     return out
 
 
+def colormap_key(cmap):
+    """
+    Identifies a colormap by its name, number of colors,
+    and the colors of masked values and values below and above its range,
+    so copies of a colormap, like colormaps loaded from the database, compare equal.
+
+    Args:
+        cmap (str or matplotlib.colors.Colormap): the colormap
+
+    Returns:
+        tuple: hashable key of the colormap
+    """
+    cmap = plt.get_cmap(cmap)
+    # Masked value, value below the range, and value above the range
+    special = cmap(np.ma.masked_array([0, -1, 2], mask=[True, False, False]))
+    return (cmap.name, cmap.N) + tuple(tuple(color) for color in special)
+
+
+def colormap_lut(cmap, vmin, vmax, size, dtype, mask_value=None):
+    """
+    Computes the RGBA color of each value from 0 to size - 1 like pngify,
+    so integer images can be colored by indexing the table.
+    Tables are cached, so renders with the same colormap and range share a table.
+
+    Args:
+        cmap (str or matplotlib.colors.Colormap): the colormap
+        vmin (int): value mapped to the lowest color
+        vmax (int): value mapped to the highest color
+        size (int): number of values in the table
+        dtype (str): dtype of the images to color, which sets the precision of the colormap
+        mask_value (int): value colored like masked values, or None to color every value
+
+    Returns:
+        np.array: read-only uint8 table with dimensions (size, 4)
+    """
+    key = (colormap_key(cmap), vmin, vmax, size, dtype, mask_value)
+    lut = lut_cache.get(key)
+    if lut is None:
+        values = np.arange(size, dtype=dtype)
+        if mask_value is not None:
+            values = np.ma.masked_equal(values, mask_value)
+        lut = plt.get_cmap(cmap)(Normalize(vmin=vmin, vmax=vmax)(values), bytes=True)
+        lut_cache.put(key, lut)
+    return lut
+
+
+def colormap_palette(cmap, vmin, vmax, size, dtype, mask_value=None):
+    """
+    Splits a colormap lookup table into its distinct colors
+    and the index of the color of each value, to write palette PNGs.
+    Palettes are cached like lookup tables.
+
+    Args:
+        same as colormap_lut
+
+    Returns:
+        tuple: read-only arrays of the palette index of each value
+               and the uint8 RGBA palette with dimensions (colors, 4)
+    """
+    lut = colormap_lut(cmap, vmin, vmax, size, dtype, mask_value)
+    return _split_palette(('colormap', colormap_key(cmap), vmin, vmax, size, dtype, mask_value),
+                          lut)
+
+
+def label_colors(labels, cmap):
+    """
+    Colors labels so each label keeps its color as other labels are created or removed.
+    Labels are spread around the colormap by the golden ratio,
+    so consecutive labels get distant colors.
+    Label 0 (background) gets the colormap's color for masked values.
+
+    Args:
+        labels (np.array): integer labels
+        cmap (str or matplotlib.colors.Colormap): the colormap
+
+    Returns:
+        np.array: uint8 RGBA color of each label, with an extra last dimension
+    """
+    positions = np.ma.masked_equal(labels, 0) * GOLDEN_RATIO_CONJUGATE % 1
+    return plt.get_cmap(cmap)(positions, bytes=True)
+
+
+def label_lut(cmap, size):
+    """
+    Computes the label_colors of labels from 0 to size - 1,
+    so label images can be colored by indexing the table.
+    Tables are cached like colormap lookup tables.
+
+    Args:
+        cmap (str or matplotlib.colors.Colormap): the colormap
+        size (int): number of labels in the table
+
+    Returns:
+        np.array: read-only uint8 table with dimensions (size, 4)
+    """
+    key = ('labels', colormap_key(cmap), size)
+    lut = lut_cache.get(key)
+    if lut is None:
+        lut = label_colors(np.arange(size), cmap)
+        lut_cache.put(key, lut)
+    return lut
+
+
+def _split_palette(key, lut):
+    """Splits a lookup table into the index of each color and the palette of distinct colors."""
+    indices = lut_cache.get(('indices',) + key)
+    palette = lut_cache.get(('palette',) + key)
+    if indices is None or palette is None:
+        palette, indices = np.unique(lut, axis=0, return_inverse=True)
+        indices = indices.astype(np.min_scalar_type(len(palette) - 1))
+        lut_cache.put(('indices',) + key, indices)
+        lut_cache.put(('palette',) + key, palette)
+    return indices, palette
+
+
+def _lookup_image(imgarr, lut, indices, palette):
+    """Colors an image with a lookup table, as a palette image if it has at most 256 colors."""
+    if len(palette) > 256:
+        return Image.fromarray(lut[imgarr])
+    img = Image.fromarray(indices[imgarr].astype(np.uint8, copy=False), mode='P')
+    img.putpalette(palette[:, :3].tobytes())
+    if (palette[:, 3] < 255).any():
+        img.info['transparency'] = palette[:, 3].tobytes()
+    return img
+
+
+def _save_png(img, compress_level):
+    out = io.BytesIO()
+    img.save(out, format='png', compress_level=compress_level)
+    out.seek(0)
+    return out
+
+
+def _lut_size(imgarr):
+    """Number of values in a lookup table for an image, rounded up so tables are reused."""
+    return max(MIN_LUT_SIZE, 1 << int(imgarr.max()).bit_length())
+
+
+def render_png(imgarr, vmin, vmax, cmap=None, mask_value=None, compress_level=6):
+    """
+    Renders an image as a PNG with the same pixels as pngify.
+    Integer images are colored with a lookup table instead of normalizing and coloring each pixel,
+    and saved as palette PNGs when they use at most 256 colors, which are faster to compress.
+    Images with negative, fractional, or very large values are colored like pngify.
+
+    Args:
+        imgarr (np.array): 2D image
+        vmin (int): value mapped to the lowest color, or None for the lowest value in the image
+        vmax (int): value mapped to the highest color, or None for the highest value in the image
+        cmap (str or matplotlib.colors.Colormap): colormap, or None to save the image as is
+        mask_value (int): value colored like masked values, or None to color every value
+        compress_level (int): zlib compression level of the PNG, from 0 (fastest) to 9 (smallest)
+
+    Returns:
+        BytesIO: the PNG
+    """
+    if not cmap:
+        img = Image.fromarray(imgarr)
+    elif _countable(imgarr):
+        vmin = int(imgarr.min()) if vmin is None else vmin
+        vmax = int(imgarr.max()) if vmax is None else vmax
+        size = _lut_size(imgarr)
+        lut = colormap_lut(cmap, vmin, vmax, size, imgarr.dtype.str, mask_value)
+        indices, palette = colormap_palette(cmap, vmin, vmax, size, imgarr.dtype.str, mask_value)
+        img = _lookup_image(imgarr, lut, indices, palette)
+    else:
+        if mask_value is not None:
+            imgarr = np.ma.masked_equal(imgarr, mask_value)
+        img = Image.fromarray(plt.get_cmap(cmap)(Normalize(vmin=vmin, vmax=vmax)(imgarr),
+                                                 bytes=True))
+    return _save_png(img, compress_level)
+
+
+def render_labels_png(labels, cmap, compress_level=6):
+    """
+    Renders a label image as a PNG colored by label_colors,
+    so the colors of labels do not depend on the other labels in the image or project.
+    Images with non-negative labels up to MAX_COUNTED_VALUE are colored with a lookup table.
+
+    Args:
+        labels (np.array): 2D integer labels
+        cmap (str or matplotlib.colors.Colormap): the colormap
+        compress_level (int): zlib compression level of the PNG, from 0 (fastest) to 9 (smallest)
+
+    Returns:
+        BytesIO: the PNG
+    """
+    if _countable(labels):
+        size = _lut_size(labels)
+        lut = label_lut(cmap, size)
+        indices, palette = _split_palette(('labels', colormap_key(cmap), size), lut)
+        img = _lookup_image(labels, lut, indices, palette)
+    else:
+        img = Image.fromarray(label_colors(labels, cmap))
+    return _save_png(img, compress_level)
+
+
 def add_outlines(frame):
     """
     Shows the frame with each label outlined with negative label values.
@@ -41,3 +257,140 @@ def add_outlines(frame):
     boundary_mask = find_boundaries(frame, mode='inner')
     outlined_frame = np.where(boundary_mask == 1, -frame, frame)
     return outlined_frame
+
+
+def _countable(stack):
+    """Whether an image has few enough distinct values to count each value."""
+    return (np.issubdtype(stack.dtype, np.integer) and
+            stack.size > 0 and
+            stack.min() >= 0 and
+            stack.max() <= MAX_COUNTED_VALUE)
+
+
+def positive_percentiles(stack, q):
+    """
+    Computes percentiles of the positive values in each channel of each frame.
+    Images with non-negative integers up to MAX_COUNTED_VALUE
+    count each value instead of sorting the values.
+
+    Args:
+        stack (np.array): frames with dimensions (frames, height, width, channels)
+        q (list): percentiles to compute
+
+    Returns:
+        np.array: percentiles with dimensions (len(q), frames, channels);
+                  NaN for channels without positive values
+    """
+    num_frames, num_channels = stack.shape[0], stack.shape[-1]
+    percentiles = np.full((len(q), num_frames, num_channels), np.nan)
+    counted = _countable(stack)
+    for frame in range(num_frames):
+        for channel in range(num_channels):
+            values = stack[frame, ..., channel]
+            if counted:
+                counts = np.bincount(values.ravel())
+                # Only count positive values
+                counts[0] = 0
+                if counts.sum() > 0:
+                    percentiles[:, frame, channel] = _percentiles_from_counts(counts, q)
+            else:
+                values = values[values > 0]
+                if values.size > 0:
+                    percentiles[:, frame, channel] = np.percentile(values, q)
+    return percentiles
+
+
+def _percentiles_from_counts(counts, q):
+    """
+    Computes percentiles with linear interpolation like np.percentile
+    from the number of times each value occurs.
+
+    Args:
+        counts (np.array): counts[v] is the number of times v occurs
+        q (list): percentiles to compute
+
+    Returns:
+        np.array: percentiles
+    """
+    cumulative = np.cumsum(counts)
+    ranks = np.asarray(q) / 100 * (cumulative[-1] - 1)
+    lower = np.floor(ranks)
+    upper = np.minimum(lower + 1, cumulative[-1] - 1)
+    # The value at each rank is the first value with more values at or below it than the rank
+    lower_values = np.searchsorted(cumulative, lower, side='right')
+    upper_values = np.searchsorted(cumulative, upper, side='right')
+    return lower_values + (ranks - lower) * (upper_values - lower_values)
+
+
+def _rescale(values, low, high):
+    """Linearly maps values from [low, high] to uint8 values, clipping values outside the range."""
+    span = (high - low).astype(np.float32)
+    low = low.astype(np.float32)
+    high = high.astype(np.float32)
+    return ((np.clip(values, low, high) - low) / span * 255).astype(np.uint8)
+
+
+def rescale_channels(stack):
+    """
+    Rescales the 5th to 95th percentile of positive values in each channel
+    of each frame to [0, 255]. Channels with equal percentiles are thresholded at that value.
+
+    Integer images are rescaled with a lookup table for each channel of each frame
+    instead of computing the rescaled value of each pixel.
+
+    Args:
+        stack (np.array): frames with dimensions (frames, height, width, channels)
+
+    Yields:
+        tuple: frame index, channel index, and uint8 rescaled channel
+               with dimensions (height, width)
+    """
+    num_frames, num_channels = stack.shape[0], stack.shape[-1]
+    low, high = positive_percentiles(stack, [5, 95])
+    # Leave channels without positive values black
+    empty = np.isnan(low)
+    low[empty], high[empty] = 0, 1
+    low = np.where(high > low, low, high - 1)
+
+    counted = _countable(stack)
+    if counted:
+        values = np.arange(stack.max() + 1, dtype=np.float32)
+        luts = _rescale(values, low[..., np.newaxis], high[..., np.newaxis])
+        luts[empty] = 0
+    else:
+        rescaled = _rescale(stack,
+                            low[:, np.newaxis, np.newaxis, :],
+                            high[:, np.newaxis, np.newaxis, :])
+        rescaled[np.broadcast_to(empty[:, np.newaxis, np.newaxis, :], rescaled.shape)] = 0
+
+    for frame in range(num_frames):
+        for channel in range(num_channels):
+            if counted:
+                yield frame, channel, luts[frame, channel].take(stack[frame, ..., channel])
+            else:
+                yield frame, channel, rescaled[frame, ..., channel]
+
+
+def reduce_to_rgb(stack):
+    """
+    Reduces frames with up to 6 channels to RGB images for display.
+    Rescales each channel with rescale_channels,
+    then collapses cyan, magenta, and yellow channels into RGB.
+
+    Args:
+        stack (np.array): frames with dimensions (frames, height, width, channels)
+
+    Returns:
+        np.array: uint8 RGB frames with dimensions (frames, height, width, 3)
+    """
+    channels = stack[..., :min(6, stack.shape[-1])]
+    # rgb starts as uint16 so it can handle values above 255 without overflow
+    rgb = np.zeros(stack.shape[:-1] + (3,), dtype=np.uint16)
+    # Adds each channel to the RGB channels it has weights for, which is faster than
+    # a matrix product with CMY_TO_RGB over the stack, as the weights are 0 or 1
+    # and the product multiplies by each weight (see benchmarks/rgb.py)
+    for frame, channel, rescaled in rescale_channels(channels):
+        for rgb_channel in np.flatnonzero(CMY_TO_RGB[channel]):
+            rgb[frame, ..., rgb_channel] += rescaled
+    np.minimum(rgb, 255, out=rgb)
+    return rgb.astype(np.uint8)
@@ -1,11 +1,13 @@
 """Tests for imgutils.py"""
 
+import copy
 import os
 
 from skimage.io import imread
 import numpy as np
 import matplotlib.pyplot as plt
 import pytest
+from PIL import Image
 
 from deepcell_label import imgutils
 from deepcell_label import models
@@ -43,6 +45,122 @@ def test_pngify(tmpdir):
     np.testing.assert_equal(imgarr.shape, loaded_image.shape[:-1])
 
 
+def test_colormap_key():
+    cmap = plt.get_cmap('viridis')
+    assert imgutils.colormap_key(cmap) == imgutils.colormap_key(copy.copy(cmap))
+    assert imgutils.colormap_key(cmap) == imgutils.colormap_key('viridis')
+    assert imgutils.colormap_key(cmap) != imgutils.colormap_key('magma')
+
+    changed = copy.copy(cmap)
+    changed.set_bad('red')
+    assert imgutils.colormap_key(changed) != imgutils.colormap_key(cmap)
+
+
+def rgba(png):
+    """Decodes a PNG as RGBA pixels."""
+    return np.array(Image.open(png).convert('RGBA'))
+
+
+@pytest.mark.parametrize('dtype', ['uint8', 'uint16', 'int32', 'float32'])
+def test_render_png(dtype):
+    imgarr = np.random.randint(0, 300, size=(32, 32)).astype(dtype)
+    imgarr[0, 0] = 0
+    masked = np.ma.masked_equal(imgarr, 0)
+
+    # Same pixels as pngify with a colormap
+    expected = imgutils.pngify(imgarr, 0, None, cmap='cubehelix')
+    out = imgutils.render_png(imgarr, 0, None, cmap='cubehelix')
+    np.testing.assert_array_equal(rgba(out), rgba(expected))
+    expected = imgutils.pngify(masked, 0, 100, cmap='viridis')
+    out = imgutils.render_png(imgarr, 0, 100, cmap='viridis', mask_value=0)
+    np.testing.assert_array_equal(rgba(out), rgba(expected))
+
+
+def test_render_png_palette():
+    imgarr = np.arange(1000, dtype='int32').reshape((10, 100))
+    cmap = copy.copy(plt.get_cmap('viridis'))
+    cmap.set_bad((0, 0, 0, 0))
+
+    out = imgutils.render_png(imgarr, 0, None, cmap=cmap, mask_value=0)
+
+    # Colormaps have at most 256 colors, so integer images are saved with a palette
+    assert Image.open(out).mode == 'P'
+    expected = imgutils.pngify(np.ma.masked_equal(imgarr, 0), 0, None, cmap=cmap)
+    np.testing.assert_array_equal(rgba(out), rgba(expected))
+    assert rgba(out)[0, 0, 3] == 0
+
+
+def test_render_png_no_cmap():
+    imgarr = np.random.randint(0, 255, size=(32, 32, 3), dtype='uint8')
+    expected = imgutils.pngify(imgarr, None, None, cmap=None)
+    out = imgutils.render_png(imgarr, None, None, cmap=None)
+    assert out.getvalue() == expected.getvalue()
+
+
+def test_render_png_compress_level():
+    imgarr = np.tile(np.arange(64, dtype='uint16'), (64, 1))
+    fast = imgutils.render_png(imgarr, 0, None, cmap='viridis', compress_level=0)
+    small = imgutils.render_png(imgarr, 0, None, cmap='viridis', compress_level=9)
+    assert len(small.getvalue()) < len(fast.getvalue())
+    np.testing.assert_array_equal(rgba(fast), rgba(small))
+
+
+def test_colormap_lut():
+    lut = imgutils.colormap_lut('viridis', 0, 10, 256, '<i4', mask_value=0)
+    assert lut.shape == (256, 4)
+    assert lut.dtype == np.uint8
+    cmap = plt.get_cmap('viridis')
+    # Masked value gets the colormap's color for masked values
+    bad = cmap(np.ma.masked_array([0], mask=[True]), bytes=True)[0]
+    np.testing.assert_array_equal(lut[0], bad)
+    np.testing.assert_array_equal(lut[1], cmap(0.1, bytes=True))
+    # Values above vmax get the last color
+    np.testing.assert_array_equal(lut[10], lut[255])
+    # Tables are shared, even by copies of a colormap
+    assert imgutils.colormap_lut(copy.copy(cmap), 0, 10, 256, '<i4', mask_value=0) is lut
+    with pytest.raises(ValueError):
+        lut[0, 0] = 1
+
+
+def test_colormap_palette():
+    lut = imgutils.colormap_lut('viridis', 0, 10, 256, '<i4', mask_value=0)
+    indices, palette = imgutils.colormap_palette('viridis', 0, 10, 256, '<i4', mask_value=0)
+    # Bad color, 10 colors from 1 to 10, and the same color for values above 10
+    assert len(palette) == 11
+    np.testing.assert_array_equal(palette[indices], lut)
+
+
+def test_label_colors():
+    cmap = plt.get_cmap('viridis')
+    colors = imgutils.label_colors(np.array([0, 1, 2, 3]), cmap)
+    assert colors.shape == (4, 4)
+    assert colors.dtype == np.uint8
+
+    # Background gets the colormap's color for masked values
+    bad = cmap(np.ma.masked_array([0], mask=[True]), bytes=True)[0]
+    np.testing.assert_array_equal(colors[0], bad)
+    # Consecutive labels get distinct colors
+    assert len(np.unique(colors, axis=0)) == 4
+    # Labels keep their color when other labels are added
+    np.testing.assert_array_equal(imgutils.label_colors(np.array([3, 100]), cmap)[0], colors[3])
+
+
+@pytest.mark.parametrize('dtype', ['uint16', 'int32', 'int64'])
+def test_render_labels_png(dtype):
+    labels = np.random.randint(0, 1000, size=(32, 32)).astype(dtype)
+    labels[0, 0] = 0
+
+    out = imgutils.render_labels_png(labels, 'viridis')
+
+    np.testing.assert_array_equal(rgba(out), imgutils.label_colors(labels, 'viridis'))
+
+
+def test_render_labels_png_large_labels():
+    labels = np.array([[0, 1], [2 ** 20, 2 ** 30]], dtype='int32')
+    out = imgutils.render_labels_png(labels, 'viridis')
+    np.testing.assert_array_equal(rgba(out), imgutils.label_colors(labels, 'viridis'))
+
+
 def test_add_outlines(db_session):
     db_session.autoflush = False
     labels = np.identity(10)
@@ -58,3 +176,72 @@ def test_add_outlines(db_session):
     outlined = imgutils.add_outlines(label_array)
     assert (outlined[outlined >= 0] == label_array[outlined >= 0]).all()
     assert (outlined[outlined < 0] == -label_array[outlined < 0]).all()
+
+
+@pytest.mark.parametrize('dtype', ['uint8', 'uint16', 'int32', 'float32'])
+def test_positive_percentiles(dtype):
+    stack = np.random.randint(0, 1000, size=(2, 16, 16, 3)).astype(dtype)
+    stack[1, ..., 2] = 0
+
+    percentiles = imgutils.positive_percentiles(stack, [5, 95])
+
+    assert percentiles.shape == (2, 2, 3)
+    for frame in range(2):
+        for channel in range(3):
+            values = stack[frame, ..., channel]
+            values = values[values > 0]
+            if values.size > 0:
+                expected = np.percentile(values, [5, 95])
+                np.testing.assert_allclose(percentiles[:, frame, channel], expected)
+    # No positive values in channel
+    assert np.isnan(percentiles[:, 1, 2]).all()
+
+
+@pytest.mark.parametrize('dtype', ['uint16', 'float32'])
+def test_reduce_to_rgb(dtype):
+    values = np.arange(100).reshape(10, 10)
+    stack = np.zeros((2, 10, 10, 4), dtype=dtype)
+    stack[0, ..., 0] = values
+    stack[0, ..., 3] = values
+    stack[1, ..., 1] = values * 10
+
+    rgb = imgutils.reduce_to_rgb(stack)
+
+    assert rgb.shape == (2, 10, 10, 3)
+    assert rgb.dtype == np.uint8
+    # 5th and 95th percentile of 1 to 99 rescaled to 0 and 255
+    low, high = np.percentile(values[values > 0], [5, 95])
+    assert (rgb[0, ..., 0][values <= low] == 0).all()
+    assert (rgb[0, ..., 0][values >= high] == 255).all()
+    # Cyan added to green and blue
+    np.testing.assert_array_equal(rgb[0, ..., 1], rgb[0, ..., 0])
+    np.testing.assert_array_equal(rgb[0, ..., 2], rgb[0, ..., 0])
+    # Frames rescaled separately
+    np.testing.assert_array_equal(rgb[1, ..., 1], rgb[0, ..., 0])
+    # Channels without positive values stay black
+    assert (rgb[1, ..., 0] == 0).all()
+    assert (rgb[1, ..., 2] == 0).all()
+
+
+def test_rescale_channels():
+    stack = np.zeros((2, 10, 10, 2), dtype='uint16')
+    stack[1, ..., 0] = np.arange(100).reshape(10, 10)
+
+    rescaled = list(imgutils.rescale_channels(stack))
+
+    assert [(frame, channel) for frame, channel, _ in rescaled] == [(0, 0), (0, 1), (1, 0), (1, 1)]
+    for frame, channel, channel_rescaled in rescaled:
+        assert channel_rescaled.shape == (10, 10)
+        assert channel_rescaled.dtype == np.uint8
+        # Only the channel with positive values is not black
+        assert channel_rescaled.any() == ((frame, channel) == (1, 0))
+
+
+def test_reduce_to_rgb_equal_percentiles():
+    mask = np.zeros((1, 10, 10, 1), dtype='uint8')
+    mask[:, :5] = 1
+
+    rgb = imgutils.reduce_to_rgb(mask)
+
+    assert (rgb[0, :5, :, 0] == 255).all()
+    assert (rgb[0, 5:, :, 0] == 0).all()
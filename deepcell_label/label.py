@@ -125,7 +125,7 @@ class BaseEdit(object):
         Returns:
             ndarray: the current label frame
         """
-        return self.project.label_frames[self.frame_id].frame
+        return self.project.get_label_frame(self.frame_id).frame
 
     @property
     def raw_frame(self):
@@ -133,7 +133,7 @@ class BaseEdit(object):
         Returns:
             ndarray: the current raw frame
         """
-        return self.project.raw_frames[self.frame_id].frame
+        return self.project.get_raw_frame(self.frame_id).frame
 
     # Access dynamic display attributes
     @property
@@ -636,7 +636,7 @@ class ZStackEdit(BaseEdit):
         """
         if self.frame_id > 0:
             prev_frame = self.frame_id - 1
-            img = self.project.label_frames[prev_frame].frame[..., self.feature]
+            img = self.project.get_label_frame(prev_frame).frame[..., self.feature]
             next_img = self.frame[..., self.feature]
             updated_img = predict_zstack_cell_ids(img, next_img)
 
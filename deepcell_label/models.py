@@ -3,54 +3,67 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import base64
-import copy
+import collections
 import enum
+import functools
+import io
 import logging
 import os
 import timeit
 from secrets import token_urlsafe
 import pickle
-import io
 
 from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 from matplotlib import pyplot as plt
 import numpy as np
-from skimage.exposure import rescale_intensity
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.mutable import Mutable
-from sqlalchemy.schema import PrimaryKeyConstraint, ForeignKeyConstraint
-from sqlalchemy import types
-
-from deepcell_label.imgutils import pngify, add_outlines
+from sqlalchemy.orm import Session, object_session, reconstructor
+from sqlalchemy.orm.attributes import flag_modified, get_history
+from sqlalchemy.schema import Index, PrimaryKeyConstraint, ForeignKeyConstraint
+from sqlalchemy import event, or_, types
+
+from deepcell_label import compression
+from deepcell_label import blobstore
+from deepcell_label.blobstore import BlobStore
+from deepcell_label.cache import frame_cache, render_cache
+from deepcell_label.config import (HISTORY_CHECKPOINT_INTERVAL, HISTORY_GC_BATCH_SIZE,
+                                   HISTORY_UNDO_DEPTH, INGEST_BATCH_SIZE, LABEL_TILE_SIZE,
+                                   LABELS_SNAPSHOT_INTERVAL, MEMENTO_KEYFRAME_INTERVAL, NPZ_CODEC,
+                                   PNG_COMPRESS_LEVEL, RAW_FRAME_STORE, RAW_STACK_CACHE)
+from deepcell_label.imgutils import (render_png, render_labels_png, add_outlines, colormap_key,
+                                     reduce_to_rgb)
 
 
 logger = logging.getLogger('models.Project')  # pylint: disable=C0103
-# Accessing relationships (like project.label_frames) issues a Query, causing a flush
-# autoflush=False prevents the flush, so we still access the db.session.dirty after the query
+# Queries made while recording an action (like finding previous frame versions)
+# would flush the partly built action; autoflush=False writes actions only when complete
 db = SQLAlchemy(session_options={'autoflush': False})  # pylint: disable=C0103
 
 
 class Npz(types.TypeDecorator):
-    """Marshals a pickles already in the database to npz if not already npz"""
+    """
+    Stores numpy arrays as bytes encoded by a codec from the compression module.
+    Reads arrays stored with any codec, including the .npz files stored before codecs.
+    """
     impl = types.LargeBinary
 
+    def __init__(self, codec=None, *args, **kwargs):
+        super(Npz, self).__init__(*args, **kwargs)
+        # Defaults to the NPZ_CODEC setting
+        self.codec = codec
+
     def process_bind_param(self, value, dialect):
         if value is None:
             return None
-        bytestream = io.BytesIO()
-        np.savez_compressed(bytestream, array=value)
-        bytestream.seek(0)
-        return bytestream.read()
+        return compression.encode(value, codec=self.codec or NPZ_CODEC)
 
     def process_result_value(self, value, dialect):
         if value is None:
             return None
-        bytestream = io.BytesIO(value)
-        bytestream.seek(0)
-        return np.load(bytestream)['array']
+        return compression.decode(value)
 
 
 @compiles(db.PickleType, 'mysql')
@@ -116,10 +129,15 @@ class Project(db.Model):
     feature = db.Column(db.Integer, default=0)
     scale_factor = db.Column(db.Float, default=1)
     colormap = db.Column(db.PickleType)
+    # Hash of the raw array to validate the cached raw stack
+    raw_checksum = db.Column(db.String(64))
 
-    raw_frames = db.relationship('RawFrame', backref='project')
+    # Loading these relationships loads every frame in the project
+    # Use get_raw_frame and get_label_frame to access a single frame
+    raw_frames = db.relationship('RawFrame', backref='project', order_by='RawFrame.frame_id')
     rgb_frames = db.relationship('RGBFrame', backref='project')
     label_frames = db.relationship('LabelFrame', backref='project',
+                                   order_by='LabelFrame.frame_id',
                                    # Delete frames detached by undo/redo
                                    cascade='save-update, merge, delete, delete-orphan')
     labels = db.relationship('Labels', backref='project', uselist=False,
@@ -154,14 +172,11 @@ class Project(db.Model):
         if self.is_track:
             # Track files require a different scale factor
             self.scale_factor = 2
+        if RAW_STACK_CACHE:
+            self.raw_checksum = BlobStore.key(raw)
 
-        # Create frames from raw, RGB, and labeled images
-        self.raw_frames = [RawFrame(i, frame)
-                           for i, frame in enumerate(raw)]
-        self.rgb_frames = [RGBFrame(i, frame)
-                           for i, frame in enumerate(raw)]
-        self.label_frames = [LabelFrame(i, frame)
-                             for i, frame in enumerate(label)]
+        # Raw and label frames are inserted in batches by Project.create
+        # RGB frames are created when first displayed
 
         # Create label metadata
         self.labels = Labels()
@@ -178,8 +193,81 @@ class Project(db.Model):
 
     @property
     def raw_array(self):
-        """Compiles all raw frames into a single numpy array."""
-        return np.array([frame.frame for frame in self.raw_frames])
+        """
+        Compiles all raw frames into a single numpy array.
+        When RAW_STACK_CACHE is set, returns a read-only memory map of the cached raw stack,
+        caching the raw frames first if the cache is missing.
+        """
+        if not RAW_STACK_CACHE:
+            return np.array([frame.frame for frame in self.raw_frames])
+        path = self.raw_stack_path
+        if path is not None and os.path.exists(path):
+            raw = np.load(path, mmap_mode='r')
+            shape = (self.num_frames, self.height, self.width, self.num_channels)
+            if raw.shape == shape:
+                return raw
+            logger.warning('Cached raw stack %s has shape %s instead of %s.',
+                           path, raw.shape, shape)
+        return self.cache_raw_array(np.array([frame.frame for frame in self.raw_frames]))
+
+    @property
+    def raw_stack_path(self):
+        """
+        Path of the cached raw stack, named by the project id and raw checksum.
+        None when the raw stack is not cached.
+        """
+        if not RAW_STACK_CACHE or self.id is None or self.raw_checksum is None:
+            return None
+        return os.path.join(RAW_STACK_CACHE, '{}-{}.npy'.format(self.id, self.raw_checksum))
+
+    def cache_raw_array(self, raw):
+        """
+        Caches the raw array in RAW_STACK_CACHE.
+
+        Args:
+            raw (np.array): raw array of the project
+
+        Returns:
+            np.memmap: read-only memory map of the cached raw array
+        """
+        start = timeit.default_timer()
+        if self.raw_checksum is None:
+            self.raw_checksum = BlobStore.key(raw)
+        path = self.raw_stack_path
+        blobstore.save(path, raw)
+        logger.debug('Cached raw stack for project %s in %ss.',
+                     self.id, timeit.default_timer() - start)
+        return np.load(path, mmap_mode='r')
+
+    @property
+    def _session(self):
+        """The session that loaded the project, so frames are shared with its relationships."""
+        return object_session(self) or db.session
+
+    def get_raw_frame(self, frame_id):
+        """
+        Gets one raw frame without loading the raw_frames relationship.
+
+        Args:
+            frame_id (int): index of the frame in the project
+
+        Returns:
+            RawFrame: row from the RawFrame table, or None if the frame does not exist
+        """
+        return self._session.query(RawFrame).get((self.id, frame_id))
+
+    def get_label_frame(self, frame_id):
+        """
+        Gets one label frame without loading the label_frames relationship.
+        The frame array is loaded and decoded when first accessed.
+
+        Args:
+            frame_id (int): index of the frame in the project
+
+        Returns:
+            LabelFrame: row from the LabelFrame table, or None if the frame does not exist
+        """
+        return self._session.query(LabelFrame).get((self.id, frame_id))
 
     @property
     def is_zstack(self):
@@ -210,6 +298,8 @@ class Project(db.Model):
     def create(loader):
         """
         Create a new project in the Project table.
+        Frames are encoded and inserted in batches of INGEST_BATCH_SIZE frames
+        so only one batch of encoded frames is held in memory at a time.
 
         Args:
             loader (Loader): loads or creates raw_array, label_array, cell_ids, & cell_info
@@ -218,6 +308,7 @@ class Project(db.Model):
             Project: new row in the Project table
         """
         start = timeit.default_timer()
+        timings = collections.OrderedDict()
         new_project = Project(loader)
         # Assign a unique 12 character base64 token to the project
         while True:
@@ -226,13 +317,74 @@ class Project(db.Model):
                 new_project.token = token
                 break
         db.session.add(new_project)
+        db.session.flush()
+        # Action for the initial project state
+        new_project.create_memento('create_project')
+        db.session.flush()
+        timings['init'] = timeit.default_timer() - start
+        new_project._insert_frames(loader.raw_array, loader.label_array, timings)
+        stage_start = timeit.default_timer()
         db.session.commit()
-        new_project.create_memento('create_project', all_frames=True)
-        db.session.commit()
-        logger.debug('Created new project %s (id %s) in %ss.',
-                     new_project.token, new_project.id, timeit.default_timer() - start)
+        timings['commit'] = timeit.default_timer() - stage_start
+        if RAW_STACK_CACHE:
+            stage_start = timeit.default_timer()
+            new_project.cache_raw_array(loader.raw_array)
+            timings['raw stack cache'] = timeit.default_timer() - stage_start
+        logger.debug('Created new project %s (id %s) in %ss (%s).',
+                     new_project.token, new_project.id, timeit.default_timer() - start,
+                     ', '.join('{} {:.3f}s'.format(stage, time) for stage, time in timings.items()))
         return new_project
 
+    def _insert_frames(self, raw, label, timings):
+        """
+        Inserts the raw and label frames of a new project with executemany,
+        one batch of frames at a time.
+        Frames are encoded as each batch is inserted.
+        The initial action stores no frames, as the label frames hold the initial version.
+
+        Args:
+            raw (np.array): raw array with dimensions (frames, height, width, channels)
+            label (np.array): label array with dimensions (frames, height, width, features)
+            timings (dict): seconds spent in each stage, updated in place
+        """
+        raw_store = BlobStore(RAW_FRAME_STORE) if RAW_FRAME_STORE else None
+        tile_size = LABEL_TILE_SIZE or None
+        for batch_start in range(0, self.num_frames, INGEST_BATCH_SIZE):
+            frame_ids = range(batch_start, min(batch_start + INGEST_BATCH_SIZE, self.num_frames))
+
+            stage_start = timeit.default_timer()
+            raw_rows = []
+            for i in frame_ids:
+                row = {'project_id': self.id, 'frame_id': i}
+                if raw_store is not None:
+                    row['frame_key'] = raw_store.put(raw[i])
+                else:
+                    row['frame_blob'] = raw[i]
+                raw_rows.append(row)
+            db.session.bulk_insert_mappings(RawFrame, raw_rows)
+            _add_time(timings, 'raw frames', stage_start)
+
+            stage_start = timeit.default_timer()
+            db.session.bulk_insert_mappings(LabelFrame, [{
+                'project_id': self.id,
+                'frame_id': i,
+                'tile_size': tile_size,
+                'frame_blob': None if tile_size else label[i],
+                # Written once
+                'version': 1,
+            } for i in frame_ids])
+            if tile_size:
+                db.session.bulk_insert_mappings(LabelTile, [{
+                    'project_id': self.id,
+                    'frame_id': i,
+                    'tile_id': tile_id,
+                    'y': y,
+                    'x': x,
+                    'tile': tile,
+                } for i in frame_ids
+                    for tile_id, (y, x, tile) in enumerate(split_tiles(label[i], tile_size))])
+            _add_time(timings, 'label frames', stage_start)
+
     def update(self):
         """
         Commit the project changes from an action.
@@ -262,89 +414,266 @@ class Project(db.Model):
             raw_frame.finish()
         for rgb_frame in self.rgb_frames:
             rgb_frame.finish()
+        if self.raw_stack_path is not None and os.path.exists(self.raw_stack_path):
+            os.remove(self.raw_stack_path)
         self.finished = db.func.current_timestamp()
         db.session.commit()
         logger.debug('Finished project %s in %ss.',
                      self.id, timeit.default_timer() - start)
 
-    def create_memento(self, action_name, all_frames=False, session=None):
+    def create_memento(self, action_name, all_frames=False, labels_changed=True, session=None):
         """
         Saves the project state.
+        Skips actions that changed no label frames and no label metadata.
+
+        Args:
+            action_name (str): name of the action
+            all_frames (bool): whether to save every label frame as a keyframe
+            labels_changed (bool): whether the action changed the label metadata
+
+        Returns:
+            Action: the new action, or None if the project did not change
         """
         session = session or db.session
+        edited_frames = session.info.get('edited_frames', {}).pop(self.id, {})
+        if all_frames:
+            frames = self.label_frames
+        else:
+            frames = [edited_frames[frame_id] for frame_id in sorted(edited_frames)]
+        if not frames and not labels_changed:
+            return None
         # Create action and store project state inside
         action = Action(self, action_name=action_name)
-        for frame in self.label_frames:
-            if frame in session.dirty or all_frames:
-                session.add(FrameMemento(action=action, frame=frame))
-        action.labels = self.labels
+        action.frame_id = frames[0].frame_id if frames else self.frame
+        for frame in frames:
+            session.add(FrameMemento(action=action, frame=frame, keyframe=all_frames))
+        if labels_changed or all_frames:
+            action.record_labels(self.labels, snapshot=all_frames)
+        else:
+            action.labels_delta = {'cell_ids': {}, 'cell_info': {}}
         if self.action is not None:
             self.action.next_action = action
         # Move the Project to the new action
         self.action = action
         self.num_actions += 1
+        return action
+
+    def compact_history(self, undo_depth=None, checkpoint_interval=None):
+        """
+        Bounds the action history of the project.
+        Keeps the last undo_depth actions and the actions that can be redone.
+        Older actions are squashed into checkpoints every checkpoint_interval actions,
+        so undoing past the last undo_depth actions jumps between checkpoints.
+        The checkpoints are the first actions in the lineage in each block of
+        checkpoint_interval action ids, so compacting again keeps the same checkpoints
+        and only squashes the actions that aged out since.
+        Deletes squashed actions and actions that can no longer be redone,
+        with their mementos, in batches of HISTORY_GC_BATCH_SIZE actions.
+
+        Args:
+            undo_depth (int): number of actions to keep; defaults to HISTORY_UNDO_DEPTH
+                              when 0, squashes no actions
+            checkpoint_interval (int): number of actions per checkpoint;
+                                       defaults to HISTORY_CHECKPOINT_INTERVAL
 
-    def undo(self):
+        Returns:
+            dict: number of checkpoints that squashed actions, and actions and mementos deleted
+        """
+        start = timeit.default_timer()
+        undo_depth = HISTORY_UNDO_DEPTH if undo_depth is None else undo_depth
+        if checkpoint_interval is None:
+            checkpoint_interval = HISTORY_CHECKPOINT_INTERVAL
+        session = self._session
+        session.flush()
+        actions = {action.action_id: action
+                   for action in session.query(Action).filter_by(project_id=self.id)}
+        # Actions from the project creation to the current action
+        lineage = []
+        action_id = self.action_id
+        while action_id is not None:
+            lineage.append(actions[action_id])
+            action_id = actions[action_id].prev_action_id
+        lineage.reverse()
+        # Actions that can be redone
+        redo_ids = set()
+        action_id = self.action.next_action_id
+        while action_id in actions and action_id not in redo_ids:
+            redo_ids.add(action_id)
+            action_id = actions[action_id].next_action_id
+
+        # Squash actions older than the undo depth into checkpoints
+        num_old = max(len(lineage) - undo_depth, 0) if undo_depth else 0
+        checkpoint_interval = max(checkpoint_interval, 1)
+        checkpoints = [i for i in range(num_old)
+                       if i == 0 or (lineage[i].action_id // checkpoint_interval >
+                                     lineage[i - 1].action_id // checkpoint_interval)]
+        num_squashed = 0
+        for previous, checkpoint in zip(checkpoints, checkpoints[1:]):
+            if checkpoint - previous > 1:
+                num_squashed += 1
+                lineage[checkpoint].squash(lineage[previous + 1:checkpoint + 1])
+                # Take the squashed actions out of the lineage
+                # so rebuilding later versions skips their changes
+                for action in lineage[previous + 1:checkpoint]:
+                    action.done = False
+                session.flush()
+            lineage[checkpoint].prev_action = lineage[previous]
+            lineage[previous].next_action = lineage[checkpoint]
+        session.flush()
+
+        # Old actions after the last checkpoint wait for the next checkpoint
+        first_kept = checkpoints[-1] if checkpoints else 0
+        kept_ids = ({lineage[i].action_id for i in checkpoints} |
+                    {action.action_id for action in lineage[first_kept:]} | redo_ids)
+        deleted_ids = sorted(set(actions) - kept_ids)
+        num_mementos = 0
+        for batch_start in range(0, len(deleted_ids), HISTORY_GC_BATCH_SIZE):
+            batch = deleted_ids[batch_start:batch_start + HISTORY_GC_BATCH_SIZE]
+            num_mementos += _delete_actions(session, self.id, batch)
+        # Forget the deleted rows
+        deleted = set(deleted_ids)
+        for obj in list(session.identity_map.values()):
+            if (isinstance(obj, (Action, FrameMemento)) and
+                    obj.project_id == self.id and obj.action_id in deleted):
+                session.expunge(obj)
+        stats = {
+            'checkpoints': num_squashed,
+            'actions': len(deleted_ids),
+            'mementos': num_mementos,
+        }
+        logger.debug('Compacted history of project %s in %ss: %s.',
+                     self.id, timeit.default_timer() - start, stats)
+        return stats
+
+    def undo(self, steps=1):
         """
-        Restores the project to before the current action.
+        Restores the project to before the current action,
+        or to before the last several actions.
+
+        Args:
+            steps (int): number of actions to undo
 
         Returns:
             dict: payload to send to frontend
         """
         start = timeit.default_timer()
+        actions = []
         action = self.action
-        if self.action.prev_action is None:
+        while action.prev_action is not None and len(actions) < steps:
+            actions.append(action)
+            action = action.prev_action
+        if not actions:
             return
-        # Restore edited label frames
-        for prev_frame in action.before_frames:
-            frame_id = prev_frame.frame_id
-            frame = prev_frame.frame_array
-            self.label_frames[frame_id].frame = frame
-        # Restore edited label info
-        if action.before_labels is not None:
-            self.labels.cell_ids = action.before_labels.cell_ids
-            self.labels.cell_info = action.before_labels.cell_info
-
-        payload = self.make_payload(y=action.y_changed,
-                                    labels=action.labels_changed)
-        action.done = False
-        self.action = action.prev_action
-
-        db.session.commit()
-        logger.debug('Undo action %s project %s in %ss.',
-                     action.action_id, self.id, timeit.default_timer() - start)
+        payload = self._apply_actions(actions, undo=True)
+        logger.debug('Undo %s actions to action %s project %s in %ss.',
+                     len(actions), self.action_id, self.id, timeit.default_timer() - start)
         return payload
 
-    def redo(self):
+    def redo(self, steps=1):
         """
-        Restore the project to after the next action.
+        Restore the project to after the next action,
+        or to after the next several actions.
+
+        Args:
+            steps (int): number of actions to redo
 
         Returns:
             dict: payload to send to frontend
         """
         start = timeit.default_timer()
-        if self.action.next_action is None:
+        actions = []
+        action = self.action
+        while action.next_action is not None and len(actions) < steps:
+            action = action.next_action
+            actions.append(action)
+        if not actions:
             return
-        next_action = self.action.next_action
+        payload = self._apply_actions(actions, undo=False)
+        logger.debug('Redo %s actions to action %s project %s in %ss.',
+                     len(actions), self.action_id, self.id, timeit.default_timer() - start)
+        return payload
 
-        # Restore edited label frames
-        for after_frame in next_action.after_frames:
-            frame_id = after_frame.frame_id
-            frame = after_frame.frame_array
-            self.label_frames[frame_id].frame = frame
-        # Restore edited label info
-        if next_action.after_labels is not None:
-            self.labels.cell_ids = next_action.after_labels.cell_ids
-            self.labels.cell_info = next_action.after_labels.cell_info
+    def steps_to(self, action_id):
+        """
+        Counts the actions to undo or redo to reach an action.
+
+        Args:
+            action_id (int): action to reach
+
+        Returns:
+            int: number of actions to redo, negative for actions to undo,
+                 or None if the action can not be reached by undoing or redoing
+        """
+        session = self._session
+        target = session.query(Action).get((self.id, action_id))
+        if target is None:
+            return None
+        if target.done:
+            # Done actions are the lineage of the current action, in order of their ids
+            return -(session.query(Action)
+                     .filter(Action.project_id == self.id,
+                             Action.done,
+                             Action.action_id > action_id)
+                     .count())
+        steps = 0
+        action = self.action
+        while action.next_action is not None:
+            action = action.next_action
+            steps += 1
+            if action is target:
+                return steps
+        return None
+
+    def _apply_actions(self, actions, undo):
+        """
+        Undoes or redoes consecutive actions at once.
+        Writes each edited label frame once and commits once.
+
+        Args:
+            actions (list): actions to undo from the newest,
+                            or actions to redo from the oldest
+            undo (bool): whether to undo instead of redo the actions
 
-        payload = self.make_payload(y=next_action.y_changed,
-                                    labels=next_action.labels_changed)
-        self.action = self.action.next_action
-        next_action.done = True
+        Returns:
+            dict: payload to send to frontend
+        """
+        # Restore edited label frames
+        frames = {}
+        for action in actions:
+            for memento in action.after_frames:
+                label_frame, frame = frames.get(memento.frame_id, (memento.frame, None))
+                if frame is None:
+                    frame = label_frame.frame
+                frame = memento.revert(frame) if undo else memento.replay(frame)
+                frames[memento.frame_id] = (label_frame, frame)
+        for label_frame, frame in frames.values():
+            label_frame.frame = frame
+
+        for action in actions:
+            action.done = not undo
+        self.action = actions[-1].prev_action if undo else actions[-1]
 
+        # Restore edited label info
+        labels_changed = any(action.labels_changed for action in actions)
+        changed_labels = None
+        if labels_changed:
+            deltas = [action.labels_delta for action in (actions[::-1] if undo else actions)]
+            if any(delta is None for delta in deltas):
+                # Actions recorded before labels_delta existed only stored the whole metadata,
+                # as pickled Labels rows, so rebuild the label info from the snapshots instead
+                self._session.flush()
+                cell_info = self.labels.cell_info
+                self.labels.restore(self.action.after_labels)
+                changed_labels = _changed_labels(cell_info, self.labels.cell_info)
+            else:
+                delta = _merge_labels_deltas(deltas)
+                self.labels.apply(delta, undo=undo)
+                changed_labels = {feature: set(changes)
+                                  for feature, changes in delta['cell_info'].items()}
+
+        payload = self.make_payload(y=bool(frames), labels=labels_changed,
+                                    changed_labels=changed_labels)
         db.session.commit()
-        logger.debug('Redo action %s project %s in %ss.',
-                     next_action.action_id, self.id, timeit.default_timer() - start)
         return payload
 
     def get_max_label(self):
@@ -374,11 +703,9 @@ class Project(db.Model):
         payload = {}
 
         img_payload = {}
-        raw_png = self._get_raw_png()
-        img_payload['raw'] = f'data:image/png;base64,{encode(raw_png)}'
-        label_png = self._get_label_png()
-        img_payload['segmented'] = f'data:image/png;base64,{encode(label_png)}'
-        img_payload['seg_arr'] = self._get_label_arr()
+        img_payload['raw'] = self._get_raw_png_url()
+        img_payload['segmented'] = self._get_label_png_url()
+        img_payload['seg_arr_url'] = self._get_label_arr_url()
         payload['imgs'] = img_payload
 
         payload['tracks'] = self.labels.readable_tracks
@@ -397,23 +724,49 @@ class Project(db.Model):
             payload['feature'] = self.feature
             payload['numFeatures'] = self.num_features
 
-        # First frame edited by each action
-        # Excludes the first action, which loads the project
-        payload['actionFrames'] = [action.frames[0].frame_id
-                                   for action in self.actions[1:] if action.done]
+        payload['actionFrames'] = self.action_frames()
 
         return payload
 
-    def make_payload(self, x=False, y=False, labels=False):
+    def action_frames(self):
+        """
+        Finds the frame of each action in the lineage of the project,
+        excluding the first action, which creates the project.
+
+        Returns:
+            list: frame of each action, in the order of the actions
+        """
+        session = self._session
+        actions = (session.query(Action.action_id, Action.frame_id)
+                   .filter(Action.project_id == self.id,
+                           Action.done,
+                           Action.prev_action_id.isnot(None))
+                   .order_by(Action.action_id)
+                   .all())
+        frames = {action_id: frame_id for action_id, frame_id in actions}
+        # Actions recorded before actions stored their frame
+        missing = [action_id for action_id, frame_id in actions if frame_id is None]
+        if missing:
+            frames.update(session.query(FrameMemento.action_id, db.func.min(FrameMemento.frame_id))
+                          .filter(FrameMemento.project_id == self.id,
+                                  FrameMemento.action_id.in_(missing))
+                          .group_by(FrameMemento.action_id))
+        return [self.frame if frames[action_id] is None else frames[action_id]
+                for action_id, _ in actions]
+
+    def make_payload(self, x=False, y=False, labels=False, changed_labels=None):
         """
         Creates a payload to send to the front-end after completing an action.
 
         Args:
-            x (bool): when True, payload includes raw image PNG
+            x (bool): when True, payload includes the URL of the raw image PNG
             y (bool): when True, payload includes labeled image data
-                           sends both a PNG and an array of where each label is
-            labels (bool): when True, payload includes the label "tracks",
-                           or the frames that each label appears in (e.g. [0-10, 15-20])
+                           sends the URLs of a PNG and of an array of where each label is
+            labels (bool): when True, payload includes the "changedTracks" of the changed labels,
+                           or the frames that each label appears in (e.g. [0-10, 15-20]),
+                           or all the label "tracks" if the changed labels are unknown
+            changed_labels (dict): set of changed labels by feature;
+                                   defaults to the labels changed since the metadata was saved
 
         Returns:
             dict: payload with image data and label tracks
@@ -421,68 +774,172 @@ class Project(db.Model):
         if x or y:
             img_payload = {}
             if x:
-                raw_png = self._get_raw_png()
-                img_payload['raw'] = f'data:image/png;base64,{encode(raw_png)}'
+                img_payload['raw'] = self._get_raw_png_url()
             if y:
-                label_png = self._get_label_png()
-                img_payload['segmented'] = f'data:image/png;base64,{encode(label_png)}'
-                img_payload['seg_arr'] = self._get_label_arr()
+                img_payload['segmented'] = self._get_label_png_url()
+                img_payload['seg_arr_url'] = self._get_label_arr_url()
         else:
             img_payload = False
 
+        tracks = False
+        changed_tracks = False
         if labels:
-            tracks = self.labels.readable_tracks
-        else:
-            tracks = False
+            changed_tracks = self.labels.readable_changes(changed_labels)
+            if changed_tracks is None:
+                tracks = self.labels.readable_tracks
+                changed_tracks = False
+
+        return {'imgs': img_payload, 'tracks': tracks, 'changedTracks': changed_tracks}
+
+    def _get_label_arr(self, frame=None, feature=None):
+        """
+        Args:
+            frame (int): label frame to outline; defaults to the current frame
+            feature (int): feature to outline; defaults to the current feature
 
-        return {'imgs': img_payload, 'tracks': tracks}
+        Returns:
+            np.array: int16 labels at each position, with negative label outlines,
+                      or None if the frame or feature does not exist
+        """
+        frame = self.frame if frame is None else frame
+        feature = self.feature if feature is None else feature
+        label_frame = self.get_label_frame(frame)
+        if label_frame is None or not 0 <= feature < self.num_features:
+            return None
+        label_arr = label_frame.frame[..., feature]
+        return add_outlines(label_arr)
 
-    def _get_label_arr(self):
+    def _get_label_arr_url(self):
         """
         Returns:
-            list: nested list of labels at each positions, with negative label outlines.
+            str: URL of the outlined label array of the current frame and feature
         """
-        # Create label array
-        label_frame = self.label_frames[self.frame]
-        label_arr = label_frame.frame[..., self.feature]
-        return add_outlines(label_arr).tolist()
+        return f'/api/labelarray/{self.token}/{self.frame}/{self.feature}'
 
-    def _get_label_png(self):
+    def _get_label_png(self, frame=None, feature=None):
+        """
+        Args:
+            frame (int): index of the label frame; defaults to the current frame
+            feature (int): index of the feature; defaults to the current feature
+
+        Returns:
+            BytesIO: the label frame as a .png, or None if the frame or feature does not exist
+        """
+        frame = self.frame if frame is None else frame
+        feature = self.feature if feature is None else feature
+        label_frame = self.get_label_frame(frame)
+        if label_frame is None or not 0 <= feature < self.num_features:
+            return None
+        key = None
+        # Frames edited in this transaction may be rolled back and their version reused
+        written_frames = self._session.info.get('written_frames', ())
+        if (not label_frame.frame_changed and
+                ('label', self.id, frame, label_frame.version) not in written_frames):
+            # Label colors do not depend on other labels,
+            # so the PNG stays valid until the frame changes
+            key = ('label', self.id, frame, label_frame.version,
+                   feature, colormap_key(self.colormap))
+
+        def render():
+            return render_labels_png(label_frame.frame[..., feature],
+                                     cmap=self.colormap,
+                                     compress_level=PNG_COMPRESS_LEVEL)
+
+        return _get_cached_png(key, render)
+
+    def _get_label_png_url(self):
         """
         Returns:
-            BytesIO: returns the current label frame as a .png
+            str: URL of the current label frame and feature as a .png,
+                 with the version of the frame so browsers reload edited frames
+        """
+        version = self.get_label_frame(self.frame).next_version
+        return f'/api/image/{self.token}/labels/{self.frame}/{self.feature}?version={version}'
+
+    def _get_rgb_frame(self, frame=None):
         """
-        # Create label png
-        label_frame = self.label_frames[self.frame]
-        label_arr = label_frame.frame[..., self.feature]
-        label_png = pngify(imgarr=np.ma.masked_equal(label_arr, 0),
-                           vmin=0,
-                           vmax=self.get_max_label(),
-                           cmap=self.colormap)
-        return label_png
+        Returns the RGB frame for a frame,
+        creating it from the raw frame if it has not been displayed before.
+        The new RGB frame is saved with the next commit.
+
+        Args:
+            frame (int): index of the frame; defaults to the current frame
 
-    def _get_raw_png(self):
+        Returns:
+            RGBFrame: the RGB frame
+        """
+        frame = self.frame if frame is None else frame
+        rgb_frame = self._session.query(RGBFrame).get((self.id, frame))
+        if rgb_frame is None:
+            start = timeit.default_timer()
+            rgb_frame = RGBFrame(frame, self.get_raw_frame(frame).frame)
+            rgb_frame.project = self
+            logger.debug('Created RGB frame %s for project %s in %ss.',
+                         frame, self.id, timeit.default_timer() - start)
+        return rgb_frame
+
+    def _get_raw_png(self, frame=None, channel=None, rgb=None):
         """
+        Args:
+            frame (int): index of the raw frame; defaults to the current frame
+            channel (int): index of the channel; defaults to the current channel
+            rgb (bool): whether to send all channels as RGB; defaults to the current setting
+
         Returns:
-            BytesIO: contains the current raw frame as a .png
+            BytesIO: contains the raw frame as a .png
         """
+        frame = self.frame if frame is None else frame
+        channel = self.channel if channel is None else channel
+        rgb = self.rgb if rgb is None else rgb
+        # Raw frames never change, so their PNGs are cached by display settings alone
         # RGB png
-        if self.rgb:
-            raw_frame = self.rgb_frames[self.frame]
-            raw_arr = raw_frame.frame
-            raw_png = pngify(imgarr=raw_arr,
-                             vmin=None,
-                             vmax=None,
-                             cmap=None)
-            return raw_png
+        if rgb:
+            def render():
+                raw_arr = self._get_rgb_frame(frame).frame
+                return render_png(imgarr=raw_arr,
+                                  vmin=None,
+                                  vmax=None,
+                                  cmap=None,
+                                  compress_level=PNG_COMPRESS_LEVEL)
+            return _get_cached_png(('rgb', self.id, frame), render)
+
         # Raw png
-        raw_frame = self.raw_frames[self.frame]
-        raw_arr = raw_frame.frame[..., self.channel]
-        raw_png = pngify(imgarr=raw_arr,
-                         vmin=0,
-                         vmax=None,
-                         cmap='cubehelix')
-        return raw_png
+        def render():
+            raw_arr = self.get_raw_frame(frame).frame[..., channel]
+            return render_png(imgarr=raw_arr,
+                              vmin=0,
+                              vmax=None,
+                              cmap='cubehelix',
+                              compress_level=PNG_COMPRESS_LEVEL)
+        return _get_cached_png(('raw', self.id, frame, channel), render)
+
+    def _get_raw_png_url(self):
+        """
+        Returns:
+            str: URL of the current raw frame as a .png, in RGB or in the current channel
+        """
+        if self.rgb:
+            return f'/api/image/{self.token}/rgb/{self.frame}'
+        return f'/api/image/{self.token}/raw/{self.frame}/{self.channel}'
+
+
+def _get_cached_png(key, render):
+    """
+    Gets a PNG from the render cache, rendering and caching it when it is not cached.
+
+    Args:
+        key (tuple): render cache key, or None to render without caching
+        render (function): returns the PNG as a BytesIO
+
+    Returns:
+        BytesIO: the PNG
+    """
+    png = render_cache.get(key) if key is not None else None
+    if png is None:
+        png = render().getvalue()
+        if key is not None:
+            render_cache.put(key, png)
+    return io.BytesIO(png)
 
 
 class Labels(db.Model):
@@ -501,6 +958,11 @@ class Labels(db.Model):
     def __init__(self):
         self.cell_ids = {}
         self.cell_info = {}
+        self._saved = None
+
+    @reconstructor
+    def _init_on_load(self):
+        self.save()
 
     @property
     def tracks(self):
@@ -514,16 +976,31 @@ class Labels(db.Model):
         simplifying track['frames'] into something like [0-29] instead of
         [0,1,2,3,...].
         """
-        cell_info = copy.deepcopy(self.cell_info)
-        for _, feature in cell_info.items():
-            for _, label in feature.items():
-                slices = list(map(list, consecutive(label['frames'])))
-                slices = '[' + ', '.join(["{}".format(a[0])
-                                          if len(a) == 1 else "{}-{}".format(a[0], a[-1])
-                                          for a in slices]) + ']'
-                label['slices'] = str(slices)
+        return {feature: {label: _readable_track(track) for label, track in info.items()}
+                for feature, info in self.cell_info.items()}
+
+    def readable_changes(self, changed_labels=None):
+        """
+        Preprocesses the tracks of changed labels for presentation on browser.
+
+        Args:
+            changed_labels (dict): set of changed labels by feature;
+                                   defaults to the labels changed since the metadata was last saved
 
-        return cell_info
+        Returns:
+            dict: readable track of each changed label by feature, or None for removed labels,
+                  or None if the metadata was not saved
+        """
+        if changed_labels is None:
+            if self._saved is None:
+                return None
+            changed_labels = _changed_labels(self._saved[1], self.cell_info)
+        readable = {}
+        for feature, labels in changed_labels.items():
+            info = self.cell_info.get(feature, {})
+            readable[feature] = {label: _readable_track(info[label]) if label in info else None
+                                 for label in labels}
+        return readable
 
     def update(self):
         """
@@ -534,30 +1011,141 @@ class Labels(db.Model):
         self.cell_ids = self.cell_ids.copy()
         self.cell_info = self.cell_info.copy()
 
+    def save(self):
+        """Copies the label metadata to find the entries changed by the next action."""
+        if self.cell_ids is None or self.cell_info is None:
+            self._saved = None
+        else:
+            self._saved = _copy_labels(self.cell_ids, self.cell_info)
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: copy of the cell_ids and cell_info
+        """
+        cell_ids, cell_info = _copy_labels(self.cell_ids, self.cell_info)
+        return {'cell_ids': cell_ids, 'cell_info': cell_info}
+
+    def changes(self):
+        """
+        Finds the label metadata entries changed since the metadata was last saved,
+        then saves the metadata.
+
+        Returns:
+            dict: labels removed from and added to cell_ids and
+                  cell_info entries before and after the changes, by feature,
+                  or None if the metadata was not saved
+        """
+        if self._saved is None:
+            self.save()
+            return None
+        saved_ids, saved_info = self._saved
+        delta = {'cell_ids': {}, 'cell_info': {}}
+        for feature, ids in self.cell_ids.items():
+            ids = np.asarray(ids)
+            old_ids = saved_ids.get(feature, ids[:0])
+            removed, added = np.setdiff1d(old_ids, ids), np.setdiff1d(ids, old_ids)
+            if removed.size or added.size:
+                delta['cell_ids'][feature] = (removed, added)
+                saved_ids[feature] = ids.copy()
+        for feature, info in self.cell_info.items():
+            old_info = saved_info.setdefault(feature, {})
+            changes = {}
+            for label in old_info.keys() | info.keys():
+                before, after = old_info.get(label), info.get(label)
+                if before != after:
+                    after = _copy_entry(after)
+                    changes[label] = (before, after)
+                    if after is None:
+                        del old_info[label]
+                    else:
+                        old_info[label] = after
+            if changes:
+                delta['cell_info'][feature] = changes
+        return delta
+
+    def apply(self, delta, undo=False):
+        """
+        Replays or reverts the changes of an action on the label metadata.
+
+        Args:
+            delta (dict): changes returned by Labels.changes
+            undo (bool): whether to revert the changes instead of replaying them
+        """
+        _apply_labels_delta(self.cell_ids, self.cell_info, delta, undo)
+        if self._saved is not None:
+            _apply_labels_delta(*self._saved, delta, undo)
+        self.update()
+
+    def restore(self, labels):
+        """
+        Replaces the label metadata.
+
+        Args:
+            labels (dict): cell_ids and cell_info to restore, like from Labels.snapshot
+        """
+        self.cell_ids = labels['cell_ids']
+        self.cell_info = labels['cell_info']
+        self.save()
+
     def finish(self):
         """Set PickleType columns to null."""
         self.cell_ids = None
         self.cell_info = None
+        self._saved = None
 
 
 class RawFrame(db.Model):
     """
     Table definition that stores the raw frames in a project.
+
+    When RAW_FRAME_STORE is set, frames are written to a BlobStore in that directory
+    and the row only holds the key of the frame in the store.
+    Raw frames never change, so frames read from the store are read-only memory maps.
     """
     # pylint: disable=E1101
     __tablename__ = 'rawframes'
     project_id = db.Column(db.Integer, db.ForeignKey('projects.id'),
                            primary_key=True, nullable=False)
     frame_id = db.Column(db.Integer, primary_key=True, nullable=False)
-    frame = db.Column(Npz)
+    # Deferred so frames in the frame cache are not loaded and decoded with the row
+    frame_blob = db.deferred(db.Column('frame', Npz))
+    frame_key = db.Column(db.String(64))
 
     def __init__(self, frame_id, frame):
         self.frame_id = frame_id
         self.frame = frame
 
+    @property
+    def frame(self):
+        """np.array: the raw frame; read-only when stored outside the database or cached"""
+        if self.frame_key is not None:
+            return BlobStore(RAW_FRAME_STORE).get(self.frame_key)
+        if self.project_id is None:
+            return self.frame_blob
+        # Raw frames never change, so they are always cached as version 0
+        key = ('raw', self.project_id, self.frame_id, 0)
+        array = frame_cache.get(key)
+        if array is None:
+            array = self.frame_blob
+            frame_cache.put(key, array)
+        return array
+
+    @frame.setter
+    def frame(self, frame):
+        if self.project_id is not None:
+            frame_cache.pop(('raw', self.project_id, self.frame_id, 0))
+        if frame is not None and RAW_FRAME_STORE:
+            self.frame_key = BlobStore(RAW_FRAME_STORE).put(frame)
+            self.frame_blob = None
+        else:
+            self.frame_key = None
+            self.frame_blob = frame
+
     def finish(self):
         """
-        Finish the frame by setting its PickleType column to null.
+        Finish the frame by setting its frame columns to null.
+        Frames in the raw frame store are kept as other frames may have the same contents.
         """
         self.frame = None
 
@@ -575,111 +1163,212 @@ class RGBFrame(db.Model):
 
     def __init__(self, frame_id, frame):
         self.frame_id = frame_id
-        self.frame = self.reduce_to_RGB(frame)
+        self.frame = reduce_to_rgb(frame[np.newaxis])[0]
 
     def finish(self):
         """Finish a frame by setting its frame to null."""
         self.frame = None
 
-    def rescale_95(self, frame):
-        """
-        Rescale a single- or multi-channel image.
 
-        Args:
-            frame (np.array): 2d image frame to rescale
+class LabelFrame(db.Model):
+    """
+    Table definition for the label frames in our projects.
+    Allows us to update and finish each frame.
 
-        Returns:
-            np.array: rescaled image
-        """
-        percentiles = np.percentile(frame[frame > 0], [5, 95])
-        rescaled_frame = rescale_intensity(
-            frame,
-            in_range=(percentiles[0], percentiles[1]),
-            out_range='uint8')
-        rescaled_frame = rescaled_frame.astype('uint8')
-        return rescaled_frame
+    When tile_size is set, the frame is stored as LabelTiles instead of a single blob
+    so that writing an edited frame only re-encodes and rewrites the tiles that changed.
+    """
+    # pylint: disable=E1101
+    __tablename__ = 'labelframes'
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'),
+                           primary_key=True, nullable=False)
+    frame_id = db.Column(db.Integer, primary_key=True, nullable=False)
+    # Whole frame for frames stored without tiles
+    # Deferred so frames in the frame cache are not loaded and decoded with the row
+    frame_blob = db.deferred(db.Column('frame', Npz))
+    tile_size = db.Column(db.Integer)
+    # Incremented each time the frame is written
+    version = db.Column(db.Integer, default=0)
 
-    def rescale_raw(self, frame):
-        """
-        Rescale first 6 raw channels individually and store in memory.
-        The rescaled raw array is used subsequently for image display purposes.
+    tiles = db.relationship('LabelTile', order_by='LabelTile.tile_id',
+                            cascade='save-update, merge, delete, delete-orphan')
 
-        Args: multi-channel frame to rescale
+    actions = association_proxy('frame_actions', 'action')
+
+    # Decoded frame, assembled from the blob or tiles on first access
+    _array = None
+
+    def __init__(self, frame_id, frame, tile_size=None):
+        self.frame_id = frame_id
+        self.tile_size = tile_size or None
+        self.version = 0
+        self.frame = frame
 
+    @property
+    def frame(self):
+        """
         Returns:
-            np.array: upto 6-channel rescaled image
+            MutableNdarray: label frame with dimensions (height, width, features)
         """
-        rescaled = np.zeros(frame.shape, dtype='uint8')
-        # this approach allows noise through
-        for channel in range(min(6, frame.shape[-1])):
-            raw_channel = frame[..., channel]
-            if np.sum(raw_channel) != 0:
-                rescaled[..., channel] = self.rescale_95(raw_channel)
-        return rescaled
+        if self._array is None:
+            array = self.cached_frame
+            # Copy the stored frame so edits are tracked and written as a new version
+            if array is not None:
+                array = array.copy()
+            self._set_array(array)
+        return self._array
 
-    def reduce_to_RGB(self, frame):
+    @property
+    def cached_frame(self):
         """
-        Go from rescaled raw array with up to 6 channels to an RGB image for display.
-        Handles adding in CMY channels as needed, and adjusting each channel if
-        viewing adjusted raw. Used to update self.rgb, which is used to display
-        raw current frame.
-
-        Args:
-            frame (np.array): upto 6-channel image to reduce to 3-channel image
+        Returns:
+            np.array: read-only frame as it was last written from the frame cache,
+                      loaded into the cache if needed
+        """
+        if self.project_id is None or self.version is None:
+            return self.stored_frame
+        key = ('label', self.project_id, self.frame_id, self.version)
+        array = frame_cache.get(key)
+        if array is None:
+            array = self.stored_frame
+            frame_cache.put(key, array)
+        return array
+
+    @frame.setter
+    def frame(self, value):
+        self._set_array(value)
+        flag_modified(self, 'version')
 
+    @property
+    def stored_frame(self):
+        """
         Returns:
-            np.array: 3-channel image
+            np.array: the frame as it was last written, or None if it has not been written
         """
-        rescaled = self.rescale_raw(frame)
-        # rgb starts as uint16 so it can handle values above 255 without overflow
-        rgb_img = np.zeros((frame.shape[0], frame.shape[1], 3), dtype='uint16')
+        if self.tile_size:
+            return assemble_tiles(self.tiles) if self.tiles else None
+        return self.frame_blob
+
+    def _set_array(self, array):
+        """Tracks changes to the frame array so they are written on the next flush."""
+        if array is not None:
+            array = MutableNdarray.coerce('frame', array)
+            array._parents[self] = 'version'
+            # Keep the frame alive while its array is in use, as the session only keeps
+            # weak references to unchanged frames and edits to the array must reach the frame
+            array._owner = self
+        self._array = array
+
+    @property
+    def frame_changed(self):
+        """Whether the frame has been changed since it was last written."""
+        return get_history(self, 'version').has_changes()
 
-        # for each of the channels that we have
-        for c in range(min(6, frame.shape[-1])):
-            # straightforward RGB -> RGB
-            new_channel = (rescaled[..., c]).astype('uint16')
-            if c < 3:
-                rgb_img[..., c] = new_channel
-            # collapse cyan to G and B
-            if c == 3:
-                rgb_img[..., 1] += new_channel
-                rgb_img[..., 2] += new_channel
-            # collapse magenta to R and B
-            if c == 4:
-                rgb_img[..., 0] += new_channel
-                rgb_img[..., 2] += new_channel
-            # collapse yellow to R and G
-            if c == 5:
-                rgb_img[..., 0] += new_channel
-                rgb_img[..., 1] += new_channel
+    @property
+    def next_version(self):
+        """Version of the frame once its changes are written."""
+        return (self.version or 0) + 1 if self.frame_changed else self.version
 
-            # clip values to uint8 range so it can be cast without overflow
-            rgb_img[..., 0:3] = np.clip(rgb_img[..., 0:3], a_min=0, a_max=255)
+    def write(self):
+        """
+        Stores the frame in its blob or tiles.
+        Only tiles that differ from their stored contents are replaced.
+        """
+        array = self._array
+        if not self.tile_size:
+            self.frame_blob = array
+        elif array is None:
+            self.tiles = []
+        else:
+            tiles = {tile.tile_id: tile for tile in self.tiles}
+            for tile_id, (y, x, tile_array) in enumerate(split_tiles(array, self.tile_size)):
+                tile = tiles.get(tile_id)
+                if tile is None:
+                    self.tiles.append(LabelTile(tile_id, y, x, tile_array))
+                elif not np.array_equal(tile.tile, tile_array):
+                    tile.tile = tile_array
+        self.version = (self.version or 0) + 1
 
-        return rgb_img.astype('uint8')
+    def finish(self):
+        """Finish a frame by setting its frame to null."""
+        self.frame = None
 
 
-class LabelFrame(db.Model):
+class LabelTile(db.Model):
     """
-    Table definition for the label frames in our projects.
-    Allows us to update and finish each frame.
+    Table definition for the square tiles of a tiled label frame.
+    Tiles are numbered in row-major order and store their offset in the frame.
     """
     # pylint: disable=E1101
-    __tablename__ = 'labelframes'
-    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'),
-                           primary_key=True, nullable=False)
-    frame_id = db.Column(db.Integer, primary_key=True, nullable=False)
-    frame = db.Column(MutableNdarray.as_mutable(Npz))
+    __tablename__ = 'labeltiles'
+    project_id = db.Column(db.Integer)
+    frame_id = db.Column(db.Integer)
+    tile_id = db.Column(db.Integer)
+    y = db.Column(db.Integer, nullable=False)
+    x = db.Column(db.Integer, nullable=False)
+    tile = db.Column(Npz)
 
-    actions = association_proxy('frame_actions', 'action')
+    __table_args__ = (
+        PrimaryKeyConstraint('project_id', 'frame_id', 'tile_id'),
+        ForeignKeyConstraint(
+            ['project_id', 'frame_id'],
+            ['labelframes.project_id', 'labelframes.frame_id']
+        )
+    )
 
-    def __init__(self, frame_id, frame):
-        self.frame_id = frame_id
-        self.frame = frame
+    def __init__(self, tile_id, y, x, tile):
+        self.tile_id = tile_id
+        self.y = y
+        self.x = x
+        self.tile = tile
 
-    def finish(self):
-        """Finish a frame by setting its frame to null."""
-        self.frame = None
+
+@event.listens_for(LabelFrame, 'expire', raw=True)
+def expire_label_frame(state, attrs):
+    """Reload the frame from the database with the rest of the row."""
+    label_frame = state.obj()
+    if label_frame is not None and attrs is None:
+        label_frame._array = None
+
+
+@event.listens_for(Session, 'before_flush')
+def write_label_frames(session, flush_context, instances):
+    """Writes new and changed label frames to their blobs or tiles before flushing."""
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, LabelFrame) and (obj in session.new or obj.frame_changed):
+            obj.write()
+            # Remember written versions in case the transaction is rolled back
+            session.info.setdefault('written_frames', set()).add(
+                ('label', obj.project_id, obj.frame_id, obj.version))
+
+
+@event.listens_for(LabelFrame.version, 'modified')
+def record_edited_frame(frame, initiator):
+    """
+    Records label frames replaced or changed in place,
+    so the next memento of their project only looks at the edited frames.
+    """
+    session = object_session(frame)
+    if session is not None and frame.project_id is not None:
+        edited_frames = session.info.setdefault('edited_frames', {})
+        edited_frames.setdefault(frame.project_id, {})[frame.frame_id] = frame
+
+
+@event.listens_for(Session, 'after_commit')
+def commit_written_frames(session):
+    session.info.pop('written_frames', None)
+    session.info.pop('edited_frames', None)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def evict_written_frames(session, previous_transaction):
+    """
+    Removes versions written in a rolled back transaction from the frame cache,
+    as the version numbers will be reused by the next write.
+    """
+    for key in session.info.pop('written_frames', ()):
+        frame_cache.pop(key)
+    session.info.pop('edited_frames', None)
 
 
 class Action(db.Model):
@@ -707,9 +1396,15 @@ class Action(db.Model):
                                   "remote(Action.action_id)==foreign(Action.next_action_id))")
     # Whether the action is currently in the Projects lineage
     done = db.Column(db.Boolean, default=True)
-    # Records label info after an action (whether or not its changed)
-    # Pickles an ORM row from the Labels table
-    labels = db.Column(db.PickleType)
+    # Frame to show when undoing the action:
+    # the first label frame edited by the action, or the frame displayed if it edited none
+    frame_id = db.Column(db.Integer)
+    # Label metadata entries changed by the action, from Labels.changes
+    # Null when the action only stores the whole label metadata
+    labels_delta = db.Column(db.PickleType(comparator=lambda *a: False))
+    # Whole label metadata after the action, stored every LABELS_SNAPSHOT_INTERVAL actions
+    # Older actions pickled an ORM row from the Labels table after every action
+    labels = db.deferred(db.Column(db.PickleType(comparator=lambda *a: False)))
 
     frames = association_proxy('action_frames', 'frame')
 
@@ -725,27 +1420,18 @@ class Action(db.Model):
 
     @property
     def labels_changed(self):
-        return self.labels is not None
+        if self.labels_delta is None:
+            return self.labels is not None
+        return any(self.labels_delta.values())
 
     @property
     def before_frames(self):
         """
         Returns a list of FrameMementos containing
         the before version of frames edited by this action.
-        TODO: profile this search
-        """
-        # Find the most last version of each edited frame before this action
-        before_frames = []
-        for frame in self.frames:
-            # Actions in the frame's lineage before this action
-            valid_actions = filter(lambda action: action.done and action.action_id < self.action_id,
-                                   frame.actions)
-            # Action containing the most recent version
-            before_action = max(valid_actions, key=lambda action: action.action_id)
-            before_frame = next(filter(lambda bf, f=frame: bf.frame_id == f.frame_id,
-                                       before_action.action_frames))
-            before_frames.append(before_frame)
-        return before_frames
+        """
+        previous = (memento.previous for memento in self.action_frames)
+        return [memento for memento in previous if memento is not None]
 
     @property
     def after_frames(self):
@@ -753,33 +1439,142 @@ class Action(db.Model):
         the after version of frames edited by this action."""
         return self.action_frames
 
+    def squash(self, actions):
+        """
+        Replaces the frame mementos of this action with the combined changes of several actions,
+        so this action changes the frames from before the first action to after the last action.
+        The squashed actions other than this one are deleted separately.
+
+        Args:
+            actions (list): consecutive actions in the project lineage ending with this action
+        """
+        frame_mementos = collections.defaultdict(list)
+        for action in actions:
+            for memento in action.action_frames:
+                frame_mementos[memento.frame_id].append(memento)
+        changes = {}
+        for frame_id, mementos in frame_mementos.items():
+            first, last = mementos[0], mementos[-1]
+            before = first.revert(first.reconstruct())
+            after = last.reconstruct()
+            # Keyframe the checkpoint if the squashed mementos had a keyframe
+            # to keep the changes needed to reconstruct the frame bounded
+            keyframe = any(memento.frame_array is not None for memento in mementos)
+            changes[frame_id] = (last.frame, before, after, keyframe)
+        if frame_mementos:
+            self.frame_id = min(frame_mementos)
+        own_mementos = {memento.frame_id: memento for memento in self.action_frames}
+        for frame_id, (frame, before, after, keyframe) in changes.items():
+            if frame_id in own_mementos:
+                own_mementos[frame_id].record(before, after, keyframe)
+            else:
+                FrameMemento(self, frame, keyframe=keyframe, before=before, after=after)
+
+        # Snapshot the checkpoint if the squashed actions had a snapshot
+        if any(action.labels is not None for action in actions):
+            self.labels = self.after_labels
+        deltas = [action.labels_delta for action in actions]
+        if any(delta is None for delta in deltas):
+            # Actions that only stored snapshots have unknown label changes,
+            # so the checkpoint is undone and redone with the snapshots
+            self.labels_delta = None
+        else:
+            self.labels_delta = _merge_labels_deltas(deltas)
+
     @property
     def before_labels(self):
+        """dict: cell_ids and cell_info before the action"""
         if self.prev_action is None:
             return None
-        return self.prev_action.labels
+        return self.prev_action.after_labels
 
     @property
     def after_labels(self):
-        return self.labels
+        """
+        Rebuilds the label metadata after the action from the nearest snapshot
+        and the label changes of the following actions.
+
+        Returns:
+            dict: cell_ids and cell_info after the action
+        """
+        snapshot = self
+        if self.labels is None:
+            snapshot = (self._lineage()
+                        .filter(Action.labels.isnot(None))
+                        .order_by(Action.action_id.desc())
+                        .first())
+        labels = _snapshot_labels(snapshot.labels)
+        if snapshot is self:
+            return labels
+        deltas = (self._lineage()
+                  .filter(Action.action_id > snapshot.action_id)
+                  .order_by(Action.action_id)
+                  .all())
+        if self not in deltas:
+            deltas.append(self)
+        for action in deltas:
+            _apply_labels_delta(labels['cell_ids'], labels['cell_info'], action.labels_delta)
+        return labels
+
+    def _lineage(self):
+        """
+        Returns:
+            Query: actions up to this action in the project's lineage
+        """
+        session = object_session(self) or db.session
+        return (session.query(Action)
+                .filter(Action.project_id == self.project_id,
+                        Action.action_id <= self.action_id,
+                        or_(Action.done, Action.action_id == self.action_id)))
+
+    def record_labels(self, labels, snapshot=False):
+        """
+        Stores the label metadata entries changed by the action,
+        and every LABELS_SNAPSHOT_INTERVAL actions the whole label metadata.
+
+        Args:
+            labels (Labels): label metadata after the action
+            snapshot (bool): whether to store the whole label metadata
+        """
+        self.labels_delta = labels.changes()
+        if not snapshot and self.labels_delta is not None and self.prev_action is not None:
+            lineage = self.prev_action._lineage()
+            last_snapshot = (lineage.filter(Action.labels.isnot(None))
+                             .with_entities(db.func.max(Action.action_id))
+                             .scalar())
+            since_snapshot = (lineage.filter(Action.action_id > last_snapshot).count()
+                              if last_snapshot is not None else LABELS_SNAPSHOT_INTERVAL)
+            snapshot = since_snapshot + 1 >= LABELS_SNAPSHOT_INTERVAL
+        if snapshot or self.labels_delta is None:
+            self.labels = labels.snapshot()
 
 
 class FrameMemento(db.Model):
     """
-    Table to store label frames in a Memento.
+    Table to store the changes an action made to a label frame.
+    Stores the changed pixels with their values before and after the action,
+    and periodically a keyframe with the whole frame after the action.
     """
     # pylint: disable=E1101
     __tablename__ = 'framemementos'
     project_id = db.Column(db.Integer)
     action_id = db.Column(db.Integer)
     frame_id = db.Column(db.Integer)
+    # Keyframe with the whole frame after the action
     frame_array = db.Column(Npz)
+    # Flat indices of the changed pixels
+    indices = db.Column(Npz)
+    # Values of the changed pixels before and after the action
+    before = db.Column(Npz)
+    after = db.Column(Npz)
 
     action = db.relationship("Action", backref="action_frames")
     frame = db.relationship("LabelFrame", backref="frame_actions")
 
     __table_args__ = (
         PrimaryKeyConstraint('project_id', 'action_id', 'frame_id'),
+        # Finds the versions of a frame in order
+        Index('ix_framemementos_frame_action', 'project_id', 'frame_id', 'action_id'),
         ForeignKeyConstraint(
             ['project_id', 'action_id'],
             ['actions.project_id', 'actions.action_id']
@@ -790,15 +1585,324 @@ class FrameMemento(db.Model):
         )
     )
 
-    def __init__(self, action, frame):
+    def __init__(self, action, frame, keyframe=False, before=None, after=None):
+        """
+        Args:
+            action (Action): action that changed the frame
+            frame (LabelFrame): frame changed by the action
+            keyframe (bool): whether to store the whole frame after the action
+            before (np.array): frame before the action; defaults to the stored frame
+            after (np.array): frame after the action; defaults to the current frame
+        """
         self.action = action
         self.frame = frame
-        self.frame_array = frame.frame.copy()
+        if after is None:
+            after = np.asarray(frame.frame)
+        if before is None:
+            before = frame.cached_frame
+        if before is None:
+            # Frame has not been written yet
+            before = np.zeros_like(after)
+            keyframe = True
+        # The label frame holds the initial version, so the first memento is the second version
+        keyframe = keyframe or (self._num_versions() + 1) % MEMENTO_KEYFRAME_INTERVAL == 0
+        self.record(before, after, keyframe)
+
+    def record(self, before, after, keyframe):
+        """
+        Stores the pixels that changed between two versions of the frame.
+
+        Args:
+            before (np.array): frame before the action
+            after (np.array): frame after the action
+            keyframe (bool): whether to also store the whole frame after the action
+        """
+        changed = np.flatnonzero(before != after)
+        index_dtype = np.int32 if after.size < np.iinfo(np.int32).max else np.int64
+        self.indices = changed.astype(index_dtype)
+        self.before = before.ravel()[changed]
+        self.after = after.ravel()[changed]
+        self.frame_array = after.copy() if keyframe else None
+
+    def _num_versions(self):
+        """Counts the mementos already stored for the frame."""
+        return db.session.query(FrameMemento).filter_by(
+            project_id=self.frame.project_id, frame_id=self.frame.frame_id).count()
 
+    @property
+    def is_delta(self):
+        """Whether the memento stores changed pixels (instead of only the whole frame)."""
+        return self.indices is not None
 
-def consecutive(data, stepsize=1):
-    return np.split(data, np.where(np.diff(data) != stepsize)[0] + 1)
+    def _lineage(self):
+        """
+        Returns:
+            Query: mementos of the frame up to this memento by actions in the project's lineage
+        """
+        session = object_session(self) or db.session
+        return (session.query(FrameMemento)
+                .join(FrameMemento.action)
+                .filter(FrameMemento.project_id == self.project_id,
+                        FrameMemento.frame_id == self.frame_id,
+                        FrameMemento.action_id <= self.action_id,
+                        or_(Action.done, FrameMemento.action_id == self.action_id)))
+
+    @property
+    def previous(self):
+        """
+        Returns:
+            FrameMemento: the previous version of the frame, or None if this is the first version
+        """
+        return (self._lineage()
+                .filter(FrameMemento.action_id < self.action_id)
+                .order_by(FrameMemento.action_id.desc())
+                .first())
+
+    def reconstruct(self):
+        """
+        Rebuilds the whole frame after the action from the nearest keyframe
+        and the changed pixels of the following mementos.
+        Without an earlier keyframe, reverts the changed pixels of the later mementos
+        on the current frame instead, so the action must be in the project's lineage.
+
+        Returns:
+            np.array: the frame after the action
+        """
+        if self.frame_array is not None:
+            return self.frame_array.copy()
+        keyframe = (self._lineage()
+                    .filter(FrameMemento.frame_array.isnot(None))
+                    .order_by(FrameMemento.action_id.desc())
+                    .first())
+        if keyframe is None:
+            session = object_session(self) or db.session
+            later = (session.query(FrameMemento)
+                     .join(FrameMemento.action)
+                     .filter(FrameMemento.project_id == self.project_id,
+                             FrameMemento.frame_id == self.frame_id,
+                             FrameMemento.action_id > self.action_id,
+                             Action.done)
+                     .order_by(FrameMemento.action_id.desc())
+                     .all())
+            frame = np.array(self.frame.cached_frame)
+            for memento in later:
+                frame.flat[memento.indices] = memento.before
+            return frame
+        deltas = (self._lineage()
+                  .filter(FrameMemento.action_id > keyframe.action_id)
+                  .order_by(FrameMemento.action_id)
+                  .all())
+        frame = keyframe.frame_array.copy()
+        for delta in deltas:
+            frame.flat[delta.indices] = delta.after
+        return frame
+
+    def revert(self, frame):
+        """
+        Undoes the action on a frame.
 
+        Args:
+            frame (np.array): the frame after the action
 
-def encode(x):
-    return base64.encodebytes(x.read()).decode()
+        Returns:
+            np.array: the frame before the action
+        """
+        if not self.is_delta:
+            return self.previous.reconstruct()
+        frame = np.array(frame)
+        frame.flat[self.indices] = self.before
+        return frame
+
+    def replay(self, frame):
+        """
+        Redoes the action on a frame.
+
+        Args:
+            frame (np.array): the frame before the action
+
+        Returns:
+            np.array: the frame after the action
+        """
+        if not self.is_delta:
+            return self.frame_array.copy()
+        frame = np.array(frame)
+        frame.flat[self.indices] = self.after
+        return frame
+
+
+def split_tiles(array, tile_size):
+    """
+    Splits a frame into square tiles in row-major order.
+
+    Args:
+        array (np.array): frame with dimensions (height, width, ...)
+        tile_size (int): length of the side of each tile
+
+    Returns:
+        generator: (y, x, tile) for each tile, where (y, x) is the offset of the tile
+    """
+    height, width = array.shape[:2]
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            # Copy so tiles keep their stored contents when the frame is edited in place
+            yield y, x, array[y:y + tile_size, x:x + tile_size].copy()
+
+
+def assemble_tiles(tiles):
+    """
+    Assembles a frame from its tiles.
+
+    Args:
+        tiles (list): LabelTiles that cover the frame
+
+    Returns:
+        np.array: the assembled frame
+    """
+    height = max(tile.y + tile.tile.shape[0] for tile in tiles)
+    width = max(tile.x + tile.tile.shape[1] for tile in tiles)
+    first = tiles[0].tile
+    array = np.zeros((height, width) + first.shape[2:], dtype=first.dtype)
+    for tile in tiles:
+        tile_height, tile_width = tile.tile.shape[:2]
+        array[tile.y:tile.y + tile_height, tile.x:tile.x + tile_width] = tile.tile
+    return array
+
+
+def _delete_actions(session, project_id, action_ids):
+    """
+    Deletes actions and their frame mementos with bulk statements.
+
+    Returns:
+        int: number of deleted frame mementos
+    """
+    actions = Action.__table__
+    mementos = FrameMemento.__table__
+    # Unlink the actions first so they can be deleted in any order
+    session.execute(actions.update()
+                    .where(actions.c.project_id == project_id)
+                    .where(actions.c.action_id.in_(action_ids))
+                    .values(prev_action_id=None, next_action_id=None))
+    result = session.execute(mementos.delete()
+                             .where(mementos.c.project_id == project_id)
+                             .where(mementos.c.action_id.in_(action_ids)))
+    session.execute(actions.delete()
+                    .where(actions.c.project_id == project_id)
+                    .where(actions.c.action_id.in_(action_ids)))
+    return result.rowcount
+
+
+def _copy_entry(entry):
+    """Copies a cell_info entry and the lists in it, which edits change in place."""
+    if entry is None:
+        return None
+    return {key: list(value) if isinstance(value, list) else value
+            for key, value in entry.items()}
+
+
+def _copy_labels(cell_ids, cell_info):
+    """Copies cell_ids and cell_info so later edits do not change the copies."""
+    cell_ids = {feature: np.array(ids) for feature, ids in cell_ids.items()}
+    cell_info = {feature: {label: _copy_entry(entry) for label, entry in info.items()}
+                 for feature, info in cell_info.items()}
+    return cell_ids, cell_info
+
+
+def _snapshot_labels(labels):
+    """Copies label metadata stored by an action, including Labels rows pickled by older actions."""
+    if isinstance(labels, Labels):
+        labels = {'cell_ids': labels.cell_ids, 'cell_info': labels.cell_info}
+    cell_ids, cell_info = _copy_labels(labels['cell_ids'], labels['cell_info'])
+    return {'cell_ids': cell_ids, 'cell_info': cell_info}
+
+
+def _changed_labels(old_info, info):
+    """
+    Finds the labels with different cell_info entries.
+
+    Returns:
+        dict: set of changed, added, and removed labels by feature
+    """
+    changed = {}
+    for feature in old_info.keys() | info.keys():
+        old_tracks, tracks = old_info.get(feature, {}), info.get(feature, {})
+        labels = {label for label in old_tracks.keys() | tracks.keys()
+                  if old_tracks.get(label) != tracks.get(label)}
+        if labels:
+            changed[feature] = labels
+    return changed
+
+
+def _readable_track(track):
+    """Copies a cell_info entry with the slices of its frames, like [0-29, 31]."""
+    readable = _copy_entry(track)
+    readable['slices'] = _readable_slices(tuple(track['frames']))
+    return readable
+
+
+@functools.lru_cache(maxsize=65536)
+def _readable_slices(frames):
+    """
+    Simplifies frames into slices like [0-29, 31] instead of [0, 1, 2, ..., 29, 31].
+    Cached by the frames, so the slices of a label are only recomputed when its frames change.
+    """
+    slices = map(list, consecutive(np.array(frames)))
+    return '[' + ', '.join(['{}'.format(a[0]) if len(a) == 1 else '{}-{}'.format(a[0], a[-1])
+                            for a in slices]) + ']'
+
+
+def _apply_labels_delta(cell_ids, cell_info, delta, undo=False):
+    """Replays or reverts label metadata changes from Labels.changes in place."""
+    for feature, (removed, added) in delta['cell_ids'].items():
+        if undo:
+            removed, added = added, removed
+        ids = np.asarray(cell_ids[feature])
+        cell_ids[feature] = np.append(ids[~np.isin(ids, removed)], added).astype(ids.dtype)
+    for feature, changes in delta['cell_info'].items():
+        info = cell_info.setdefault(feature, {})
+        for label, (before, after) in changes.items():
+            entry = before if undo else after
+            if entry is None:
+                info.pop(label, None)
+            else:
+                info[label] = _copy_entry(entry)
+
+
+def _merge_labels_deltas(deltas):
+    """Combines consecutive label metadata changes from Labels.changes into one change."""
+    merged = {'cell_ids': {}, 'cell_info': {}}
+    for delta in deltas:
+        for feature, (removed, added) in delta['cell_ids'].items():
+            if feature not in merged['cell_ids']:
+                merged['cell_ids'][feature] = (removed, added)
+                continue
+            old_removed, old_added = merged['cell_ids'][feature]
+            # Labels added then removed (or removed then added) cancel out
+            merged['cell_ids'][feature] = (
+                np.union1d(np.setdiff1d(old_removed, added), np.setdiff1d(removed, old_added)),
+                np.union1d(np.setdiff1d(old_added, removed), np.setdiff1d(added, old_removed)),
+            )
+        for feature, changes in delta['cell_info'].items():
+            merged_changes = merged['cell_info'].setdefault(feature, {})
+            for label, (before, after) in changes.items():
+                if label in merged_changes:
+                    before = merged_changes[label][0]
+                merged_changes[label] = (before, after)
+    for feature, (removed, added) in list(merged['cell_ids'].items()):
+        if not removed.size and not added.size:
+            del merged['cell_ids'][feature]
+    for feature, changes in list(merged['cell_info'].items()):
+        for label, (before, after) in list(changes.items()):
+            if before == after:
+                del changes[label]
+        if not changes:
+            del merged['cell_info'][feature]
+    return merged
+
+
+def _add_time(timings, stage, start):
+    """Adds the time since start to the time spent in a stage."""
+    timings[stage] = timings.get(stage, 0) + timeit.default_timer() - start
+
+
+def consecutive(data, stepsize=1):
+    return np.split(data, np.where(np.diff(data) != stepsize)[0] + 1)
@@ -1,12 +1,18 @@
 """Test for DeepCell Label Models"""
 
+import copy
 import io
+import os
+import pickle
 
 import numpy as np
 import pytest
+import sqlalchemy
+from PIL import Image
 
 from deepcell_label import models
-from deepcell_label.imgutils import pngify
+from deepcell_label.cache import render_cache
+from deepcell_label.imgutils import label_colors, pngify
 from deepcell_label.conftest import DummyLoader
 
 
@@ -17,6 +23,11 @@ def enable_transactional_tests(db_session):
     pass
 
 
+def rgba(png):
+    """Decodes a PNG as RGBA pixels."""
+    return np.array(Image.open(png).convert('RGBA'))
+
+
 def test_project_init():
     """
     Test constructor for Project table.
@@ -164,8 +175,405 @@ def test_create_memento_frame_changed(db_session):
 
     assert len(project.action.after_frames) == 1
     assert project.action.after_frames[0].frame is changed_frame
-    assert len(project.action.before_frames) == 1
-    assert project.action.before_frames[0].frame is changed_frame
+    # The version before the first edit is the label frame at creation
+    assert len(project.action.before_frames) == 0
+
+    first_memento = project.action.after_frames[0]
+    project.label_frames[0].frame = new_frame + 1
+    project.create_memento(action_name='test')
+    project.update()
+    assert project.action.before_frames == [first_memento]
+
+
+def test_frame_memento_stores_changed_pixels(db_session):
+    project = models.Project.create(DummyLoader(labels=np.zeros((1, 3, 3, 1))))
+
+    project.label_frames[0].frame[1, 2, 0] = 5
+    project.create_memento('test')
+    project.update()
+
+    memento = project.action.after_frames[0]
+    assert memento.frame_array is None
+    np.testing.assert_array_equal(memento.indices, [5])
+    np.testing.assert_array_equal(memento.before, [0])
+    np.testing.assert_array_equal(memento.after, [5])
+
+
+def test_frame_memento_keyframes(db_session, monkeypatch):
+    monkeypatch.setattr(models, 'MEMENTO_KEYFRAME_INTERVAL', 2)
+    project = models.Project.create(DummyLoader(labels=np.zeros((1, 2, 2, 1))))
+    # Project creation stores no frames, as the label frame holds the first version
+    assert project.action.after_frames == []
+
+    for value in range(1, 4):
+        project.label_frames[0].frame[0, 0] = value
+        project.create_memento('test')
+        project.update()
+        memento = project.action.after_frames[0]
+        # Every other memento is a keyframe
+        assert (memento.frame_array is not None) == (value % 2 == 0)
+        np.testing.assert_array_equal(memento.reconstruct(), project.label_frames[0].frame)
+
+
+def test_frame_memento_reconstruct_without_keyframe(monkeypatch):
+    """Test rebuilding versions from the current frame when no keyframe precedes them."""
+    monkeypatch.setattr(models, 'MEMENTO_KEYFRAME_INTERVAL', 100)
+    project = models.Project.create(DummyLoader(labels=np.zeros((1, 4, 4, 1))))
+    frames = _edit_frames(project, 3)
+
+    actions = sorted(project.actions, key=lambda action: action.action_id)
+    for action, expected in zip(actions[1:], frames[1:]):
+        assert action.after_frames[0].frame_array is None
+        np.testing.assert_array_equal(action.after_frames[0].reconstruct(), expected)
+
+
+def test_frame_memento_previous_skips_undone_actions(monkeypatch):
+    monkeypatch.setattr(models, 'MEMENTO_KEYFRAME_INTERVAL', 100)
+    project = models.Project.create(DummyLoader(labels=np.zeros((1, 2, 2, 1))))
+
+    project.label_frames[0].frame[0, 0] = 1
+    project.create_memento('test')
+    project.update()
+    second = project.action.after_frames[0]
+    # The first version is the label frame at creation
+    assert second.previous is None
+
+    project.label_frames[0].frame[0, 1] = 2
+    project.create_memento('test')
+    project.update()
+    project.undo()
+    project.update()
+    project.label_frames[0].frame[1, 0] = 3
+    project.create_memento('test')
+    project.update()
+    third = project.action.after_frames[0]
+
+    # The undone action is not a previous version of the frame
+    assert third.previous is second
+    expected = np.array([[[1], [0]], [[3], [0]]])
+    np.testing.assert_array_equal(third.reconstruct(), expected)
+    assert project.action.before_frames == [second]
+
+
+def test_undo_redo_full_frame_mementos(monkeypatch):
+    """Test undoing and redoing with mementos stored as whole frames by older versions."""
+    monkeypatch.setattr(models, 'MEMENTO_KEYFRAME_INTERVAL', 100)
+    project = models.Project.create(DummyLoader(labels=np.zeros((1, 4, 4, 1))))
+    frames = _edit_frames(project, 2)
+    # Older versions stored the whole frame after each action, without the changed pixels
+    for action in project.actions:
+        for memento in action.after_frames:
+            memento.frame_array = memento.reconstruct()
+            memento.indices = memento.before = memento.after = None
+    project.update()
+
+    project.undo()
+    project.update()
+    np.testing.assert_array_equal(project.label_frames[0].frame, frames[1])
+    project.redo()
+    project.update()
+    np.testing.assert_array_equal(project.label_frames[0].frame, frames[2])
+
+
+def test_create_memento_edited_frames_only(db_session):
+    """Test recording an edit without loading the other label frames."""
+    project = models.Project.create(DummyLoader(labels=np.zeros((3, 4, 4, 1))))
+    project.get_label_frame(1).frame[0, 0] = 1
+    # Edited frames are still recorded after a flush
+    db_session.flush()
+    project.create_memento('test')
+
+    assert 'label_frames' in sqlalchemy.inspect(project).unloaded
+    assert [memento.frame.frame_id for memento in project.action.after_frames] == [1]
+    project.update()
+
+    # Undo is not recorded as an edit in the next action
+    project.undo()
+    project.get_label_frame(2).frame[0, 0] = 1
+    project.create_memento('test')
+    assert [memento.frame.frame_id for memento in project.action.after_frames] == [2]
+
+
+def test_create_memento_skips_unchanged_project():
+    """Test skipping actions that did not change the project."""
+    project = models.Project.create(DummyLoader())
+    action = project.action
+    num_actions = project.num_actions
+
+    assert project.create_memento('test', labels_changed=False) is None
+    assert project.action is action
+    assert project.num_actions == num_actions
+
+
+def _label_state(project):
+    """Returns a copy of the label metadata with cell ids in sorted order."""
+    return (copy.deepcopy(project.labels.cell_info),
+            {feature: sorted(ids) for feature, ids in project.labels.cell_ids.items()})
+
+
+def _add_cells(project, labels):
+    """Adds each label to the label metadata in its own action and returns the state after each."""
+    states = [_label_state(project)]
+    for label in labels:
+        project.labels.cell_info[0][label] = {'label': str(label), 'frames': [0], 'slices': ''}
+        project.labels.cell_ids[0] = np.append(project.labels.cell_ids[0], label)
+        project.create_memento('test')
+        project.update()
+        states.append(_label_state(project))
+    return states
+
+
+def test_create_memento_labels_delta():
+    project = models.Project.create(DummyLoader(labels=np.ones((1, 4, 4, 1))))
+    project.labels.cell_info[0][1]['frames'].append(1)
+    project.create_memento('test')
+    project.update()
+
+    # Stores only the changed entry
+    assert project.action.labels is None
+    assert project.action.labels_delta['cell_ids'] == {}
+    assert project.action.labels_delta['cell_info'] == {0: {1: (
+        {'label': '1', 'frames': [0], 'slices': ''},
+        {'label': '1', 'frames': [0, 1], 'slices': ''},
+    )}}
+
+
+def test_undo_redo_labels(monkeypatch):
+    monkeypatch.setattr(models, 'LABELS_SNAPSHOT_INTERVAL', 3)
+    project = models.Project.create(DummyLoader(labels=np.ones((1, 4, 4, 1))))
+    states = _add_cells(project, range(2, 7))
+
+    actions = sorted(project.actions, key=lambda action: action.action_id)
+    # Snapshots the label metadata on creation and every third action
+    assert [action.labels is not None for action in actions] == [
+        True, False, False, True, False, False]
+    for action, (cell_info, cell_ids) in zip(actions, states):
+        labels = action.after_labels
+        assert labels['cell_info'] == cell_info
+        assert sorted(labels['cell_ids'][0]) == cell_ids[0]
+
+    for expected in reversed(states[:-1]):
+        project.undo()
+        project.update()
+        assert _label_state(project) == expected
+    for expected in states[1:]:
+        project.redo()
+        project.update()
+        assert _label_state(project) == expected
+
+
+def test_undo_redo_pickled_labels_rows():
+    """Test undoing and redoing actions that stored a pickled Labels row instead of deltas."""
+    project = models.Project.create(DummyLoader(labels=np.ones((1, 4, 4, 1))))
+    states = _add_cells(project, [2, 3])
+    # Older versions pickled the whole Labels row after every action
+    after_labels = [(action, action.after_labels) for action in project.actions]
+    for action, after in after_labels:
+        labels = models.Labels()
+        labels.cell_ids = after['cell_ids']
+        labels.cell_info = after['cell_info']
+        action.labels = labels
+        action.labels_delta = None
+    project.update()
+    models.db.session.expire_all()
+
+    project.undo()
+    project.update()
+    assert _label_state(project) == states[1]
+    project.redo()
+    project.update()
+    assert _label_state(project) == states[2]
+
+
+def _edit_frames(project, num_edits):
+    """Makes edits that each change a different pixel and returns the frame after each edit."""
+    frames = [np.array(project.label_frames[0].frame)]
+    for value in range(1, num_edits + 1):
+        project.label_frames[0].frame[value // 4, value % 4] = value
+        project.create_memento('test')
+        project.update()
+        frames.append(np.array(project.label_frames[0].frame))
+    return frames
+
+
+def test_compact_history(monkeypatch):
+    monkeypatch.setattr(models, 'MEMENTO_KEYFRAME_INTERVAL', 4)
+    project = models.Project.create(DummyLoader(labels=np.zeros((1, 4, 4, 1))))
+    frames = _edit_frames(project, 10)
+
+    stats = project.compact_history(undo_depth=3, checkpoint_interval=3)
+    project.update()
+
+    # Keeps the creation, checkpoints after edits 3 and 6,
+    # edit 7, which waits for the next checkpoint, and the last 3 edits
+    assert stats == {'checkpoints': 2, 'actions': 4, 'mementos': 4}
+    assert len(project.actions) == 7
+    # Undo one edit at a time, then between checkpoints
+    for expected in [9, 8, 7, 6, 3, 0]:
+        project.undo()
+        project.update()
+        np.testing.assert_array_equal(project.label_frames[0].frame, frames[expected])
+    for expected in [3, 6, 7, 8, 9, 10]:
+        project.redo()
+        project.update()
+        np.testing.assert_array_equal(project.label_frames[0].frame, frames[expected])
+
+
+def test_compact_history_repeatedly(monkeypatch):
+    """Test compacting every few edits, like the edit endpoint, keeps the same checkpoints."""
+    monkeypatch.setattr(models, 'MEMENTO_KEYFRAME_INTERVAL', 8)
+    project = models.Project.create(DummyLoader(labels=np.zeros((1, 8, 8, 1))))
+    frames = [np.array(project.label_frames[0].frame)]
+    for value in range(1, 101):
+        project.label_frames[0].frame.flat[value % 64] = value
+        project.create_memento('test')
+        project.update()
+        frames.append(np.array(project.label_frames[0].frame))
+        if value % 10 == 0:
+            project.compact_history(undo_depth=20, checkpoint_interval=10)
+            project.update()
+
+    # Keeps a checkpoint every 10 actions before the last 20 actions
+    action_ids = sorted(action.action_id for action in project.actions)
+    assert action_ids == list(range(0, 80, 10)) + list(range(80, 101))
+    for expected in list(range(99, 80, -1)) + list(range(80, -1, -10)):
+        project.undo()
+        project.update()
+        assert project.action.action_id == expected
+        np.testing.assert_array_equal(project.label_frames[0].frame, frames[expected])
+
+
+def test_compact_history_reverted_pixels(monkeypatch):
+    """Test squashing actions that change a pixel and change it back."""
+    monkeypatch.setattr(models, 'MEMENTO_KEYFRAME_INTERVAL', 5)
+    project = models.Project.create(DummyLoader(labels=np.zeros((1, 4, 4, 1))))
+    frames = [np.array(project.label_frames[0].frame)]
+    # Edits 2 and 3 change pixel (0, 0) and change it back
+    for index, value in [((1, 1), 1), ((0, 0), 5), ((0, 0), 0),
+                         ((1, 2), 2), ((1, 3), 3), ((2, 0), 4), ((2, 1), 6)]:
+        project.label_frames[0].frame[index] = value
+        project.create_memento('test')
+        project.update()
+        frames.append(np.array(project.label_frames[0].frame))
+
+    project.compact_history(undo_depth=1, checkpoint_interval=3)
+    project.update()
+
+    # Undo to the checkpoints after edits 6 and 3
+    for expected in [6, 3]:
+        project.undo()
+        project.update()
+        np.testing.assert_array_equal(project.label_frames[0].frame, frames[expected])
+
+
+def test_compact_history_labels(monkeypatch):
+    monkeypatch.setattr(models, 'LABELS_SNAPSHOT_INTERVAL', 4)
+    project = models.Project.create(DummyLoader(labels=np.ones((1, 4, 4, 1))))
+    states = _add_cells(project, range(2, 9))
+    # Removes the cell added by the previous edit, so the checkpoint after both changes neither
+    del project.labels.cell_info[0][8]
+    project.labels.cell_ids[0] = project.labels.cell_ids[0][:-1]
+    project.create_memento('test')
+    project.update()
+    states.append(_label_state(project))
+    states += _add_cells(project, [9])[1:]
+
+    project.compact_history(undo_depth=1, checkpoint_interval=4)
+    project.update()
+
+    # Undo to the checkpoints after edits 8, 4, and the creation
+    for expected in [8, 4, 0]:
+        project.undo()
+        project.update()
+        assert _label_state(project) == states[expected]
+    for expected in [4, 8, 9]:
+        project.redo()
+        project.update()
+        assert _label_state(project) == states[expected]
+
+
+def test_compact_history_deletes_unreachable_actions():
+    project = models.Project.create(DummyLoader(labels=np.zeros((1, 4, 4, 1))))
+    _edit_frames(project, 2)
+    project.undo()
+    project.update()
+    redo_action = project.action.next_action
+    # Replaces the undone edit
+    _edit_frames(project, 1)
+    project.undo()
+    project.update()
+
+    stats = project.compact_history(undo_depth=0)
+    project.update()
+
+    # Keeps the edit that can be redone
+    assert stats == {'checkpoints': 0, 'actions': 1, 'mementos': 1}
+    assert redo_action not in project.actions
+    project.redo()
+    project.update()
+    assert project.label_frames[0].frame[0, 1] == 1
+
+
+def test_undo_redo_steps(monkeypatch):
+    monkeypatch.setattr(models, 'MEMENTO_KEYFRAME_INTERVAL', 3)
+    monkeypatch.setattr(models, 'LABELS_SNAPSHOT_INTERVAL', 3)
+    project = models.Project.create(DummyLoader(labels=np.zeros((1, 4, 4, 1))))
+    frames = _edit_frames(project, 3)
+    states = [_label_state(project)] * 4 + _add_cells(project, [1, 2, 3])[1:]
+    frames += [frames[-1]] * 3
+
+    for undo, steps, expected in [(True, 4, 2), (True, 10, 0), (False, 5, 5), (False, 10, 6)]:
+        if undo:
+            project.undo(steps=steps)
+        else:
+            project.redo(steps=steps)
+        project.update()
+        assert project.action.action_id == expected
+        np.testing.assert_array_equal(project.label_frames[0].frame, frames[expected])
+        assert _label_state(project) == states[expected]
+
+
+def test_steps_to():
+    project = models.Project.create(DummyLoader(labels=np.zeros((1, 4, 4, 1))))
+    _edit_frames(project, 3)
+    project.undo()
+    project.update()
+
+    assert project.steps_to(0) == -2
+    assert project.steps_to(2) == 0
+    assert project.steps_to(3) == 1
+    assert project.steps_to(4) is None
+
+    # The undone action can not be redone after a new action
+    project.undo()
+    project.update()
+    _edit_frames(project, 1)
+    assert project.steps_to(2) is None
+    assert project.steps_to(4) == 0
+
+
+def test_action_frames(db_session):
+    project = models.Project.create(DummyLoader(labels=np.zeros((3, 4, 4, 1))))
+    for frame_id in [2, 1]:
+        project.get_label_frame(frame_id).frame[0, 0] = 1
+        project.create_memento('test')
+        project.update()
+    # Action that only changes the labels shows the frame displayed when it was made
+    project.frame = 1
+    project.create_memento('test')
+    project.update()
+    project.get_label_frame(0).frame[0, 0] = 1
+    project.create_memento('test')
+    project.update()
+    project.undo()
+
+    assert project.action_frames() == [2, 1, 1]
+    assert project.make_first_payload()['actionFrames'] == [2, 1, 1]
+
+    # Finds the frame of actions that did not store it from their frame mementos
+    project.action.prev_action.frame_id = None
+    db_session.flush()
+    assert project.action_frames() == [2, 1, 1]
 
 
 def test_undo_no_previous_action():
@@ -309,19 +717,30 @@ def test_get_label_png():
     """
     Test label frame PNGs to send to the front-end.
     """
-    project = models.Project.create(DummyLoader())
+    labels = np.array([[[[1], [0]], [[0], [3]]]])
+    project = models.Project.create(DummyLoader(labels=labels))
 
     expected_frame = project.label_frames[project.frame].frame[..., project.feature]
-    expected_frame = np.ma.masked_equal(expected_frame, 0)
-    expected_png = pngify(expected_frame,
-                          vmin=0,
-                          vmax=project.get_max_label(),
-                          cmap=project.colormap)
+    expected_colors = label_colors(expected_frame, project.colormap)
 
     label_png = project._get_label_png()
 
     assert isinstance(label_png, io.BytesIO)
-    assert label_png.getvalue() == expected_png.getvalue()
+    np.testing.assert_array_equal(rgba(label_png), expected_colors)
+
+
+def test_get_label_png_new_label():
+    """Creating a label does not change the colors of other labels."""
+    labels = np.array([[[[1], [0]], [[0], [3]]], [[[1], [1]], [[0], [0]]]])
+    project = models.Project.create(DummyLoader(labels=labels))
+    label_png = project._get_label_png()
+
+    project.label_frames[1].frame[0, 0, 0] = 10
+    project.labels.cell_ids[0] = np.append(project.labels.cell_ids[0], 10)
+    project.update()
+    render_cache.clear()
+
+    assert project._get_label_png().getvalue() == label_png.getvalue()
 
 
 def test_get_raw_png_greyscale():
@@ -336,7 +755,7 @@ def test_get_raw_png_greyscale():
 
     raw_png = project._get_raw_png()
     assert isinstance(raw_png, io.BytesIO)
-    assert raw_png.getvalue() == expected_png.getvalue()
+    np.testing.assert_array_equal(rgba(raw_png), rgba(expected_png))
 
 
 def test_get_raw_png_rgb():
@@ -344,14 +763,61 @@ def test_get_raw_png_rgb():
     project.rgb = True
     project.update()
 
+    raw_png = project._get_raw_png()
+    project.update()
+
     expected_frame = project.rgb_frames[project.frame].frame
     expected_png = pngify(expected_frame, vmin=None, vmax=None, cmap=None)
-
-    raw_png = project._get_raw_png()
     assert isinstance(raw_png, io.BytesIO)
     assert raw_png.getvalue() == expected_png.getvalue()
 
 
+def test_get_png_render_cache():
+    project = models.Project.create(DummyLoader())
+    render_cache.clear()
+
+    raw_png = project._get_raw_png()
+    label_png = project._get_label_png()
+    assert render_cache.stats()['misses'] == 2
+    assert len(render_cache) == 2
+
+    # Rendering the same frames again reuses the cached PNGs
+    assert project._get_raw_png().getvalue() == raw_png.getvalue()
+    assert project._get_label_png().getvalue() == label_png.getvalue()
+    assert render_cache.stats()['hits'] == 2
+
+    # Colormaps loaded from the database again reuse the cached PNGs
+    project.colormap = pickle.loads(pickle.dumps(project.colormap))
+    project._get_label_png()
+    assert render_cache.stats()['hits'] == 3
+
+    # Changing display settings renders new PNGs
+    project.colormap = 'magma'
+    project._get_label_png()
+    project.rgb = True
+    project._get_raw_png()
+    assert render_cache.stats()['misses'] == 4
+
+
+def test_get_label_png_render_cache_edited_frame():
+    labels = np.array([[[[1], [0]], [[0], [2]]]])
+    project = models.Project.create(DummyLoader(labels=labels))
+    label_frame = project.label_frames[project.frame]
+    label_png = project._get_label_png()
+
+    # Edits are rendered without caching until they are committed
+    label_frame.frame[0, 0, project.feature] = 2
+    edited_png = project._get_label_png()
+    assert edited_png.getvalue() != label_png.getvalue()
+    assert len(render_cache) == 1
+
+    project.update()
+    assert project._get_label_png().getvalue() == edited_png.getvalue()
+    assert len(render_cache) == 2
+    assert project._get_label_png().getvalue() == edited_png.getvalue()
+    assert render_cache.stats()['hits'] == 1
+
+
 def test_get_max_label_all_zeroes():
     labels = np.zeros((1, 1, 1, 1))
     project = models.Project.create(DummyLoader(labels=labels))
@@ -393,17 +859,17 @@ def test_finish_project():
     """
     # create project
     project = models.Project.create(DummyLoader())
+    project.rgb = True
+    project._get_raw_png()
+    project.update()
 
     project.finish()
     assert project.finished is not None
     assert project.labels.cell_ids is None
     assert project.labels.cell_info is None
-    for raw, rgb, label in zip(project.raw_frames,
-                               project.rgb_frames,
-                               project.label_frames):
-        assert raw.frame is None
-        assert rgb.frame is None
-        assert label.frame is None
+    assert len(project.rgb_frames) == 1
+    for frame in project.raw_frames + project.rgb_frames + project.label_frames:
+        assert frame.frame is None
 
 
 def test_raw_frame_init():
@@ -415,15 +881,164 @@ def test_raw_frame_init():
         assert frame.frame_id is not None
 
 
+def test_raw_frame_store(tmpdir, monkeypatch):
+    """Test storing raw frames outside the database."""
+    monkeypatch.setattr(models, 'RAW_FRAME_STORE', str(tmpdir))
+    raw = np.random.randint(0, 100, size=(2, 4, 4, 2), dtype='uint16')
+    project = models.Project.create(DummyLoader(raw=raw))
+
+    for raw_frame, expected in zip(project.raw_frames, raw):
+        assert raw_frame.frame_blob is None
+        assert raw_frame.frame_key is not None
+        assert isinstance(raw_frame.frame, np.memmap)
+        np.testing.assert_array_equal(raw_frame.frame, expected)
+    np.testing.assert_array_equal(project.raw_array, raw)
+
+    project.finish()
+    for raw_frame in project.raw_frames:
+        assert raw_frame.frame_key is None
+        assert raw_frame.frame is None
+
+
+def test_raw_stack_cache(tmpdir, monkeypatch):
+    """Test caching the raw array of a project in a memory-mapped file."""
+    monkeypatch.setattr(models, 'RAW_STACK_CACHE', str(tmpdir))
+    raw = np.random.randint(0, 100, size=(2, 4, 4, 2), dtype='uint16')
+    project = models.Project.create(DummyLoader(raw=raw))
+
+    path = project.raw_stack_path
+    assert path == str(tmpdir.join('{}-{}.npy'.format(project.id, project.raw_checksum)))
+    assert os.path.exists(path)
+    raw_array = project.raw_array
+    assert isinstance(raw_array, np.memmap)
+    np.testing.assert_array_equal(raw_array, raw)
+
+    # Rebuilds missing cache from raw frames
+    os.remove(path)
+    np.testing.assert_array_equal(project.raw_array, raw)
+    assert os.path.exists(path)
+
+    project.finish()
+    assert not os.path.exists(path)
+
+
+def test_raw_stack_cache_wrong_shape(tmpdir, monkeypatch):
+    """Test rebuilding a cached raw stack that does not match the project."""
+    monkeypatch.setattr(models, 'RAW_STACK_CACHE', str(tmpdir))
+    raw = np.random.randint(0, 100, size=(2, 4, 4, 2), dtype='uint16')
+    project = models.Project.create(DummyLoader(raw=raw))
+    np.save(project.raw_stack_path, np.zeros((1, 4, 4, 2)))
+
+    np.testing.assert_array_equal(project.raw_array, raw)
+
+
+def test_create_in_batches(monkeypatch):
+    """Test inserting frames in several batches when creating a project."""
+    monkeypatch.setattr(models, 'INGEST_BATCH_SIZE', 2)
+    monkeypatch.setattr(models, 'LABEL_TILE_SIZE', 2)
+    raw = np.random.randint(0, 100, size=(5, 3, 3, 1), dtype='uint16')
+    labels = np.random.randint(0, 10, size=(5, 3, 3, 1), dtype='int32')
+    project = models.Project.create(DummyLoader(raw=raw, labels=labels))
+
+    np.testing.assert_array_equal(project.raw_array, raw)
+    np.testing.assert_array_equal(project.label_array, labels)
+    assert [frame.frame_id for frame in project.label_frames] == list(range(5))
+    for label_frame in project.label_frames:
+        assert len(label_frame.tiles) == 4
+        assert label_frame.version == 1
+    # Initial action does not copy the frames
+    assert project.action.action_name == 'create_project'
+    assert project.action.action_frames == []
+
+
+def test_get_frame():
+    """Test getting one frame without loading every frame in the project."""
+    raw = np.random.randint(0, 100, size=(3, 2, 2, 1), dtype='uint16')
+    labels = np.random.randint(0, 10, size=(3, 2, 2, 1), dtype='int32')
+    project = models.Project.create(DummyLoader(raw=raw, labels=labels))
+
+    label_frame = project.get_label_frame(1)
+    raw_frame = project.get_raw_frame(1)
+
+    assert label_frame.frame_id == 1
+    assert raw_frame.frame_id == 1
+    np.testing.assert_array_equal(label_frame.frame, labels[1])
+    np.testing.assert_array_equal(raw_frame.frame, raw[1])
+    unloaded = sqlalchemy.inspect(project).unloaded
+    assert 'label_frames' in unloaded
+    assert 'raw_frames' in unloaded
+    assert project.get_label_frame(3) is None
+    # Same frame as in the relationship
+    assert project.label_frames[1] is label_frame
+
+
+def test_get_label_frame_edit():
+    """Test editing a label frame that is not referenced after getting its array."""
+    project = models.Project.create(DummyLoader(labels=np.zeros((2, 1, 1, 1))))
+
+    project.get_label_frame(1).frame[0, 0, 0] = 1
+    project.update()
+
+    assert project.get_label_frame(1).frame[0, 0, 0] == 1
+
+
+def test_frame_cache(db_session):
+    """Test reading raw and label frames through the frame cache."""
+    raw = np.random.randint(0, 100, size=(2, 4, 4, 1), dtype='uint16')
+    labels = np.random.randint(0, 10, size=(2, 4, 4, 1), dtype='int32')
+    project = models.Project.create(DummyLoader(raw=raw, labels=labels))
+    label_frame = project.label_frames[0]
+    raw_frame = project.raw_frames[0]
+    version = label_frame.version
+    label_key = ('label', project.id, 0, version)
+    raw_key = ('raw', project.id, 0, 0)
+    label_frame.frame
+    assert label_key in models.frame_cache
+
+    # Reload frames from the cache after expiring them
+    db_session.expire_all()
+    hits = models.frame_cache.hits
+    np.testing.assert_array_equal(label_frame.frame, labels[0])
+    np.testing.assert_array_equal(raw_frame.frame, raw[0])
+    assert raw_key in models.frame_cache
+    assert models.frame_cache.hits == hits + 1
+
+    # Edits are made to a copy and written as a new version
+    label_frame.frame[0, 0, 0] = 100
+    assert models.frame_cache.get(label_key)[0, 0, 0] == labels[0, 0, 0, 0]
+    project.update()
+    assert label_frame.version == version + 1
+    db_session.expire_all()
+    assert label_frame.frame[0, 0, 0] == 100
+    assert ('label', project.id, 0, version + 1) in models.frame_cache
+
+    # Rolled back versions are removed from the cache
+    label_frame.frame[0, 0, 0] = 200
+    db_session.flush()
+    label_frame._array = None
+    assert label_frame.frame[0, 0, 0] == 200
+    assert ('label', project.id, 0, version + 2) in models.frame_cache
+    db_session.rollback()
+    assert ('label', project.id, 0, version + 2) not in models.frame_cache
+
+
 def test_rgb_frame_init():
-    """Test constructing the RGB frames for a project."""
-    project = models.Project.create(DummyLoader())
+    """Test constructing the RGB frames for a project when they are first displayed."""
+    project = models.Project.create(DummyLoader(raw=np.zeros((2, 1, 1, 1))))
+    assert len(project.rgb_frames) == 0
+
+    project.rgb = True
+    project.frame = 1
+    project._get_raw_png()
+    project.update()
 
     rgb_frames = project.rgb_frames
+    assert len(rgb_frames) == 1
     for frame in rgb_frames:
         assert frame.frame.ndim == 3  # Height, width, features
-        assert frame.frame_id is not None
+        assert frame.frame_id == 1
         assert frame.frame.shape[2] == 3  # RGB channels
+        assert frame.frame.shape[:-1] == project.raw_frames[1].frame.shape[:-1]
 
 
 def test_label_frame_init():
@@ -436,22 +1051,90 @@ def test_label_frame_init():
         assert frame.frame_id is not None
 
 
+def test_label_frame_tiles(db_session, monkeypatch):
+    """Test storing label frames as tiles."""
+    monkeypatch.setattr(models, 'LABEL_TILE_SIZE', 2)
+    labels = np.arange(25).reshape((1, 5, 5, 1))
+    project = models.Project.create(DummyLoader(labels=labels))
+    label_frame = project.label_frames[0]
+
+    assert label_frame.tile_size == 2
+    assert label_frame.frame_blob is None
+    assert len(label_frame.tiles) == 9
+    # Reassemble frame from database
+    db_session.expire_all()
+    np.testing.assert_array_equal(label_frame.frame, labels[0])
+
+
+def test_label_frame_write_changed_tiles(db_session, monkeypatch):
+    """Test that writing a tiled label frame only rewrites the changed tiles."""
+    monkeypatch.setattr(models, 'LABEL_TILE_SIZE', 2)
+    labels = np.zeros((1, 4, 4, 1))
+    project = models.Project.create(DummyLoader(labels=labels))
+    label_frame = project.label_frames[0]
+    version = label_frame.version
+
+    updated_tiles = []
+
+    def record_update(mapper, connection, target):
+        updated_tiles.append(target.tile_id)
+
+    sqlalchemy.event.listen(models.LabelTile, 'before_update', record_update)
+    try:
+        label_frame.frame[3, 0] = 1
+        db_session.commit()
+    finally:
+        sqlalchemy.event.remove(models.LabelTile, 'before_update', record_update)
+
+    assert updated_tiles == [2]
+    assert label_frame.version == version + 1
+    assert label_frame.frame[3, 0] == 1
+
+
+def test_label_frame_smaller_than_tile(db_session, monkeypatch):
+    """Test writing in-place edits to a frame that fits in a single tile."""
+    monkeypatch.setattr(models, 'LABEL_TILE_SIZE', 4)
+    project = models.Project.create(DummyLoader(labels=np.zeros((1, 2, 2, 1))))
+    label_frame = project.label_frames[0]
+
+    # Write the frame twice without expiring it in between
+    label_frame.frame[:] = 1
+    db_session.flush()
+    label_frame.frame[:] = 2
+    db_session.commit()
+    db_session.expire_all()
+
+    assert len(label_frame.tiles) == 1
+    assert (label_frame.frame == 2).all()
+
+
+def test_label_frame_no_tiles(db_session, monkeypatch):
+    """Test storing label frames as a single blob when tiling is disabled."""
+    monkeypatch.setattr(models, 'LABEL_TILE_SIZE', 0)
+    labels = np.ones((1, 3, 3, 1))
+    project = models.Project.create(DummyLoader(labels=labels))
+    label_frame = project.label_frames[0]
+
+    assert label_frame.tile_size is None
+    assert label_frame.tiles == []
+    label_frame.frame[0, 0] = 2
+    db_session.commit()
+    db_session.expire_all()
+    assert label_frame.frame[0, 0] == 2
+    np.testing.assert_array_equal(label_frame.frame_blob, label_frame.frame)
+
+
 def test_frames_init():
-    """Test that raw, RGB, and label frames within a project are all compatible."""
+    """Test that raw and label frames within a project are all compatible."""
     project = models.Project.create(DummyLoader())
 
     raw_frames = project.raw_frames
     label_frames = project.label_frames
-    rgb_frames = project.rgb_frames
     assert len(raw_frames) == len(label_frames)
-    assert len(raw_frames) == len(rgb_frames)
-    for raw_frame, label_frame, rgb_frame in zip(raw_frames, label_frames, rgb_frames):
+    for raw_frame, label_frame in zip(raw_frames, label_frames):
         assert raw_frame.frame.shape[:-1] == label_frame.frame.shape[:-1]
         assert raw_frame.frame_id == label_frame.frame_id
         assert raw_frame.project_id == label_frame.project_id
-        assert raw_frame.frame.shape[:-1] == rgb_frame.frame.shape[:-1]
-        assert raw_frame.frame_id == rgb_frame.frame_id
-        assert raw_frame.project_id == rgb_frame.project_id
 
 
 def test_labels_init():
@@ -463,3 +1146,60 @@ def test_labels_init():
     assert len(labels.cell_info) == project.num_features
     for feature in range(project.num_features):
         assert len(labels.cell_ids[feature]) == len(labels.cell_info[feature])
+
+
+def test_readable_tracks():
+    project = models.Project.create(DummyLoader(labels=np.ones((1, 4, 4, 1))))
+    project.labels.cell_info[0][1]['frames'] = [0, 1, 2, 4, 6, 7]
+
+    tracks = project.labels.readable_tracks
+    assert tracks[0][1]['slices'] == '[0-2, 4, 6-7]'
+
+    # Reuses the slices of labels with the same frames
+    hits = models._readable_slices.cache_info().hits
+    assert project.labels.readable_tracks == tracks
+    assert models._readable_slices.cache_info().hits > hits
+
+    # Copies the label metadata
+    tracks[0][1]['frames'].append(8)
+    assert project.labels.cell_info[0][1]['frames'] == [0, 1, 2, 4, 6, 7]
+
+
+def test_make_payload_changed_tracks():
+    project = models.Project.create(DummyLoader(labels=np.ones((1, 4, 4, 1))))
+    project.labels.cell_info[0][1]['frames'].append(1)
+    project.labels.cell_info[0][2] = {'label': '2', 'frames': [0, 1], 'slices': ''}
+
+    payload = project.make_payload(labels=True)
+    assert payload['tracks'] is False
+    assert payload['changedTracks'] == {0: {
+        1: {'label': '1', 'frames': [0, 1], 'slices': '[0-1]'},
+        2: {'label': '2', 'frames': [0, 1], 'slices': '[0-1]'},
+    }}
+
+    project.create_memento('test')
+    del project.labels.cell_info[0][2]
+    assert project.make_payload(labels=True)['changedTracks'] == {0: {2: None}}
+    assert project.make_payload(labels=False)['changedTracks'] is False
+
+
+def test_make_payload_tracks_unsaved_labels():
+    project = models.Project.create(DummyLoader(labels=np.ones((1, 4, 4, 1))))
+    project.labels._saved = None
+
+    payload = project.make_payload(labels=True)
+    assert payload['changedTracks'] is False
+    assert payload['tracks'] == project.labels.readable_tracks
+
+
+@pytest.mark.parametrize('snapshot_interval', [1, 100])
+def test_undo_redo_changed_tracks(monkeypatch, snapshot_interval):
+    monkeypatch.setattr(models, 'LABELS_SNAPSHOT_INTERVAL', snapshot_interval)
+    project = models.Project.create(DummyLoader(labels=np.ones((1, 4, 4, 1))))
+    _add_cells(project, [2, 3])
+
+    payload = project.undo()
+    assert payload['tracks'] is False
+    assert payload['changedTracks'] == {0: {3: None}}
+    payload = project.redo()
+    assert payload['changedTracks'] == {0: {3: {'label': '3', 'frames': [0], 'slices': '[0]'}}}
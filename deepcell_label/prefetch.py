@@ -0,0 +1,181 @@
+"""
+Background rendering of the frames next to the displayed frame.
+
+After a project displays a frame, a wave of prefetches renders the frames before and after it
+in a thread pool, so the render cache already holds them when the user moves to the next frame.
+Each project has one wave at a time: a new wave cancels the frames of the last wave
+that have not started, so jumping elsewhere in a movie does not wait for outdated prefetches.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import concurrent.futures
+import logging
+import threading
+
+
+logger = logging.getLogger('prefetch')  # pylint: disable=C0103
+
+
+def neighbors(frame, radius, num_frames):
+    """
+    Finds the frames around a frame, nearest first, alternating after and before it.
+
+    Args:
+        frame (int): index of the displayed frame
+        radius (int): number of frames to find on each side of the frame
+        num_frames (int): number of frames in the project
+
+    Returns:
+        list: indices of the neighboring frames
+    """
+    frames = []
+    for distance in range(1, radius + 1):
+        for neighbor in (frame + distance, frame - distance):
+            if 0 <= neighbor < num_frames:
+                frames.append(neighbor)
+    return frames
+
+
+class Wave(object):
+    """
+    Prefetches scheduled together after displaying a frame,
+    which stop once they render max_bytes of PNGs or are cancelled.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.cancelled = False
+        self.futures = []
+        self._lock = threading.Lock()
+
+    @property
+    def full(self):
+        """Whether the wave has rendered its budget of PNGs."""
+        return self.nbytes >= self.max_bytes
+
+    def add_bytes(self, nbytes):
+        with self._lock:
+            self.nbytes += nbytes
+
+    def cancel(self):
+        """
+        Cancels the prefetches that have not started.
+
+        Returns:
+            int: number of prefetches cancelled before they started
+        """
+        self.cancelled = True
+        return sum(future.cancel() for future in self.futures)
+
+    def done(self):
+        return all(future.done() for future in self.futures)
+
+
+class Prefetcher(object):
+    """
+    Thread pool that renders the neighbors of displayed frames into the render cache.
+    Configured by the PREFETCH_WORKERS, PREFETCH_FRAMES, and PREFETCH_SIZE settings;
+    prefetching is disabled when PREFETCH_WORKERS is 0.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.workers = 0
+        self.radius = 0
+        self.max_bytes = 0
+        self.rendered = 0
+        self.skipped = 0
+        self.cancelled = 0
+        self.failed = 0
+        self._executor = None
+        self._waves = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('PREFETCH_WORKERS', 0)
+        self.radius = app.config.get('PREFETCH_FRAMES', 0)
+        self.max_bytes = app.config.get('PREFETCH_SIZE', 0) * 1024 * 1024
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self.workers and self.radius and self.max_bytes:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix='prefetch')
+
+    @property
+    def enabled(self):
+        return self._executor is not None
+
+    def prefetch(self, key, frame, num_frames, render):
+        """
+        Renders the neighbors of a frame in the background,
+        cancelling the unstarted prefetches of the last wave with the same key.
+
+        Args:
+            key (str): identifies the waves that replace each other, like a project token
+            frame (int): index of the displayed frame
+            num_frames (int): number of frames in the project
+            render (function): renders a frame into the render cache in an app context,
+                               and returns the number of bytes rendered
+
+        Returns:
+            Wave: the scheduled prefetches, or None if prefetching is disabled
+        """
+        if not self.enabled:
+            return None
+        wave = Wave(self.max_bytes)
+        with self._lock:
+            last_wave = self._waves.get(key)
+            self._waves[key] = wave
+            if last_wave is not None:
+                self.cancelled += last_wave.cancel()
+            # Forget finished waves of other projects
+            for other_key, other_wave in list(self._waves.items()):
+                if other_wave is not wave and other_wave.done():
+                    del self._waves[other_key]
+        for neighbor in neighbors(frame, self.radius, num_frames):
+            wave.futures.append(self._executor.submit(self._render, wave, neighbor, render))
+        return wave
+
+    def _render(self, wave, frame, render):
+        if wave.cancelled or wave.full:
+            with self._lock:
+                self.skipped += 1
+            return
+        try:
+            with self.app.app_context():
+                nbytes = render(frame)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Could not prefetch frame %s.', frame)
+            with self._lock:
+                self.failed += 1
+            return
+        wave.add_bytes(nbytes)
+        with self._lock:
+            self.rendered += 1
+
+    def stats(self):
+        """
+        Returns:
+            dict: prefetch counters and settings
+        """
+        with self._lock:
+            return {
+                'rendered': self.rendered,
+                'skipped': self.skipped,
+                'cancelled': self.cancelled,
+                'failed': self.failed,
+                'waves': len(self._waves),
+                'workers': self.workers,
+                'frames': self.radius,
+                'max_bytes': self.max_bytes,
+            }
+
+
+prefetcher = Prefetcher()  # pylint: disable=C0103
@@ -0,0 +1,104 @@
+"""Tests for prefetch.py"""
+
+import threading
+
+from flask import Flask
+import pytest
+
+from deepcell_label.prefetch import Prefetcher, neighbors
+
+
+@pytest.fixture
+def prefetcher():
+    app = Flask(__name__)
+    app.config.update(PREFETCH_WORKERS=1, PREFETCH_FRAMES=2, PREFETCH_SIZE=1)
+    prefetcher = Prefetcher(app)
+    yield prefetcher
+    prefetcher._executor.shutdown()
+
+
+def wait(wave):
+    for future in wave.futures:
+        if not future.cancelled():
+            future.result(timeout=10)
+
+
+def test_neighbors():
+    assert neighbors(5, 2, 10) == [6, 4, 7, 3]
+    assert neighbors(0, 2, 10) == [1, 2]
+    assert neighbors(9, 2, 10) == [8, 7]
+    assert neighbors(0, 3, 1) == []
+
+
+def test_prefetch(prefetcher):
+    rendered = []
+
+    def render(frame):
+        rendered.append(frame)
+        return 1
+
+    wave = prefetcher.prefetch('project', 5, 10, render)
+    wait(wave)
+
+    assert rendered == [6, 4, 7, 3]
+    assert wave.nbytes == 4
+    assert prefetcher.stats()['rendered'] == 4
+
+
+def test_prefetch_disabled():
+    app = Flask(__name__)
+    app.config.update(PREFETCH_WORKERS=0, PREFETCH_FRAMES=2, PREFETCH_SIZE=1)
+    prefetcher = Prefetcher(app)
+    assert not prefetcher.enabled
+    assert prefetcher.prefetch('project', 5, 10, lambda frame: 0) is None
+
+
+def test_prefetch_budget(prefetcher):
+    rendered = []
+
+    def render(frame):
+        rendered.append(frame)
+        return prefetcher.max_bytes
+
+    wait(prefetcher.prefetch('project', 5, 10, render))
+
+    # Stops after rendering the budget
+    assert rendered == [6]
+    assert prefetcher.stats()['skipped'] == 3
+
+
+def test_prefetch_cancel(prefetcher):
+    started = threading.Event()
+    release = threading.Event()
+    rendered = []
+
+    def render_slowly(frame):
+        started.set()
+        release.wait(timeout=10)
+        rendered.append(frame)
+        return 1
+
+    def render(frame):
+        rendered.append(frame)
+        return 1
+
+    first_wave = prefetcher.prefetch('project', 5, 10, render_slowly)
+    started.wait(timeout=10)
+    # Jump elsewhere while the first frame of the first wave renders
+    second_wave = prefetcher.prefetch('project', 0, 10, render)
+    release.set()
+    wait(first_wave)
+    wait(second_wave)
+
+    assert first_wave.cancelled
+    # Only the frame that started before the jump is rendered from the first wave
+    assert rendered == [6, 1, 2]
+    assert prefetcher.stats()['cancelled'] == 3
+
+
+def test_prefetch_failure(prefetcher):
+    def render(frame):
+        raise ValueError('could not render')
+
+    wait(prefetcher.prefetch('project', 0, 2, render))
+    assert prefetcher.stats()['failed'] == 1
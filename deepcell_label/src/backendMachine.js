@@ -1,4 +1,5 @@
 import { Machine, sendParent } from 'xstate';
+import { fetchLabelArray } from './labelArray';
 
 /** Returns a Promise for a DeepCell Label API call based on the event. */
 function getApiService(context, event) {
@@ -62,11 +63,22 @@ function toggleRGB(context, event) {
 function fetchErrorWrapper(url, options) {
   return fetch(url, options).then(response => {
     return response.json().then(json => {
-      return response.ok ? json : Promise.reject(json);
+      return response.ok ? loadSegArray(json) : Promise.reject(json);
     });
   });
 }
 
+/** Fetches the binary label array linked in a payload and adds it as seg_arr. */
+function loadSegArray(payload) {
+  if (!payload.imgs || !payload.imgs.seg_arr_url) {
+    return payload;
+  }
+  return fetchLabelArray(payload.imgs.seg_arr_url).then(segArray => {
+    payload.imgs.seg_arr = segArray;
+    return payload;
+  });
+}
+
 const backendMachine = Machine(
   {
     id: 'backend',
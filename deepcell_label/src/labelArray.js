@@ -0,0 +1,111 @@
+// Magic bytes at the start of arrays encoded by deepcell_label/compression.py
+const MAGIC = [68, 67, 76, 1]; // 'DCL\x01'
+// Codec ids in the header, from compression.CODECS
+const RAW = 1;
+const ZLIB = 2;
+const RLE = 4;
+
+/** Whether the browser can decompress zlib encoded arrays. */
+const canInflate = typeof DecompressionStream !== 'undefined';
+
+/**
+ * Decompresses zlib data with the browser's built-in DecompressionStream.
+ * @param {ArrayBuffer} data zlib compressed bytes
+ * @returns {Promise<ArrayBuffer>} decompressed bytes
+ */
+function inflate(data) {
+  const stream = new Blob([data]).stream().pipeThrough(new DecompressionStream('deflate'));
+  return new Response(stream).arrayBuffer();
+}
+
+/**
+ * Expands run-length encoded labels: the number of runs,
+ * then the label of each run as int16 and the length of each run as uint32.
+ * @param {ArrayBuffer} data run-length encoded labels
+ * @returns {ArrayBuffer} labels for every pixel
+ */
+function expandRuns(data) {
+  const view = new DataView(data);
+  const numRuns = Number(view.getBigUint64(0, true));
+  const valuesOffset = 8;
+  const lengthsOffset = valuesOffset + 2 * numRuns;
+  let size = 0;
+  for (let i = 0; i < numRuns; i++) {
+    size += view.getUint32(lengthsOffset + 4 * i, true);
+  }
+  const labels = new Int16Array(size);
+  let start = 0;
+  for (let i = 0; i < numRuns; i++) {
+    const value = view.getInt16(valuesOffset + 2 * i, true);
+    const end = start + view.getUint32(lengthsOffset + 4 * i, true);
+    labels.fill(value, start, end);
+    start = end;
+  }
+  return labels.buffer;
+}
+
+/**
+ * Decodes an outlined label array sent by /api/labelarray.
+ * @param {ArrayBuffer} buffer array with a codec, dtype, and shape header
+ * @returns {Promise<Array<Int16Array>>} rows of labels, indexed like array[y][x]
+ */
+export function decodeLabelArray(buffer) {
+  const view = new DataView(buffer);
+  for (let i = 0; i < MAGIC.length; i++) {
+    if (view.getUint8(i) !== MAGIC[i]) {
+      return Promise.reject(new Error('Unrecognized label array header'));
+    }
+  }
+  const codec = view.getUint8(4);
+  const dtypeLength = view.getUint8(5);
+  const ndim = view.getUint8(6);
+  const dtype = new TextDecoder().decode(new Uint8Array(buffer, 7, dtypeLength));
+  if (dtype !== '<i2' || ndim !== 2) {
+    return Promise.reject(
+      new Error(`Unsupported label array with dtype ${dtype} and ${ndim} dimensions`));
+  }
+  let offset = 7 + dtypeLength;
+  const shape = [];
+  for (let i = 0; i < ndim; i++) {
+    shape.push(Number(view.getBigInt64(offset, true)));
+    offset += 8;
+  }
+  const data = buffer.slice(offset);
+  let decoded;
+  if (codec === RAW) {
+    decoded = Promise.resolve(data);
+  } else if (codec === ZLIB) {
+    decoded = inflate(data);
+  } else if (codec === RLE) {
+    decoded = Promise.resolve(expandRuns(data));
+  } else {
+    return Promise.reject(new Error(`Unsupported label array codec ${codec}`));
+  }
+  return decoded.then(data => {
+    const [height, width] = shape;
+    const labels = new Int16Array(data);
+    const rows = [];
+    for (let y = 0; y < height; y++) {
+      rows.push(labels.subarray(y * width, (y + 1) * width));
+    }
+    return rows;
+  });
+}
+
+/**
+ * Fetches an outlined label array, compressed with zlib when the browser can decompress it
+ * and run-length encoded otherwise.
+ * @param {string} url URL of the label array from a payload
+ * @returns {Promise<Array<Int16Array>>} rows of labels, indexed like array[y][x]
+ */
+export function fetchLabelArray(url) {
+  const encoding = canInflate ? 'zlib' : 'rle';
+  return fetch(`${document.location.origin}${url}?encoding=${encoding}`)
+    .then(response => {
+      if (!response.ok) {
+        return Promise.reject({ error: `Could not load label array (${response.status})` });
+      }
+      return response.arrayBuffer();
+    })
+    .then(decodeLabelArray);
+}
@@ -231,6 +231,30 @@ export class Model {
     if (payload.tracks) {
       this.tracks = payload.tracks;
     }
+    if (payload.changedTracks) {
+      this.tracks = this.mergeTracks(payload.changedTracks);
+    }
+  }
+
+  /**
+   * Copies the tracks with the tracks of changed labels from a payload.
+   * @param {Object} changedTracks tracks of the changed labels by feature, null for removed labels
+   * @returns {Object} updated tracks
+   */
+  mergeTracks(changedTracks) {
+    const tracks = { ...this.tracks };
+    for (const [feature, labels] of Object.entries(changedTracks)) {
+      const featureTracks = { ...tracks[feature] };
+      for (const [label, track] of Object.entries(labels)) {
+        if (track === null) {
+          delete featureTracks[label];
+        } else {
+          featureTracks[label] = track;
+        }
+      }
+      tracks[feature] = featureTracks;
+    }
+    return tracks;
   }
 
   updateMousePos(x, y) {
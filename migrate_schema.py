@@ -0,0 +1,146 @@
+"""
+Add the columns and indexes of the current models to the tables of an existing database.
+
+db.create_all creates missing tables, like labeltiles, but does not change existing tables,
+so every query on a table with new columns fails on databases created by older versions.
+Run this script once on such a database before starting the application.
+Columns and indexes that already exist are skipped, so the script can be run again safely.
+
+Unfortunately, because the models cannot query tables that are missing their columns,
+the schema changes and backfills must be executed in raw SQL.
+The column types are compiled from the models so they match the tables made by db.create_all.
+
+Columns added to existing tables:
+
+- labelframes.tile_size: null for frames stored as a single blob in the frame column
+- labelframes.version: 0 for existing frames
+- framemementos.indices, before, and after: null for mementos that store the whole frame,
+  which are read as keyframes
+- rawframes.frame_key: null for frames stored in the frame column instead of a frame store
+- projects.raw_checksum: null for existing projects, computed when their raw stack is first cached
+- actions.labels_delta: null for existing actions, which are undone and redone with
+  the Labels rows pickled in actions.labels
+- actions.frame_id: filled in with the first label frame each existing action edited
+
+Indexes added to existing tables:
+
+- ix_framemementos_frame_action: finds the versions of a frame in order
+
+Usage:
+    python migrate_schema.py
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import logging
+
+from flask.logging import default_handler
+import sqlalchemy
+
+from deepcell_label import create_app
+from deepcell_label import models
+
+
+# Columns added to existing tables, in the order to add them
+COLUMNS = [
+    ('labelframes', 'tile_size'),
+    ('labelframes', 'version'),
+    ('framemementos', 'indices'),
+    ('framemementos', 'before'),
+    ('framemementos', 'after'),
+    ('rawframes', 'frame_key'),
+    ('projects', 'raw_checksum'),
+    ('actions', 'labels_delta'),
+    ('actions', 'frame_id'),
+]
+
+# Indexes added to existing tables
+INDEXES = [
+    ('framemementos', 'ix_framemementos_frame_action'),
+]
+
+# Statements that fill in the new columns of existing rows
+BACKFILLS = [
+    'UPDATE labelframes SET version = 0 WHERE version IS NULL',
+    # Actions that edited no label frames keep a null frame,
+    # and Project.action_frames falls back to the displayed frame for them
+    'UPDATE actions SET frame_id = ('
+    'SELECT MIN(framemementos.frame_id) FROM framemementos '
+    'WHERE framemementos.project_id = actions.project_id '
+    'AND framemementos.action_id = actions.action_id) '
+    'WHERE frame_id IS NULL',
+]
+
+
+def initialize_logger():
+    """Set up logger format and level"""
+    formatter = logging.Formatter(
+        '[%(asctime)s]:[%(levelname)s]:[%(name)s]: %(message)s')
+
+    default_handler.setFormatter(formatter)
+    default_handler.setLevel(logging.DEBUG)
+
+    logger = logging.getLogger()
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(default_handler)
+
+
+def add_column(engine, table, name):
+    """
+    Adds a column of a model to its table, with the scalar default of the model as the default.
+
+    Returns:
+        bool: whether the column was added
+    """
+    existing = {column['name'] for column in sqlalchemy.inspect(engine).get_columns(table)}
+    if name in existing:
+        return False
+    column = models.db.metadata.tables[table].c[name]
+    # Quotes reserved words like "before" on MySQL
+    preparer = engine.dialect.identifier_preparer
+    statement = 'ALTER TABLE {} ADD COLUMN {} {}'.format(
+        preparer.format_table(column.table), preparer.format_column(column),
+        column.type.compile(dialect=engine.dialect))
+    if column.default is not None and column.default.is_scalar:
+        statement += ' DEFAULT {}'.format(column.default.arg)
+    engine.execute(statement)
+    return True
+
+
+def add_index(engine, table, name):
+    """
+    Creates an index of a model on its table.
+
+    Returns:
+        bool: whether the index was created
+    """
+    existing = {index['name'] for index in sqlalchemy.inspect(engine).get_indexes(table)}
+    if name in existing:
+        return False
+    index = next(index for index in models.db.metadata.tables[table].indexes
+                 if index.name == name)
+    index.create(bind=engine)
+    return True
+
+
+def migrate(engine):
+    """Adds the missing columns and indexes and fills in the columns for existing rows."""
+    for table, name in COLUMNS:
+        if add_column(engine, table, name):
+            print('added column', name, 'to', table)
+    for table, name in INDEXES:
+        if add_index(engine, table, name):
+            print('added index', name, 'to', table)
+    for statement in BACKFILLS:
+        result = engine.execute(statement)
+        print(statement, '-', result.rowcount, 'rows')
+
+
+# still creating the application to initialize the database connection
+application = create_app()  # pylint: disable=C0103
+
+
+if __name__ == '__main__':
+    initialize_logger()
+    migrate(models.db.engine)